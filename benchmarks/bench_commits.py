@@ -0,0 +1,80 @@
+"""
+Count the commits and time the writes of DreamDAO.create and DreamDAO.update
+(including updates that change nothing)
+
+Every dream is written with 10 tags and a dream type, half of them new. The
+database is created in a temporary XDG_DATA_HOME so the user journal is never
+touched.
+
+usage: PYTHONPATH=. python benchmarks/bench_commits.py [nbdreams]
+"""
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+os.environ['XDG_DATA_HOME'] = tempfile.mkdtemp(prefix='dreamdtb-bench')
+
+from sqlalchemy import event  # noqa: E402
+
+from dream_dtb.engine import Engine  # noqa: E402
+from dream_dtb.db import DreamDAO  # noqa: E402
+
+NBDREAMS = 200
+NBTAGS = 10
+
+
+class Counter:
+
+    def __init__(self):
+        self.commits = 0
+        self.statements = 0
+
+    def on_commit(self, conn):
+        self.commits += 1
+
+    def on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements += 1
+
+
+def instance(i):
+    return {'title': f'dream {i}',
+            'recit': 'lorem ipsum dolor sit amet ' * 40,
+            'date': datetime.date(2017, 1, 1) + datetime.timedelta(days=i),
+            'tags': [f'tag {(i * NBTAGS // 2 + j)}' for j in range(NBTAGS)],
+            'drtype': ('normal', 'lucid')[i % 2]}
+
+
+def measure(name, func, nbcalls):
+    counter = Counter()
+    event.listen(Engine, 'commit', counter.on_commit)
+    event.listen(Engine, 'before_cursor_execute', counter.on_execute)
+    start = time.perf_counter()
+    for i in range(nbcalls):
+        func(i)
+    elapsed = time.perf_counter() - start
+    event.remove(Engine, 'commit', counter.on_commit)
+    event.remove(Engine, 'before_cursor_execute', counter.on_execute)
+    print(f'{name:>8}: {counter.commits / nbcalls:.1f} commit(s)/call, '
+          f'{counter.statements / nbcalls:.1f} statements/call, '
+          f'{elapsed / nbcalls * 1000:.2f} ms/call')
+    return counter
+
+
+def main(nbdreams):
+    ids = []
+    measure('create', lambda i: ids.append(DreamDAO.create(instance(i))), nbdreams)
+
+    def update(i):
+        new = instance(i + 1)
+        new['title'] = f'dream {i}'
+        new['date'] = instance(i)['date']
+        DreamDAO.update(ids[i], new)
+    measure('update', update, nbdreams)
+    # writing the same values again must not touch the database
+    measure('no-op', update, nbdreams)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if sys.argv[1:] else NBDREAMS)
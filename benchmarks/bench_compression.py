@@ -0,0 +1,158 @@
+"""
+Storage of the dreams body as text or compressed
+
+A journal of generated prose is imported in two temporary databases, one
+with [storage] compress = no and one with compress = yes, and each database
+is measured in a child process:
+
+- size: size of the database file
+- tree: latency of listing the dreams of a month (the navigation tree) and
+  hit rate of the sqlite page cache while doing it, with a 2MB cache and
+  without memory mapping
+- read: latency of reading the body of a dream
+- write: latency of updating the body of a dream (one transaction each)
+
+The page cache counters are read with sqlite3_db_status through ctypes,
+they are reported as n/a if the sqlite module does not allow it.
+
+usage: PYTHONPATH=. python benchmarks/bench_compression.py [number of dreams]
+
+Run from the root of the repository: dream_dtb is not installed by the
+benchmarks, it is found through PYTHONPATH, also by the child processes.
+"""
+import ctypes
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+WORDS = """the a and i was in of to my it that we were on with he she they
+there had at but as for into from then all out like dream remember house
+could room someone back around running water door looking night mother
+friend old felt something very through car street suddenly trying school
+flying sky city strange people again big dark light window tree sea walking
+lucid realized dreaming would when up down over under about saw told asked
+know think wanted began stairs floor wall voice hand face eyes long small
+red blue green white black""".split()
+
+# word frequencies roughly follow Zipf's law
+CUM_WEIGHTS = [sum(1 / rank for rank in range(1, n + 2)) for n in range(len(WORDS))]
+MONTHS = 200
+READS = 2000
+WRITES = 200
+# sqlite3_db_status operations
+CACHE_HIT, CACHE_MISS = 7, 8
+
+
+def sentence(rng):
+    words = rng.choices(WORDS, cum_weights=CUM_WEIGHTS, k=rng.randint(6, 18))
+    return ' '.join(words).capitalize() + '.'
+
+
+def body(rng):
+    return '\n\n'.join(' '.join(sentence(rng) for _ in range(rng.randint(2, 6)))
+                       for _ in range(rng.randint(1, 6)))
+
+
+def cache_counters(conn):
+    """ Return (hits, misses) of the page cache of a sqlite3 connection and
+    reset them, None if they cannot be read
+    """
+    try:
+        import _sqlite3
+        lib = ctypes.CDLL(_sqlite3.__file__)
+        status = lib.sqlite3_db_status
+    except (OSError, AttributeError):
+        return None
+    status.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.POINTER(ctypes.c_int),
+                       ctypes.POINTER(ctypes.c_int), ctypes.c_int]
+    # the sqlite3 handle follows the object header of the connection
+    handle = ctypes.c_void_p.from_address(id(conn) + 2 * ctypes.sizeof(ctypes.c_void_p)).value
+    values = []
+    for op in (CACHE_HIT, CACHE_MISS):
+        current, highwater = ctypes.c_int(), ctypes.c_int()
+        if status(handle, op, ctypes.byref(current), ctypes.byref(highwater), 1):
+            return None
+        values.append(current.value)
+    return tuple(values)
+
+
+def child(count):
+    """ Import and measure the journal, print the results as json """
+    from dream_dtb import compression
+    from dream_dtb.db import Engine
+    from dream_dtb.importer import Importer
+
+    rng = random.Random(0)
+    first = datetime.date(2000, 1, 1)
+    Importer().run({'title': f'dream {i}',
+                    'date': first + datetime.timedelta(days=i * 30 * MONTHS // count),
+                    'recit': body(rng),
+                    'tags': [], 'drtype': 'normal'}
+                   for i in range(count))
+    # train the dictionary as on the next start
+    compression.convert(Engine)
+
+    raw = Engine.raw_connection()
+    conn = raw.connection
+    # memory mapped pages would bypass the page cache
+    conn.execute('PRAGMA mmap_size = 0')
+    conn.execute('PRAGMA cache_size = -2000')
+    conn.execute('VACUUM')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    results = {'size': os.path.getsize(Engine.url.database)}
+
+    cache_counters(conn)
+    start = time.perf_counter()
+    for _ in range(MONTHS):
+        since = first + datetime.timedelta(days=30 * rng.randrange(MONTHS))
+        conn.execute('SELECT id, title FROM dream WHERE date BETWEEN ? AND ? '
+                     'ORDER BY date, created', (since, since + datetime.timedelta(days=30))).fetchall()
+    results['tree'] = (time.perf_counter() - start) / MONTHS
+    counters = cache_counters(conn)
+    results['hit_rate'] = counters[0] / max(sum(counters), 1) if counters else None
+
+    ids = [rng.randint(1, count) for _ in range(READS)]
+    start = time.perf_counter()
+    for idnum in ids:
+        conn.execute('SELECT inflate(recit) FROM dream WHERE id = ?', (idnum,)).fetchone()
+    results['read'] = (time.perf_counter() - start) / READS
+
+    start = time.perf_counter()
+    for _ in range(WRITES):
+        with conn:
+            conn.execute('UPDATE dream SET recit = ? WHERE id = ?',
+                         (compression.encode(body(rng)), rng.randint(1, count)))
+    results['write'] = (time.perf_counter() - start) / WRITES
+    raw.close()
+    print(json.dumps(results))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print(f'{count} dreams')
+    print(f"{'compress':<9} {'size':>9} {'tree':>9} {'hit rate':>9} {'read':>9} {'write':>9}")
+    for compress in ('no', 'yes'):
+        env = dict(os.environ,
+                   XDG_DATA_HOME=tempfile.mkdtemp(prefix='dreamdtb-bench'),
+                   XDG_CONFIG_HOME=tempfile.mkdtemp(prefix='dreamdtb-bench'))
+        os.makedirs(os.path.join(env['XDG_CONFIG_HOME'], 'dreamdtb'))
+        with open(os.path.join(env['XDG_CONFIG_HOME'], 'dreamdtb', 'dreamrc'), 'w') as rc:
+            rc.write(f'[storage]\ncompress = {compress}\n')
+        output = subprocess.run([sys.executable, __file__, '--child', str(count)], env=env,
+                                check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+        res = json.loads(output.splitlines()[-1])
+        hit_rate = f"{res['hit_rate']:.1%}" if res['hit_rate'] is not None else 'n/a'
+        print(f"{compress:<9} {res['size'] / 2**20:>7.1f}MB {res['tree'] * 1e3:>7.2f}ms "
+              f"{hit_rate:>9} {res['read'] * 1e6:>7.0f}us {res['write'] * 1e3:>7.2f}ms")
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        child(int(sys.argv[2]))
+    else:
+        main()
@@ -0,0 +1,63 @@
+"""
+Latency of the cached DAO reads
+
+Opens random dreams of a temporary journal the way the gui does (find_by_id
+then the labels of the dialog) with a skewed access pattern, and reports the
+mean latency and the hit ratio of the query cache for several cache sizes.
+
+usage: PYTHONPATH=. python benchmarks/bench_query_cache.py [number of dreams]
+"""
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+os.environ['XDG_DATA_HOME'] = tempfile.mkdtemp(prefix='dreamdtb-bench')
+
+from dream_dtb.db import DreamDAO  # noqa: E402
+from dream_dtb.db import TagDAO  # noqa: E402
+from dream_dtb.db import DreamTypeDAO  # noqa: E402
+from dream_dtb.db import cache  # noqa: E402
+from dream_dtb.importer import Importer  # noqa: E402
+
+LOOKUPS = 5000
+
+
+def populate(count):
+    first = datetime.date(2000, 1, 1)
+    Importer().run({'title': f'dream {i}',
+                    'date': first + datetime.timedelta(days=i // 2),
+                    'recit': 'flying over the sea ' * 50,
+                    'tags': [f'tag{i % 7}', f'tag{i % 11}'],
+                    'drtype': 'lucid' if i % 3 else 'normal'}
+                   for i in range(count))
+
+
+def run(count, size):
+    cache.size = size
+    cache.invalidate()
+    cache.hits = cache.misses = 0
+    rand = random.Random(0)
+    start = time.perf_counter()
+    for _ in range(LOOKUPS):
+        # most reads go to a few recent dreams
+        DreamDAO.find_by_id(count - int(rand.paretovariate(1.2)) % count)
+        TagDAO.get_labels()
+        DreamTypeDAO.get_labels()
+    elapsed = time.perf_counter() - start
+    stats = cache.stats()
+    print(f"size {size:>5}  {elapsed / LOOKUPS * 1e6:>8.0f} us/open  "
+          f"hit ratio {stats['hit_ratio']:.1%}")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    populate(count)
+    for size in (0, 16, 64, 256, 1024):
+        run(count, size)
+
+
+if __name__ == '__main__':
+    main()
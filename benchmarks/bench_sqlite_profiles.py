@@ -0,0 +1,80 @@
+"""
+Compare the write and read throughput of the sqlite tuning profiles
+(config.SQLITE_PROFILES)
+
+For each profile a fresh database is created in a temporary directory and
+filled with one transaction per dream, as DreamDAO.create does. Reads fetch
+random dreams by id and build the navigation tree.
+
+usage: PYTHONPATH=. python benchmarks/bench_sqlite_profiles.py [nbdreams]
+"""
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+os.environ['XDG_DATA_HOME'] = tempfile.mkdtemp(prefix='dreamdtb-bench')
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+from sqlalchemy import select  # noqa: E402
+
+from dream_dtb import config  # noqa: E402
+from dream_dtb.engine import Base  # noqa: E402
+from dream_dtb.engine import set_sqlite_pragmas  # noqa: E402
+from dream_dtb.db import Dream  # noqa: E402
+
+NBDREAMS = 2000
+NBREADS = 5000
+RECIT = 'lorem ipsum dolor sit amet ' * 80
+
+
+def make_engine(directory, pragmas):
+    engine = create_engine('sqlite:///{}'.format(os.path.join(directory, 'dream.db')))
+    event.listen(engine, 'connect',
+                 lambda dbapi_connection, record: set_sqlite_pragmas(dbapi_connection, pragmas))
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def bench_writes(engine, nbdreams):
+    table = Dream.__table__
+    now = datetime.datetime.utcnow()
+    start = time.perf_counter()
+    for i in range(nbdreams):
+        with engine.begin() as conn:
+            conn.execute(table.insert(), {'title': f'dream {i}',
+                                          'recit': RECIT,
+                                          'date': datetime.date(2000, 1, 1) + datetime.timedelta(days=i),
+                                          'created': now,
+                                          'updated': now})
+    return nbdreams / (time.perf_counter() - start)
+
+
+def bench_reads(engine, nbdreams):
+    table = Dream.__table__
+    query = select([table]).where(table.c.id == 0)
+    ids = [random.randint(1, nbdreams) for _ in range(NBREADS)]
+    start = time.perf_counter()
+    with engine.connect() as conn:
+        for idnum in ids:
+            conn.execute(query.where(table.c.id == idnum)).first()
+        tree = select([table.c.date, table.c.id, table.c.title]).order_by(table.c.date, table.c.created)
+        conn.execute(tree).fetchall()
+    return NBREADS / (time.perf_counter() - start)
+
+
+def main(nbdreams):
+    print(f'{"profile":>10} {"writes/s":>10} {"reads/s":>10}')
+    for profile, pragmas in config.SQLITE_PROFILES.items():
+        engine = make_engine(tempfile.mkdtemp(prefix=f'dreamdtb-{profile}'), pragmas)
+        writes = bench_writes(engine, nbdreams)
+        reads = bench_reads(engine, nbdreams)
+        engine.dispose()
+        print(f'{profile:>10} {writes:>10.0f} {reads:>10.0f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if sys.argv[1:] else NBDREAMS)
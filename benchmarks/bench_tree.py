@@ -0,0 +1,79 @@
+"""
+Benchmark DreamDAO.get_tree, and DreamDAO.get_years (the first level of the
+lazy tree), on journals of increasing size
+
+The database is created in a temporary XDG_DATA_HOME so the user journal is
+never touched. Every SELECT issued while building the tree is checked: the
+benchmark fails if the dream body (recit) is ever selected.
+
+usage: PYTHONPATH=. python benchmarks/bench_tree.py [nbrows ...]
+"""
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+os.environ['XDG_DATA_HOME'] = tempfile.mkdtemp(prefix='dreamdtb-bench')
+
+from sqlalchemy import event  # noqa: E402
+
+from dream_dtb.engine import Engine  # noqa: E402
+from dream_dtb.db import Dream  # noqa: E402
+from dream_dtb.db import DreamDAO  # noqa: E402
+
+SIZES = [1000, 10000, 100000, 1000000]
+RECIT = 'lorem ipsum dolor sit amet ' * 40
+BATCH = 10000
+
+
+def populate(start, stop):
+    """ Insert dreams [start, stop) spread over one dream per ~8 hours """
+    first = datetime.date(1990, 1, 1)
+    now = datetime.datetime.utcnow()
+    with Engine.begin() as conn:
+        for offset in range(start, stop, BATCH):
+            rows = [{'title': f'dream {i}',
+                     'recit': RECIT,
+                     'date': first + datetime.timedelta(days=i // 3),
+                     'created': now,
+                     'updated': now}
+                    for i in range(offset, min(offset + BATCH, stop))]
+            conn.execute(Dream.__table__.insert(), rows)
+
+
+def check_statement(conn, cursor, statement, parameters, context, executemany):
+    if statement.lstrip().upper().startswith('SELECT') and 'recit' in statement:
+        raise AssertionError(f'dream body selected: {statement}')
+
+
+def main(sizes):
+    event.listen(Engine, 'before_cursor_execute', check_statement)
+    print(f'{"rows":>10} {"seconds":>10} {"us/row":>10} {"years ms":>10}')
+    nbrows = 0
+    for size in sorted(sizes):
+        event.remove(Engine, 'before_cursor_execute', check_statement)
+        populate(nbrows, size)
+        event.listen(Engine, 'before_cursor_execute', check_statement)
+        nbrows = size
+
+        start = time.perf_counter()
+        tree = DreamDAO.get_tree()
+        elapsed = time.perf_counter() - start
+
+        count = sum(len(dreams)
+                    for months in tree.values()
+                    for days in months.values()
+                    for dreams in days.values())
+        assert count == size, (count, size)
+
+        start = time.perf_counter()
+        years = DreamDAO.get_years()
+        years_elapsed = time.perf_counter() - start
+        assert sum(years.values()) == size, (years, size)
+        print(f'{size:>10} {elapsed:>10.3f} {elapsed / size * 1e6:>10.2f} '
+              f'{years_elapsed * 1e3:>10.2f}')
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or SIZES)
@@ -0,0 +1,318 @@
+"""
+Render the dream database as a book (html or pdf)
+
+The book is made of one section per year or per month. Sections are
+rendered in parallel by a process pool: each worker streams the dreams of its
+section from the database (see exporter.iter_dreams) and writes the rendered
+section to a temporary part file. The parts are then appended in date order
+to the output, so that neither the workers nor the main process ever hold
+more than a batch of dreams in memory.
+
+The pdf is written without any external library, using the standard Courier
+fonts that every pdf reader provides.
+"""
+import datetime
+import html
+import logging
+import os
+import shutil
+import struct
+import tempfile
+import textwrap
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from dream_dtb.db import DreamDAO
+from dream_dtb.engine import Engine
+from dream_dtb.exporter import iter_dreams
+
+logger = logging.getLogger('dream_logger')
+
+BOOK_FORMATS = ['html', 'pdf']
+SECTIONS = ['year', 'month']
+
+# html document around the sections
+HTML_HEAD = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ max-width: 42em; margin: auto; font-family: serif; line-height: 1.5; }}
+section > h1 {{ page-break-before: always; border-bottom: 1px solid; }}
+article {{ margin-bottom: 2em; }}
+.meta {{ color: #666; font-style: italic; }}
+</style>
+</head>
+<body>
+<h1>{title}</h1>
+"""
+HTML_TAIL = "</body>\n</html>\n"
+
+
+def guess_format(path):
+    """ Return the book format from the extension of path, default to pdf """
+    ext = os.path.splitext(path)[1].lower()
+    return 'html' if ext in ('.html', '.htm') else 'pdf'
+
+
+def sections(by='year', since=None, until=None):
+    """ Return the sections of the book in date order
+    Arguments:
+        - by (str): one of SECTIONS
+        - since, until (datetime.date): clip the sections to these dates
+    Return:
+        list((str, datetime.date, datetime.date)): heading, first and last
+        day of each section
+    """
+    result = []
+    for year in DreamDAO.get_years():
+        months = DreamDAO.get_months(year) if by == 'month' else [None]
+        for month in months:
+            start, end = DreamDAO._date_range(year, month)
+            end = end - datetime.timedelta(days=1)
+            if since is not None:
+                start = max(start, since)
+            if until is not None:
+                end = min(end, until)
+            if start <= end:
+                heading = year if month is None else f'{year}-{month}'
+                result.append((heading, start, end))
+    return result
+
+
+class Book:
+    """ Render dreams to a html or pdf book
+    Arguments:
+        - fmt (str): one of BOOK_FORMATS
+        - by (str): one of SECTIONS
+        - since, until (datetime.date): only dreams within these dates
+        - labels list(str): only dreams having at least one of these tags
+        - workers (int): number of rendering processes, default to the
+          number of cpus
+    """
+
+    def __init__(self, fmt='pdf', by='year', since=None, until=None, labels=None, workers=None):
+        if fmt not in BOOK_FORMATS:
+            raise ValueError(f'fmt must be one of {BOOK_FORMATS}')
+        if by not in SECTIONS:
+            raise ValueError(f'by must be one of {SECTIONS}')
+        self.fmt = fmt
+        self.by = by
+        self.since = since
+        self.until = until
+        self.labels = labels or []
+        self.workers = workers or os.cpu_count()
+
+    def write(self, path, title='Dream journal'):
+        """ Render the book to path. Return the number of sections. """
+        parts = sections(self.by, self.since, self.until)
+        with tempfile.TemporaryDirectory(prefix='dreamdtb-book-') as tmpdir:
+            jobs = [(self.fmt, heading, start, end, self.labels,
+                     os.path.join(tmpdir, f'{index:05d}.part'))
+                    for index, (heading, start, end) in enumerate(parts)]
+            count = 0
+            with ProcessPoolExecutor(self.workers, initializer=_init_worker) as executor:
+                # results come back in section order while later sections
+                # are still being rendered
+                rendered = executor.map(render_section, jobs)
+                with open(path, 'wb') as stream:
+                    writer = HtmlWriter(stream, title) if self.fmt == 'html' else PdfWriter(stream)
+                    for part, dreams in rendered:
+                        if dreams:
+                            writer.append(part)
+                            count += 1
+                        os.remove(part)
+                    writer.close()
+        logger.info(f'book: {count} sections written to {path}')
+        return count
+
+
+def _init_worker():
+    # connections inherited from the parent process must not be shared
+    Engine.dispose()
+
+
+def render_section(job):
+    """ Render the dreams of a section to a part file, run by the workers
+    Arguments:
+        - job (tuple): fmt, heading, first day, last day, tag labels and path
+          of the part file
+    Return:
+        (str, int): path of the part file and number of dreams rendered, a
+        section without dreams is left empty
+    """
+    fmt, heading, start, end, labels, path = job
+    render = _render_html if fmt == 'html' else _render_pdf
+    with open(path, 'wb') as stream:
+        count = render(stream, heading, iter_dreams(start, end, labels))
+    return path, count
+
+
+def _render_html(stream, heading, dreams):
+    count = 0
+    for count, dream in enumerate(dreams, 1):
+        if count == 1:
+            stream.write(f'<section>\n<h1>{html.escape(heading)}</h1>\n'.encode())
+        meta = ' · '.join(filter(None, [dream['date'].isoformat(),
+                                        dream['drtype'],
+                                        ', '.join(dream['tags'])]))
+        paragraphs = ''.join(f'<p>{html.escape(par)}</p>\n'
+                             for par in (dream['recit'] or '').split('\n\n') if par.strip())
+        stream.write((f'<article>\n<h2>{html.escape(dream["title"])}</h2>\n'
+                      f'<p class="meta">{html.escape(meta)}</p>\n'
+                      f'{paragraphs}</article>\n').encode())
+    if count:
+        stream.write(b'</section>\n')
+    return count
+
+
+class HtmlWriter:
+    """ Concatenate html part files into a document """
+
+    def __init__(self, stream, title):
+        self.stream = stream
+        self.stream.write(HTML_HEAD.format(title=html.escape(title)).encode())
+
+    def append(self, part):
+        with open(part, 'rb') as source:
+            shutil.copyfileobj(source, self.stream)
+
+    def close(self):
+        self.stream.write(HTML_TAIL.encode())
+
+
+# A4 page in points, Courier glyphs are 0.6 em wide
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+MARGIN = 56
+FONTS = {'body': ('F1', 10), 'meta': ('F1', 9), 'title': ('F2', 12), 'heading': ('F2', 20)}
+FONT_NAMES = {'F1': 'Courier', 'F2': 'Courier-Bold'}
+
+
+def _render_pdf(stream, heading, dreams):
+    layout = PdfLayout(stream)
+    count = 0
+    for count, dream in enumerate(dreams, 1):
+        if count == 1:
+            layout.line(heading, 'heading')
+            layout.skip()
+        layout.keep(4)
+        layout.line(dream['title'], 'title')
+        layout.line(' - '.join(filter(None, [dream['date'].isoformat(),
+                                             dream['drtype'],
+                                             ', '.join(dream['tags'])])), 'meta')
+        layout.skip()
+        for line in (dream['recit'] or '').split('\n'):
+            layout.line(line, 'body')
+        layout.skip()
+    layout.close()
+    return count
+
+
+class PdfLayout:
+    """ Lay out lines of text on pages and write each page content stream,
+    compressed and length prefixed, to a part file
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.ops = []
+        self.y = PAGE_HEIGHT - MARGIN
+
+    def line(self, text, style):
+        """ Write text wrapped to the page width """
+        font, size = FONTS[style]
+        width = int((PAGE_WIDTH - 2 * MARGIN) / (0.6 * size))
+        for chunk in textwrap.wrap(text, width) or ['']:
+            if self.y - size < MARGIN:
+                self.page()
+            self.y -= size * 1.3
+            self.ops.append(f'BT /{font} {size} Tf {MARGIN} {self.y:.1f} Td ('.encode()
+                            + _pdf_string(chunk) + b') Tj ET')
+
+    def skip(self):
+        """ Add an empty line, unless at the top of a page """
+        if self.ops:
+            self.y -= FONTS['body'][1] * 1.3
+
+    def keep(self, lines):
+        """ Start a new page if the next lines would not fit in this one """
+        if self.y - lines * FONTS['body'][1] * 1.3 < MARGIN:
+            self.page()
+
+    def page(self):
+        if self.ops:
+            content = zlib.compress(b'\n'.join(self.ops))
+            self.stream.write(struct.pack('>I', len(content)))
+            self.stream.write(content)
+        self.ops = []
+        self.y = PAGE_HEIGHT - MARGIN
+
+    def close(self):
+        self.page()
+
+
+def _pdf_string(text):
+    """ Return text as the bytes of a pdf literal string """
+    data = text.encode('cp1252', errors='replace')
+    return data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+class PdfWriter:
+    """ Assemble the pages of pdf part files into a document. Pages are
+    copied one at a time, only the object offsets are kept in memory.
+    """
+
+    # objects written first: catalog, page tree and the two fonts
+    CATALOG, PAGES, FIRST_FONT = 1, 2, 3
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.offsets = {}
+        self.pages = []
+        self.next_id = self.FIRST_FONT + len(FONT_NAMES)
+        self.stream.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        self._object(self.CATALOG, f'<< /Type /Catalog /Pages {self.PAGES} 0 R >>'.encode())
+        for index, name in enumerate(FONT_NAMES.values()):
+            self._object(self.FIRST_FONT + index,
+                         (f'<< /Type /Font /Subtype /Type1 /BaseFont /{name} '
+                          '/Encoding /WinAnsiEncoding >>').encode())
+
+    def append(self, part):
+        with open(part, 'rb') as source:
+            while True:
+                header = source.read(4)
+                if not header:
+                    break
+                self._page(source.read(struct.unpack('>I', header)[0]))
+
+    def close(self):
+        if not self.pages:
+            # a pdf needs at least one page
+            self._page(zlib.compress(b''))
+        kids = ' '.join(f'{page} 0 R' for page in self.pages)
+        self._object(self.PAGES, f'<< /Type /Pages /Kids [{kids}] /Count {len(self.pages)} >>'.encode())
+        xref = self.stream.tell()
+        size = self.next_id
+        self.stream.write(f'xref\n0 {size}\n0000000000 65535 f \n'.encode())
+        for objid in range(1, size):
+            self.stream.write(f'{self.offsets[objid]:010d} 00000 n \n'.encode())
+        self.stream.write(f'trailer\n<< /Size {size} /Root {self.CATALOG} 0 R >>\n'
+                          f'startxref\n{xref}\n%%EOF\n'.encode())
+
+    def _page(self, content):
+        fonts = ' '.join(f'/{font} {self.FIRST_FONT + index} 0 R'
+                         for index, font in enumerate(FONT_NAMES))
+        contents, page = self.next_id, self.next_id + 1
+        self.next_id += 2
+        self._object(contents, f'<< /Length {len(content)} /Filter /FlateDecode >>\nstream\n'.encode()
+                     + content + b'\nendstream')
+        self._object(page, (f'<< /Type /Page /Parent {self.PAGES} 0 R '
+                            f'/MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] '
+                            f'/Resources << /Font << {fonts} >> >> '
+                            f'/Contents {contents} 0 R >>').encode())
+        self.pages.append(page)
+
+    def _object(self, objid, body):
+        self.offsets[objid] = self.stream.tell()
+        self.stream.write(f'{objid} 0 obj\n'.encode() + body + b'\nendobj\n')
@@ -0,0 +1,241 @@
+"""
+Dreams open in the editor and their saving to the database
+
+Buffer tracks the dreams edited in nvim and whether they differ from the
+database, AutoSaver saves them in the background once the edits settle.
+Neither depends on Gtk or nvim.
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from dream_dtb.db import DreamDAO
+
+logger = logging.getLogger('dream_logger')
+
+
+def fingerprint(instance):
+    """ Return a hash of the fields of a dream saved to the database. The
+    tags are compared as a set and the date as a string, so that the
+    fingerprints of a dream loaded from the database and of the same dream
+    edited in the gui are equal.
+    """
+    fields = (instance.get('title') or '',
+              str(instance.get('date') or ''),
+              instance.get('drtype') or '',
+              '\x1f'.join(sorted(set(instance.get('tags') or []))),
+              instance.get('recit') or '')
+    return hashlib.blake2b('\x1e'.join(fields).encode('utf-8'), digest_size=16).digest()
+
+
+class Buffer():
+    """ class representing a list of currently edited buffers (id, tags, dream
+    type, title, recit, date) whether one of the field have been modified or
+    not.  If the dream is not already present in the database id is None.
+
+    Dreams are edited in nvim scratch buffers named BUF_PREFIX<number>, their
+    text never touches the disk.
+
+    bufs is ordered from the least to the most recently used buffer. At most
+    limit buffers are meant to be open, see lru.
+
+    Each buffer keeps the fingerprint of the dream as last saved to the
+    database (None for a new dream), a buffer is only modified when its
+    fingerprint differs. While a save is in flight, the buffer is compared to
+    the fingerprint being saved instead, and once the save is done to the
+    dream actually saved: a buffer reverted meanwhile stays modified.
+    """
+
+    BUF_PREFIX = 'dreamdtb://'
+
+    def __init__(self, limit=0):
+        """
+        Arguments:
+            - limit (int): maximum number of open buffers, 0 for no limit
+        """
+        self.bufs = OrderedDict()
+        # bufname of the dreams stored in the database {id: bufname}
+        self.ids = {}
+        self.limit = limit
+        self.count = 0
+        # writes to the database avoided because the dream was unchanged
+        self.skipped = 0
+        # buffers are modified from the nvim loop and saved by the autosave
+        # thread
+        self.lock = threading.Lock()
+
+    def add(self, instance):
+        """ add a buffer to the bufs stack and return its name """
+        # TODO: check if the (date, title) does already exists in database +
+        # bufs. If it does open the corresponding dream. otherwise create a new
+        # one.
+        with self.lock:
+            self.count += 1
+            bufname = f'{self.BUF_PREFIX}{self.count}'
+            saved = fingerprint(instance) if instance.get('id') is not None else None
+            self.bufs[bufname] = {'modified': False,
+                                  'saved': saved,
+                                  # fingerprint of the save in flight
+                                  'saving': None,
+                                  'instance': instance}
+            if instance.get('id') is not None:
+                self.ids[instance['id']] = bufname
+        return bufname
+
+    def touch(self, bufname):
+        """ Mark bufname as the most recently used buffer """
+        with self.lock:
+            if bufname in self.bufs:
+                self.bufs.move_to_end(bufname)
+
+    def lru(self, keep=None):
+        """ Return the least recently used buffers to close to get back to
+        the limit, other than keep
+        """
+        with self.lock:
+            excess = len(self.bufs) - self.limit
+            if not self.limit or excess <= 0:
+                return []
+            return [name for name in self.bufs if name != keep][:excess]
+
+    def modify(self, bufname, instance):
+        """ modify a buffer
+        Arguments:
+            - bufname (str): name of the buffer
+            - instance (dict): {'title': title,
+                                'date': date,
+                                'recit': recit,
+                                'tags': tags,
+                                'drtype': drtype}
+        """
+        with self.lock:
+            buf = self.bufs[bufname]
+            for key in instance:
+                buf['instance'][key] = instance[key]
+            persisted = buf['saved'] if buf['saving'] is None else buf['saving']
+            modified = fingerprint(buf['instance']) != persisted
+            if not modified and not buf['modified']:
+                self.skipped += 1
+            buf['modified'] = modified
+
+    def save(self, bufname):
+        """ Save a buffer to the database """
+        self.save_all([bufname])
+
+    def get_ids(self):
+        """ Return the ids of the dreams open in a buffer """
+        return self.ids.keys()
+
+    def get_bufname(self, idnum):
+        """ Return buffername which correspond to idnum """
+        return self.ids.get(idnum)
+
+    def save_all(self, bufnames=None):
+        """ Save the modified buffers to the database in one transaction
+        Arguments:
+            - bufnames (iterable): buffers to save, default to all
+        """
+        # TODO: if buf['instance']['recit'] == '', should I discard writing to
+        # database an empty dream ? or maybe remove the dream from the database
+        # if it already exists
+        with self.lock:
+            # buffers may have been removed since they were scheduled
+            names = [name for name in (bufnames or list(self.bufs))
+                     if name in self.bufs and self.bufs[name]['modified']]
+            # a copy is saved, the buffers may be modified meanwhile
+            instances = [dict(self.bufs[name]['instance']) for name in names]
+            for name, instance in zip(names, instances):
+                self.bufs[name]['modified'] = False
+                self.bufs[name]['saving'] = fingerprint(instance)
+        if not names:
+            return
+
+        logger.info(f'save: {", ".join(names)}')
+        # None: not saved
+        ids = [None] * len(names)
+        try:
+            ids = DreamDAO.save_batch(instances)
+        finally:
+            with self.lock:
+                for name, idnum in zip(names, ids):
+                    buf = self.bufs.get(name)
+                    if buf is None:
+                        continue
+                    if idnum is not None:
+                        buf['instance']['id'] = idnum
+                        buf['saved'] = buf['saving']
+                        self.ids[idnum] = name
+                    buf['saving'] = None
+                    # the buffer may have been edited during the save
+                    buf['modified'] = fingerprint(buf['instance']) != buf['saved']
+
+    def remove(self, bufname):
+        """ Remove a buffer from the buffer stack. Return the dream of the
+        buffer if it still has to be saved, None otherwise.
+        """
+        with self.lock:
+            buf = self.bufs.pop(bufname, None)
+            if buf is None:
+                return None
+            if self.ids.get(buf['instance'].get('id')) == bufname:
+                del self.ids[buf['instance']['id']]
+            return buf['instance'] if buf['modified'] else None
+
+
+class AutoSaver():
+    """ Background thread saving the modified buffers once none of them
+    has been modified for delay seconds. A buffer modified several times
+    meanwhile is saved once, all the buffers in one transaction.
+    Arguments:
+        - save (callable): receives the set of buffer names to save
+        - delay (float): idle time in seconds
+    """
+
+    def __init__(self, save, delay):
+        self.save = save
+        self.delay = delay
+        self.pending = set()
+        self.deadline = None
+        self.stopping = False
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name='dreamdtb-autosave', daemon=True)
+        self.thread.start()
+
+    def schedule(self, bufname):
+        """ Save bufname after the idle delay """
+        with self.cond:
+            self.pending.add(bufname)
+            self.deadline = time.monotonic() + self.delay
+            self.cond.notify()
+
+    def stop(self):
+        """ Save the buffers left and stop the thread, if not done yet """
+        if not self.thread.is_alive():
+            return
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+        logger.info("waiting for autosave to finish...")
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.stopping:
+                    timeout = None
+                    if self.pending:
+                        timeout = self.deadline - time.monotonic()
+                        if timeout <= 0:
+                            break
+                    self.cond.wait(timeout)
+                bufnames, self.pending = self.pending, set()
+                stopping = self.stopping
+            if bufnames:
+                try:
+                    self.save(bufnames)
+                except Exception:
+                    logger.exception("autosave failed")
+            if stopping:
+                return
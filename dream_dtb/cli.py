@@ -3,13 +3,10 @@ from datetime import datetime
 from click_default_group import DefaultGroup
 from click_datetime import Datetime
 import logging
-import logging.config
 
 
-from dream_dtb.gui import Controller
 from dream_dtb import config
 
-logging.config.dictConfig(config.LOGGING)
 logger = logging.getLogger('dream_logger')
 
 
@@ -17,6 +14,8 @@ def launch_gui(instance=None):
     """ wrapper to launch the main gtk window
     if instance is not None, nvim will start with a dream open
     """
+    # gtk, vte and neovim are only imported by the commands that need them
+    from dream_dtb.gui import Controller
     app = Controller(instance)
     app.RunGui()
 
@@ -26,9 +25,14 @@ CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 
 
 @click.group(context_settings=CONTEXT_SETTINGS, cls=DefaultGroup, default='launch', default_if_no_args=True)
-def main():
+@click.pass_context
+def main(ctx):
     """Dream note gui """
-    pass
+    # logging.config imports the logging handlers and their dependencies,
+    # which help does not need
+    if ctx.invoked_subcommand != 'help':
+        import logging.config
+        logging.config.dictConfig(config.LOGGING)
 
 
 @click.command(context_settings=CONTEXT_SETTINGS)
@@ -52,21 +56,270 @@ def add(**kwargs):
 
 
 @click.command(context_settings=CONTEXT_SETTINGS)
+@click.option('--host', type=str, default='127.0.0.1',
+              help='address to listen on, default to 127.0.0.1')
+@click.option('--port', '-p', type=int, default=8080,
+              help='port to listen on, default to 8080')
+@click.option('--connections', type=int, default=4,
+              help='number of read-only database connections, default to 4')
+@click.option('--open', 'open_browser', is_flag=True, default=False,
+              help='open the dreams in the web browser')
 def browse(**kwargs):
-    """ browse dream database """
-    print("browse dreams in web navigator")
+    """ browse dream database in a web browser """
+    from dream_dtb import web
+
+    logger.info('browse command')
+    if kwargs['open_browser']:
+        import webbrowser
+        webbrowser.open(f"http://{kwargs['host']}:{kwargs['port']}/")
+    web.serve(kwargs['host'], kwargs['port'], kwargs['connections'])
 
 
 @click.command(context_settings=CONTEXT_SETTINGS)
+@click.option('--format', 'fmt', type=click.Choice(['pdf', 'html']), default=None,
+              help='book format, guessed from the output extension by default')
+@click.option('--by', type=click.Choice(['year', 'month']), default='year',
+              help='one section per year or per month, default to year')
+@click.option('--since', type=Datetime(format='%Y-%m-%d'), default=None,
+              help='only dreams from this date YYYY-MM-DD')
+@click.option('--until', type=Datetime(format='%Y-%m-%d'), default=None,
+              help='only dreams up to this date YYYY-MM-DD')
+@click.option('--tags', '-t', type=str, default=None, multiple=True,
+              help='only dreams with one of these tags. Can be specified multiple times')
+@click.option('--workers', '-j', type=int, default=None,
+              help='number of rendering processes, default to the number of cpus')
+@click.argument('output', type=click.Path(dir_okay=False, writable=True), default='dreams.pdf')
 def book(**kwargs):
-    """ create a pdf from the dream database """
-    print("pdf created")
+    """ create a pdf (or html) book from the dream database """
+    import time
+    from dream_dtb.book import Book
+    from dream_dtb.book import guess_format
+
+    logger.info('book command')
+    output = kwargs['output']
+    book = Book(fmt=kwargs['fmt'] or guess_format(output),
+                by=kwargs['by'],
+                since=kwargs['since'].date() if kwargs['since'] else None,
+                until=kwargs['until'].date() if kwargs['until'] else None,
+                labels=list(kwargs['tags']),
+                workers=kwargs['workers'])
+    start = time.perf_counter()
+    count = book.write(output)
+    click.echo(f'{output}: {count} sections in {time.perf_counter() - start:.1f}s')
 
 
 @click.command(context_settings=CONTEXT_SETTINGS)
+@click.option('--session', '-s', type=int, default=-1,
+              help='session to report, counted from the oldest (0) or the latest (-1), default to -1')
+@click.option('--nested', is_flag=True, default=False,
+              help='also report the calls made by other database calls')
+@click.argument('trace', type=click.Path(exists=True, dir_okay=False), default=config.TRACE_PATH)
+def profile(**kwargs):
+    """ Report the database calls recorded in the trace file (enabled by
+    trace = yes in the [profile] section of dreamrc)
+    """
+    from dream_dtb import instrument
+
+    sessions = instrument.read_sessions(kwargs['trace'])
+    try:
+        session = sessions[kwargs['session']]
+    except IndexError:
+        raise click.ClickException(f"no session {kwargs['session']}, {len(sessions)} sessions recorded")
+    started = datetime.fromtimestamp(session['session']['time'])
+    command = ' '.join(session['session']['argv']) or 'launch'
+    click.echo(f"session {sessions.index(session)} of {len(sessions)}: "
+               f"dreamdtb {command} ({started:%Y-%m-%d %H:%M:%S})\n")
+
+    summary = instrument.report(session['records'], kwargs['nested'])
+    if not summary:
+        click.echo('no database call recorded')
+    width = max([len(name) for name in summary] + [4])
+    click.echo(f"{'call':<{width}}  {'calls':>6}  {'total ms':>9}  {'p50':>7}  {'p95':>7}  "
+               f"{'max':>7}  {'sql/call':>8}  {'sql ms':>8}")
+    for name, stats in summary.items():
+        click.echo(f"{name:<{width}}  {stats['calls']:>6}  {stats['total']:>9.1f}  "
+                   f"{stats['p50']:>7.2f}  {stats['p95']:>7.2f}  {stats['max']:>7.2f}  "
+                   f"{stats['statements']:>8.1f}  {stats['sql']:>8.1f}")
+
+    # one column per bucket, the height of a bar is relative to its row
+    bars = ' \u2581\u2582\u2583\u2584\u2585\u2586\u2587\u2588'
+    labels = [f'{bound:g}' for bound in instrument.BUCKETS[:-1]] + ['inf']
+    if summary:
+        click.echo(f"\nlatency histograms (ms, upper bounds: {' '.join(labels)})")
+    for name, stats in summary.items():
+        top = max(stats['histogram'])
+        row = ''.join(bars[-(-count * (len(bars) - 1) // top)] for count in stats['histogram'])
+        click.echo(f"{name:<{width}}  |{row}|")
+
+    slow = [record for record in session['records'] if record['type'] == 'slow']
+    if slow:
+        click.echo(f"\n{len(slow)} slow queries, the slowest:")
+        for record in sorted(slow, key=lambda record: -record['ms'])[:5]:
+            where = f" in {record['name']}" if record['name'] else ''
+            click.echo(f"  {record['ms']:.1f}ms{where}: {' '.join(record['sql'].split())}")
+            for detail in record['plan']:
+                click.echo(f"      {detail}")
+
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@click.option('--json', 'as_json', is_flag=True, default=False,
+              help='output the statistics as json')
 def stat(**kwargs):
     """ output some statistics about the dream database """
-    print("output stats")
+    from dream_dtb.db import StatDAO
+
+    logger.info('stat command')
+    stats = StatDAO.get_stats()
+    if kwargs['as_json']:
+        import json
+        click.echo(json.dumps(stats, indent=2))
+        return
+
+    click.echo(f"{stats['dreams']} dreams from {stats['first']} to {stats['last']}")
+    click.echo(f"lucid ratio: {stats['lucid_ratio']:.1%}")
+    words = stats['words']
+    click.echo(f"words: {words['total']} (mean {words['mean']}, max {words['max']})")
+    for name, streak in stats['streaks'].items():
+        dates = f" ({streak['start']} to {streak['end']})" if streak['days'] else ''
+        click.echo(f"{name} streak: {streak['days']} days{dates}")
+    for section in ('years', 'months', 'weekdays', 'types', 'tags'):
+        if stats[section]:
+            click.echo(f"\n{section}:")
+            width = max(len(key) for key in stats[section])
+            for key, count in stats[section].items():
+                click.echo(f"  {key:<{width}}  {count}")
+
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@click.argument('idnum', type=int)
+@click.argument('revision', type=int, required=False)
+def history(**kwargs):
+    """ List the revisions of the text of a dream, or print one of them """
+    from dream_dtb.db import RevisionDAO
+
+    logger.info('history command')
+    idnum, number = kwargs['idnum'], kwargs['revision']
+    if number is not None:
+        recit = RevisionDAO.get(idnum, number)
+        if recit is None:
+            raise click.ClickException(f'dream {idnum} has no revision {number}')
+        click.echo(recit, nl=False)
+        return
+
+    revisions = RevisionDAO.history(idnum)
+    if not revisions:
+        click.echo(f'dream {idnum} has never been modified')
+    for revision in revisions:
+        kind = 'snapshot' if revision['snapshot'] else 'delta'
+        click.echo(f"{revision['number']:>4}  {revision['created']:%Y-%m-%d %H:%M:%S}  "
+                   f"{kind:<8}  {revision['size']} bytes")
+
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@click.argument('idnum', type=int)
+@click.argument('revision', type=int)
+def restore(**kwargs):
+    """ Restore the text of a dream as of a revision (see history) """
+    from dream_dtb.db import RevisionDAO
+
+    logger.info('restore command')
+    idnum, number = kwargs['idnum'], kwargs['revision']
+    modified = RevisionDAO.restore(idnum, number)
+    if modified is None:
+        raise click.ClickException(f'dream {idnum} has no revision {number}')
+    if modified:
+        click.echo(f'dream {idnum} restored to revision {number}')
+    else:
+        click.echo(f'dream {idnum} is already at revision {number}')
+
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@click.option('--limit', '-n', type=int, default=20,
+              help='maximum number of results, default to 20')
+@click.option('--raw', is_flag=True, default=False,
+              help='use the sqlite FTS5 query syntax (AND, OR, NOT, prefix*, ...)')
+@click.argument('query', nargs=-1, required=True)
+def search(**kwargs):
+    """ Search dreams by title and text """
+    from dream_dtb.db import DreamDAO
+    query = ' '.join(kwargs['query'])
+    try:
+        results = DreamDAO.search(query, kwargs['limit'], kwargs['raw'],
+                                  start=click.style('', bold=True, reset=False),
+                                  end=click.style('', reset=True))
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    for result in results:
+        click.echo(f"{result['date']} [{result['id']}] {result['title']}")
+        click.echo(f"    {result['snippet']}")
+
+
+@click.command('import', context_settings=CONTEXT_SETTINGS)
+@click.option('--format', 'fmt', type=click.Choice(['jsonl', 'csv', 'markdown']),
+              default=None, help='input format, guessed from the file extension by default')
+@click.option('--on-duplicate', type=click.Choice(['skip', 'update', 'fail']),
+              default='skip',
+              help='what to do with a dream whose title and date already exist, default to skip')
+@click.option('--batch-size', type=int, default=5000,
+              help='number of dreams written per transaction, default to 5000')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True))
+def import_(**kwargs):
+    """ Import dreams from jsonl, csv or markdown files (or directories of
+    markdown files)
+    """
+    import time
+    from itertools import chain
+    from dream_dtb import formats
+    from dream_dtb.importer import Importer, DuplicateError
+
+    logger.info('import command')
+    importer = Importer(kwargs['on_duplicate'], kwargs['batch_size'])
+    instances = chain.from_iterable(formats.read(path, kwargs['fmt'])
+                                    for path in kwargs['paths'])
+    start = time.perf_counter()
+    try:
+        counts = importer.run(instances)
+    except (formats.FormatError, DuplicateError) as error:
+        raise click.ClickException(f'{error} (imported so far: {dict(importer.counts)})')
+    elapsed = time.perf_counter() - start
+
+    total = sum(counts.values())
+    click.echo(f"{counts['created']} created, {counts['updated']} updated, "
+               f"{counts['unchanged']} unchanged, {counts['skipped']} skipped in {elapsed:.1f}s "
+               f"({total / max(elapsed, 1e-6):.0f} dreams/s)")
+
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@click.option('--format', 'fmt', type=click.Choice(['jsonl', 'csv', 'markdown']),
+              default='jsonl', help='output format, default to jsonl')
+@click.option('--output', '-o', type=click.Path(), default=None,
+              help='output file (a directory for markdown: one file per dream), default to stdout')
+@click.option('--since', type=Datetime(format='%Y-%m-%d'), default=None,
+              help='only dreams from this date YYYY-MM-DD')
+@click.option('--until', type=Datetime(format='%Y-%m-%d'), default=None,
+              help='only dreams up to this date YYYY-MM-DD')
+@click.option('--tags', '-t', type=str, default=None, multiple=True,
+              help='only dreams with one of these tags. Can be specified multiple times')
+def export(**kwargs):
+    """ Export dreams to jsonl, csv or markdown """
+    from dream_dtb import formats
+    from dream_dtb.exporter import iter_dreams
+
+    logger.info('export command')
+    since = kwargs['since'].date() if kwargs['since'] else None
+    until = kwargs['until'].date() if kwargs['until'] else None
+    instances = iter_dreams(since, until, list(kwargs['tags']))
+
+    output = kwargs['output']
+    if output is None:
+        formats.write(click.get_text_stream('stdout'), instances, kwargs['fmt'])
+    elif kwargs['fmt'] == 'markdown':
+        count = formats.write_markdown_files(output, instances)
+        logger.info(f'{count} dreams exported to {output}')
+    else:
+        newline = '' if kwargs['fmt'] == 'csv' else None
+        with open(output, 'w', encoding='utf-8', newline=newline) as stream:
+            formats.write(stream, instances, kwargs['fmt'])
 
 
 @click.command(context_settings=CONTEXT_SETTINGS)
@@ -87,7 +340,13 @@ main.add_command(add)
 main.add_command(browse)
 main.add_command(book)
 main.add_command(launch)
+main.add_command(profile)
 main.add_command(stat)
+main.add_command(search)
+main.add_command(import_)
+main.add_command(export)
+main.add_command(history)
+main.add_command(restore)
 main.add_command(help)
 
 
@@ -0,0 +1,328 @@
+"""
+Optional compression of the dreams body at rest
+
+When enabled ([storage] compress = yes in dreamrc), the bodies are stored
+as blobs: a 2 bytes big-endian dictionary id followed by a raw deflate
+stream compressed with that dictionary (0 meaning no dictionary). Plain text
+bodies are left as text values, so both kinds can be mixed in the dream
+table and the option can be switched at any time: convert brings the
+existing bodies to the configured storage, by batches, and records it in
+the setting table ('text' or 'zlib:<dictionary id>'). The configured storage
+is also written to a file next to the database once reached, so that the
+next starts only query the database when the setting changed.
+
+The dictionaries are trained on the bodies of the journal (see train) and
+stored in the zdict table. They are never modified, the latest one is used
+to compress.
+
+CompressedText decodes the bodies read through SQLAlchemy. sql statements
+reading the bodies directly (the full text index triggers, the dream_text
+view, the web server) use the inflate function that register adds to every
+sqlite connection.
+
+The full text index reads the bodies through the dream_text view and its
+triggers. While the bodies are compressed, they decode them with inflate;
+convert switches them when the storage changes (see _index_triggers).
+
+The dictionaries are looked up in the database of the connection given to
+register, or of the engine given to convert. CompressedText, having no
+connection at hand, uses the database of the application engine (see
+bind).
+"""
+import functools
+import logging
+import os
+import sqlite3
+import struct
+import threading
+import zlib
+from collections import Counter
+
+from sqlalchemy import Text
+from sqlalchemy.types import TypeDecorator
+
+from dream_dtb import config
+
+logger = logging.getLogger('dream_logger')
+
+HEADER = struct.Struct('>H')
+LEVEL = 6
+# zlib only uses the last 32K of a dictionary
+DICTIONARY_SIZE = 32 * 1024
+# number of dreams needed to train a dictionary, and bodies sampled to train
+# it
+TRAIN_MIN = 200
+SAMPLE_SIZE = 1000
+# bodies converted per transaction
+BATCH_SIZE = 2000
+
+# dictionaries by database path and id, loaded on first use
+_dictionaries = {}
+# id of the dictionary used to compress by database path, looked up on
+# first use
+_current = {}
+_lock = threading.Lock()
+# database of the bodies handled by CompressedText, see bind
+_database = None
+
+
+def bind(path):
+    """ Set the database whose dictionaries CompressedText and encode use
+    by default
+    Arguments:
+        - path (str): database file of the application engine
+    """
+    global _database
+    _database = path
+
+
+def _fetch(path, query, params=()):
+    """ Run a query on a short-lived read-only connection to the database
+    file path
+    """
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        return conn.execute(query, params).fetchone()
+    finally:
+        conn.close()
+
+
+def _dictionary(dict_id, path=None):
+    """ Return the dictionary whose id is dict_id in the database path, the
+    bound one by default
+    """
+    path = path or _database
+    with _lock:
+        dictionaries = _dictionaries.setdefault(path, {0: b''})
+        if dict_id not in dictionaries:
+            row = _fetch(path, 'SELECT data FROM zdict WHERE id = ?', (dict_id,))
+            if row is None:
+                raise ValueError(f'unknown compression dictionary {dict_id} in {path}')
+            dictionaries[dict_id] = row[0]
+        return dictionaries[dict_id]
+
+
+def _current_dictionary(path=None):
+    """ Return (id, data) of the dictionary used to compress in the
+    database path, the bound one by default
+    """
+    path = path or _database
+    if path not in _current:
+        row = _fetch(path, 'SELECT MAX(id) FROM zdict')
+        _current[path] = row[0] or 0
+    return _current[path], _dictionary(_current[path], path)
+
+
+def deflate(text, dict_id=None, zdict=None, path=None):
+    """ Compress text with a dictionary, the current one of the database
+    path by default
+    """
+    if text is None:
+        return None
+    if zdict is None:
+        dict_id, zdict = _current_dictionary(path)
+    compressor = zlib.compressobj(LEVEL, zlib.DEFLATED, -15, zdict=zdict) if zdict else \
+        zlib.compressobj(LEVEL, zlib.DEFLATED, -15)
+    data = compressor.compress(text.encode('utf-8')) + compressor.flush()
+    return HEADER.pack(dict_id) + data
+
+
+def inflate(value, path=None):
+    """ Return the text of a body as stored in the database path (the bound
+    one by default), compressed or not
+    """
+    if value is None or isinstance(value, str):
+        return value
+    dict_id, = HEADER.unpack_from(value)
+    zdict = _dictionary(dict_id, path)
+    decompressor = zlib.decompressobj(-15, zdict=zdict) if zdict else zlib.decompressobj(-15)
+    return (decompressor.decompress(value[HEADER.size:]) + decompressor.flush()).decode('utf-8')
+
+
+def encode(text, path=None):
+    """ Return the value stored for the body text in the database path (the
+    bound one by default), following the configuration
+    """
+    return deflate(text, path=path) if config.COMPRESS_BODIES else text
+
+
+class CompressedText(TypeDecorator):
+    """ Text column stored compressed when the compression is enabled """
+
+    impl = Text
+
+    def process_bind_param(self, value, dialect):
+        return encode(value)
+
+    def process_result_value(self, value, dialect):
+        return inflate(value)
+
+
+def register(dbapi_connection, path):
+    """ Add the inflate sql function to a sqlite connection
+    Arguments:
+        - dbapi_connection (sqlite3.Connection)
+        - path (str): database file of the connection, where the dictionaries
+          are looked up
+    """
+    dbapi_connection.create_function('inflate', 1, functools.partial(inflate, path=path),
+                                     deterministic=True)
+
+
+def train(bodies, size=DICTIONARY_SIZE):
+    """ Return a compression dictionary of at most size bytes made of the
+    words and the sequences of 2 and 3 words found in the most bodies. The
+    most useful ones are put at the end of the dictionary, where they are
+    the cheapest to refer to.
+    """
+    counts = Counter()
+    for body in bodies:
+        words = body.split()
+        grams = set()
+        for length in (1, 2, 3):
+            for start in range(len(words) - length + 1):
+                grams.add(' '.join(words[start:start + length]) + ' ')
+        counts.update(grams)
+
+    # bytes saved by a sequence: its length for every body but the first
+    scored = sorted(((count - 1) * len(gram.encode('utf-8')), gram)
+                    for gram, count in counts.items() if count > 1)
+    chosen, total = [], 0
+    for score, gram in reversed(scored):
+        length = len(gram.encode('utf-8'))
+        if total + length <= size:
+            chosen.append(gram)
+            total += length
+    return ''.join(reversed(chosen)).encode('utf-8')
+
+
+def convert(engine):
+    """ Bring the bodies stored in the database of engine to the configured
+    storage, by batches of BATCH_SIZE dreams committed one at a time. When
+    compressing, a dictionary is trained once the journal has TRAIN_MIN
+    dreams, the bodies compressed without it are then compressed again.
+
+    Nothing is read from the database when the storage file next to it
+    tells that the configured storage is already reached.
+    Return:
+        int: number of bodies converted
+    """
+    configured = 'zlib' if config.COMPRESS_BODIES else 'text'
+    stamp = f'{engine.url.database}-storage'
+    try:
+        with open(stamp, encoding='utf-8') as stream:
+            if stream.read() == configured:
+                return 0
+    except OSError:
+        pass
+
+    raw = engine.raw_connection()
+    try:
+        converted, wanted = _convert(raw.connection, engine.url.database)
+    finally:
+        raw.close()
+    if wanted == 'zlib:0':
+        # until a dictionary is trained, the size of the journal is checked
+        # on each start
+        if os.path.exists(stamp):
+            os.remove(stamp)
+    else:
+        with open(stamp, 'w', encoding='utf-8') as stream:
+            stream.write(configured)
+    return converted
+
+
+def _convert(conn, path):
+    """ Convert the bodies of the sqlite connection conn to the database
+    path, see convert
+    Return:
+        (int, str): number of bodies converted and storage reached
+    """
+    row = conn.execute("SELECT value FROM setting WHERE name = 'body_storage'").fetchone()
+    storage = row[0] if row else 'text'
+    if not config.COMPRESS_BODIES:
+        if storage == 'text':
+            return 0, storage
+        wanted, stale, header = 'text', "typeof(recit) = 'blob'", None
+    else:
+        dict_id, zdict = conn.execute('SELECT id, data FROM zdict ORDER BY id DESC').fetchone() or (0, b'')
+        if not dict_id and conn.execute('SELECT COUNT(*) FROM dream').fetchone()[0] >= TRAIN_MIN:
+            dict_id, zdict = _train(conn, path)
+        wanted = f'zlib:{dict_id}'
+        if storage == wanted:
+            return 0, storage
+        with _lock:
+            _dictionaries.setdefault(path, {0: b''})[dict_id] = zdict
+        _current[path] = dict_id
+        stale, header = "typeof(recit) = 'text' OR substr(recit, 1, 2) IS NOT ?", HEADER.pack(dict_id)
+        if storage == 'text':
+            with conn:
+                _index_triggers(conn, True)
+
+    logger.info(f"converting the dreams body to {wanted}")
+    converted = 0
+    low, high = conn.execute('SELECT MIN(id), MAX(id) FROM dream').fetchone()
+    for start in range(low or 0, (high or -1) + 1, BATCH_SIZE):
+        params = (start, start + BATCH_SIZE - 1) + ((header,) if header else ())
+        rows = conn.execute(f'SELECT id, recit FROM dream WHERE id BETWEEN ? AND ? '
+                            f'AND ({stale})', params).fetchall()
+        if header:
+            values = [(deflate(inflate(body, path), dict_id, zdict), idnum) for idnum, body in rows]
+        else:
+            values = [(inflate(body, path), idnum) for idnum, body in rows]
+        with conn:
+            conn.executemany('UPDATE dream SET recit = ? WHERE id = ?', values)
+        converted += len(values)
+        if high - low >= BATCH_SIZE:
+            logger.info(f"converted {converted} bodies")
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO setting (name, value) VALUES ('body_storage', ?)",
+                     (wanted,))
+        if wanted == 'text':
+            _index_triggers(conn, False)
+    return converted, wanted
+
+
+def _index_triggers(conn, compressed):
+    """ Create the dream_text view and the triggers keeping the full text
+    index in sync, replacing the existing ones. They only call the inflate
+    sql function when the bodies are compressed: a journal stored as text
+    stays writable from a plain sqlite connection.
+    """
+    recit = 'inflate({}.recit)' if compressed else '{}.recit'
+    new, old = recit.format('new'), recit.format('old')
+    for name in ('dream_fts_ai', 'dream_fts_ad', 'dream_fts_au'):
+        conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+    conn.execute('DROP VIEW IF EXISTS dream_text')
+    conn.execute(f"""CREATE VIEW dream_text AS
+        SELECT id, title, {recit.format('dream')} AS recit FROM dream""")
+    conn.execute(f"""CREATE TRIGGER dream_fts_ai AFTER INSERT ON dream BEGIN
+          INSERT INTO dream_fts(rowid, title, recit)
+          VALUES (new.id, new.title, {new});
+        END""")
+    conn.execute(f"""CREATE TRIGGER dream_fts_ad AFTER DELETE ON dream BEGIN
+          INSERT INTO dream_fts(dream_fts, rowid, title, recit)
+          VALUES ('delete', old.id, old.title, {old});
+        END""")
+    # a body only (de)compressed keeps its text, it is not indexed again
+    conn.execute(f"""CREATE TRIGGER dream_fts_au AFTER UPDATE OF title, recit ON dream
+        WHEN old.title IS NOT new.title OR {old} IS NOT {new} BEGIN
+          INSERT INTO dream_fts(dream_fts, rowid, title, recit)
+          VALUES ('delete', old.id, old.title, {old});
+          INSERT INTO dream_fts(rowid, title, recit)
+          VALUES (new.id, new.title, {new});
+        END""")
+
+
+def _train(conn, path):
+    """ Train a dictionary on a sample of the bodies and store it, return
+    its (id, data)
+    """
+    sample = [inflate(body, path) for body, in conn.execute(
+        'SELECT recit FROM dream WHERE recit IS NOT NULL ORDER BY random() LIMIT ?',
+        (SAMPLE_SIZE,))]
+    zdict = train(sample)
+    with conn:
+        dict_id = conn.execute('INSERT INTO zdict (data) VALUES (?)', (zdict,)).lastrowid
+    logger.info(f"compression dictionary {dict_id}: {len(zdict)} bytes")
+    return dict_id, zdict
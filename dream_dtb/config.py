@@ -1,7 +1,12 @@
+"""
+Paths and settings of dream-dtb
+
+The paths only depend on the environment. The settings read from the
+configuration file, and the names needing heavier modules (SOCK_NAME,
+IPC_PATH), are computed on first access by the module __getattr__, so that
+commands which do not use them (dreamdtb help) start faster.
+"""
 import os
-import tempfile
-from uuid import uuid4
-from gi.repository import GLib
 
 # script dir
 ROOT_DIR = os.path.dirname(os.path.realpath(__file__))
@@ -12,8 +17,8 @@ DB_NAME = 'dream.db'
 CF_NAME = 'dreamrc'
 # log file
 LOG_NAME = 'dream.log'
-# socket name for nvim rpc communication
-SOCK_NAME = f'nvim-{uuid4()}'
+# trace of the database calls
+TRACE_NAME = 'trace.jsonl'
 
 # directory to be included in nvim runtimepath variable that provide custom rpc
 # events
@@ -35,13 +40,162 @@ try:
 except KeyError:
     LOG_PATH = os.path.join(os.environ['HOME'], '.cache', 'dreamdtb', LOG_NAME)
 
-try:
-    IPC_PATH = os.path.join(os.environ['XDG_RUNTIME_DIR'], 'dreamdtb', SOCK_NAME)
-except KeyError:
-    IPC_PATH = os.path.join(GLib.get_tmp_dir(), 'dreamdtb', SOCK_NAME)
+TRACE_PATH = os.path.join(os.path.dirname(LOG_PATH), TRACE_NAME)
+
+
+# sqlite tuning profiles. Each entry is a pragma applied on every new
+# connection. 'safe' is the sqlite default behaviour.
+SQLITE_PROFILES = {
+    'safe': {
+        'journal_mode': 'delete',
+        'synchronous': 'full',
+        'cache_size': '-2000',
+        'mmap_size': '0',
+        'temp_store': 'default',
+        'busy_timeout': '5000',
+    },
+    'balanced': {
+        'journal_mode': 'wal',
+        'synchronous': 'normal',
+        'cache_size': '-16000',
+        'mmap_size': '268435456',
+        'temp_store': 'memory',
+        'busy_timeout': '5000',
+    },
+    'fast': {
+        'journal_mode': 'wal',
+        'synchronous': 'off',
+        'cache_size': '-64000',
+        'mmap_size': '1073741824',
+        'temp_store': 'memory',
+        'busy_timeout': '5000',
+    },
+}
+
+# default settings, overridden by the configuration file
+DEFAULTS = {
+    'sqlite': {
+        # one of SQLITE_PROFILES, any pragma of the profile can also be set
+        # in this section to override it
+        'profile': 'balanced',
+    },
+    'gui': {
+        # load the navigation tree one level at a time, when a node is
+        # expanded
+        'lazy_tree': 'yes',
+        # seconds without modification after which the modified dreams are
+        # written to the database
+        'autosave_delay': '2',
+        # number of dreams kept open in nvim, the least recently used ones
+        # are closed beyond it. 0 for no limit
+        'max_buffers': '20',
+    },
+    'storage': {
+        # store the body of the dreams compressed, the existing dreams are
+        # converted on the next start
+        'compress': 'no',
+    },
+    'profile': {
+        # append the duration and the number of sql statements of every
+        # database call to the trace file, see dreamdtb profile
+        'trace': 'no',
+        # sql statements slower than this number of milliseconds are logged
+        # with their query plan, 0 to disable. Empty: 100 if the trace is
+        # enabled, 0 otherwise
+        'slow_query': '',
+    },
+    'cache': {
+        # number of query results (dreams, label lists) kept in memory, 0
+        # disables the cache
+        'size': '256',
+    },
+}
+
+
+def load_config(path=CONF_PATH):
+    """ Read the configuration file (ini format) on top of DEFAULTS. A
+    missing file is not an error.
+    Arguments:
+        - path (str): path of the configuration file
+    Return:
+        configparser.ConfigParser
+    """
+    import configparser
+
+    settings = configparser.ConfigParser()
+    settings.read_dict(DEFAULTS)
+    settings.read(path)
+    return settings
+
+
+def sqlite_pragmas(settings):
+    """ Return the pragmas to apply on each sqlite connection as {name: value}
+    Arguments:
+        - settings (configparser.ConfigParser): see load_config
+    """
+    import re
+
+    section = settings['sqlite']
+    profile = section['profile']
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f'unknown sqlite profile in {CONF_PATH}: {profile}')
+
+    pragmas = dict(SQLITE_PROFILES[profile])
+    for name in pragmas:
+        if name in section:
+            pragmas[name] = section[name]
+
+    for name, value in pragmas.items():
+        if not re.fullmatch(r'-?\w+', value):
+            raise ValueError(f'invalid value for sqlite {name} in {CONF_PATH}: {value}')
+    return pragmas
+
+
+def _settings():
+    """ Return the settings derived from the configuration file by name """
+    settings = load_config()
+    trace = settings.getboolean('profile', 'trace')
+    slow_query = settings.get('profile', 'slow_query')
+    return {
+        'SETTINGS': settings,
+        'LAZY_TREE': settings.getboolean('gui', 'lazy_tree'),
+        'AUTOSAVE_DELAY': max(settings.getfloat('gui', 'autosave_delay'), 0),
+        'MAX_BUFFERS': max(settings.getint('gui', 'max_buffers'), 0),
+        'COMPRESS_BODIES': settings.getboolean('storage', 'compress'),
+        'PROFILE_TRACE': trace,
+        'SLOW_QUERY': (max(settings.getfloat('profile', 'slow_query'), 0)
+                       if slow_query else 100 if trace else 0),
+        'CACHE_SIZE': max(settings.getint('cache', 'size'), 0),
+    }
+
+
+def _ipc():
+    """ Return the socket name and path for nvim rpc communication """
+    import tempfile
+    from uuid import uuid4
+
+    sock_name = f'nvim-{uuid4()}'
+    try:
+        ipc_path = os.path.join(os.environ['XDG_RUNTIME_DIR'], 'dreamdtb', sock_name)
+    except KeyError:
+        ipc_path = os.path.join(tempfile.gettempdir(), 'dreamdtb', sock_name)
+    return {'SOCK_NAME': sock_name, 'IPC_PATH': ipc_path}
+
+
+# names computed on first access {name: function returning a dict of names}
+_LAZY = dict.fromkeys(['SETTINGS', 'LAZY_TREE', 'AUTOSAVE_DELAY', 'MAX_BUFFERS',
+                       'COMPRESS_BODIES', 'PROFILE_TRACE', 'SLOW_QUERY', 'CACHE_SIZE'],
+                      _settings)
+_LAZY.update(dict.fromkeys(['SOCK_NAME', 'IPC_PATH'], _ipc))
 
 
-BUF_PATH = tempfile.mkdtemp(prefix='dreamdtb')
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    # the next accesses find the names in the module globals
+    for key, value in _LAZY[name]().items():
+        globals().setdefault(key, value)
+    return globals()[name]
 
 LOGGING = {
     'version': 1,
@@ -65,11 +219,12 @@ LOGGING = {
             'backupCount': 1,
             'mode': 'a'
         },
+        # stdout is left to the output of the commands (export, stat --json)
         'console': {
             'level': 'DEBUG',
             'class': 'logging.StreamHandler',
             'formatter': 'simple',
-            'stream': 'ext://sys.stdout'
+            'stream': 'ext://sys.stderr'
         },
     },
     'loggers': {
@@ -1,30 +1,48 @@
+import copy
+import datetime
 import logging
 import os
 import pathlib
-import pandas as pd
-import numpy as np
+import sqlite3
+import threading
 
 from collections import OrderedDict
+from collections import namedtuple
+from sqlalchemy import Boolean
 from sqlalchemy import Column
+from sqlalchemy import LargeBinary
 from sqlalchemy import Text
 from sqlalchemy import Integer
 from sqlalchemy import String
 from sqlalchemy import DATE
+from sqlalchemy import DateTime
 from sqlalchemy import ForeignKey
+from sqlalchemy import Index
 from sqlalchemy import UniqueConstraint
 from sqlalchemy import Table
 from sqlalchemy.orm import backref
 from sqlalchemy.orm import relationship
-from sqlalchemy_utils import create_database
-from sqlalchemy_utils import database_exists
-from sqlalchemy_utils import Timestamp
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.exc import OperationalError
 from sqlalchemy import inspect
-
+from sqlalchemy import case
+from sqlalchemy import func
+from sqlalchemy import event
+from sqlalchemy import select
+from sqlalchemy import text
+
+from dream_dtb import compression
+from dream_dtb import config
+from dream_dtb import instrument
+from dream_dtb import revisions
+from dream_dtb.instrument import instrumented
 from dream_dtb.util import Singleton
 from dream_dtb.util import session_scope
-from dream_dtb import Base
-from dream_dtb import Engine
+from dream_dtb.engine import Base
+from dream_dtb.engine import Engine
+from dream_dtb.engine import Session
+from dream_dtb.migrations import SCHEMA_VERSION
+from dream_dtb.migrations import migrate
 
 logger = logging.getLogger('dream_logger')
 
@@ -33,6 +51,26 @@ def object_as_dict(obj):
             for c in inspect(obj).mapper.column_attrs}
 
 
+def word_count(recit):
+    """ Return the number of words of a dream body """
+    return len(recit.split()) if recit else 0
+
+
+def _upsert_labels(session, model, labels):
+    """ Insert the labels missing from the table of model (Tag or DreamType)
+    with a single INSERT OR IGNORE and return {label: id} for all labels
+    """
+    labels = set(labels)
+    if not labels:
+        return {}
+    table = model.__table__
+    session.execute(table.insert().prefix_with('OR IGNORE'),
+                    [{'label': label} for label in labels])
+    rows = session.execute(select([table.c.label, table.c.id])
+                           .where(table.c.label.in_(labels)))
+    return dict(rows.fetchall())
+
+
 class InitDb(metaclass=Singleton):
     """ A singleton class that initialize the database """
 
@@ -43,18 +81,45 @@ class InitDb(metaclass=Singleton):
         self.popDb()
 
     def createDb(self):
-        """ Create database if does not exists """
-        if not database_exists(self.engine.url):
+        """ Create database directory if does not exists, sqlite creates the
+        database file on first connection
+        """
+        if not os.path.exists(self.engine.url.database):
             logger.info("database does not exists")
             pathlib.Path(os.path.dirname(self.engine.url.database)).mkdir(parents=True,
                                                                           exist_ok=True)
-            create_database(self.engine.url)
         else:
             logger.info("database already exists")
 
     def popDb(self):
-        """ Generate tables """
-        self.base.metadata.create_all(self.engine)
+        """ Generate or upgrade the tables, see migrations. Convert the
+        bodies if the compression setting changed since the last conversion
+        (recorded next to the database, see compression.convert).
+        """
+        applied = migrate(self.engine)
+        if applied:
+            logger.info(f"database schema upgraded to version {SCHEMA_VERSION}")
+        converted = compression.convert(self.engine)
+        if converted:
+            logger.info(f"{converted} dream bodies converted")
+
+
+class Timestamp:
+    """ Mixin adding created and updated columns, updated being refreshed on
+    every update of the row (same columns as sqlalchemy_utils.Timestamp)
+    """
+
+    created = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+    updated = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+
+@event.listens_for(Timestamp, 'before_update', propagate=True)
+def timestamp_before_update(mapper, connection, target):
+    target.updated = datetime.datetime.utcnow()
+
+
+# The tables are created and upgraded by the migrations module: a change of
+# the models below needs a new migration.
 
 
 class Tag(Base):
@@ -73,28 +138,34 @@ class DreamType(Base):
         return "<DreamType(dream_type='{}')>".format(self.label)
 
 
+# The primary keys index the associations by dream, the reverse indexes by
+# tag and by dream type (Tag.dreams, DreamType.dreams, tag filters).
 tags = Table('tags', Base.metadata,
-             Column('dream_id', Integer, ForeignKey('dream.id')),
-             Column('tag_id', Integer, ForeignKey('tag.id'))
+             Column('dream_id', Integer, ForeignKey('dream.id'), primary_key=True),
+             Column('tag_id', Integer, ForeignKey('tag.id'), primary_key=True),
+             Index('ix_tags_tag_id', 'tag_id', 'dream_id')
              )
 
 drtype = Table('drtype', Base.metadata,
-               Column('dream_id', Integer, ForeignKey('dream.id')),
-               Column('type_id', Integer, ForeignKey('dreamtype.id'))
+               Column('dream_id', Integer, ForeignKey('dream.id'), primary_key=True),
+               Column('type_id', Integer, ForeignKey('dreamtype.id'), primary_key=True),
+               Index('ix_drtype_type_id', 'type_id', 'dream_id')
                )
 
 
 class Dream(Base, Timestamp):
 
     title = Column(String, nullable=False)
-    recit = Column(Text)
+    recit = Column(compression.CompressedText)
     date = Column(DATE, nullable=False)
     tags = relationship('Tag', secondary=tags,
                         backref=backref('dreams', lazy='dynamic'))
     drtype = relationship('DreamType', secondary=drtype,
                           backref=backref('dreams', lazy='dynamic'))
 
-    __table_args__ = (UniqueConstraint('title', 'date', name='_title_date_uc'),)
+    __table_args__ = (UniqueConstraint('title', 'date', name='_title_date_uc'),
+                      # order of the navigation tree and of the pagination
+                      Index('ix_dream_date_created', 'date', 'created'))
 
     def __repr__(self):
 
@@ -134,6 +205,225 @@ class Dream(Base, Timestamp):
             return ""
 
 
+class DreamStat(Base):
+    """ Metrics of a dream too expensive to compute in sql, kept up to date by
+    DreamDAO and the importer whenever a dream body is written. The id is the
+    id of the dream.
+    """
+
+    id = Column(Integer, ForeignKey('dream.id'), primary_key=True)
+    words = Column(Integer, nullable=False, default=0)
+
+
+class DreamCount(Base):
+    """ Number of dreams per value of a period (total, year, month, weekday,
+    tag or type id), and total number of words. The rows are maintained by
+    triggers in the transaction writing the dreams, see
+    migrations._dream_counts.
+    """
+
+    period = Column(String, nullable=False)
+    value = Column(String, nullable=False)
+    dreams = Column(Integer, nullable=False, default=0)
+    words = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (UniqueConstraint('period', 'value', name='_period_value_uc'),)
+
+
+class Revision(Base):
+    """ A version of the body of a dream, numbered from 1 for each dream.
+    data is a snapshot of the text or a delta against the previous revision,
+    see revisions.
+    """
+
+    dream_id = Column(Integer, ForeignKey('dream.id'), nullable=False)
+    number = Column(Integer, nullable=False)
+    created = Column(DateTime, nullable=False)
+    snapshot = Column(Boolean, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+
+    __table_args__ = (UniqueConstraint('dream_id', 'number', name='_dream_number_uc'),)
+
+
+# Full text index of the dreams title and body: dream_fts is an external
+# content FTS5 table (the text is only stored in the dream table) kept in
+# sync by triggers, see migrations.
+
+
+def fts_query(words):
+    """ Turn the words typed by the user into a FTS5 query matching the
+    dreams containing all of them. The last word is matched as a prefix so
+    that results show up while typing.
+    """
+    tokens = ['"{}"'.format(word.replace('"', '""')) for word in words.split()]
+    if tokens:
+        tokens[-1] += '*'
+    return ' '.join(tokens)
+
+
+# A change of the navigation tree produced by a committed transaction.
+# action is one of 'insert', 'update' or 'delete'. old_date is the date
+# before the change (None for an insert), date the date after the change
+# (None for a delete).
+TreeChange = namedtuple('TreeChange', ['action', 'id', 'title', 'old_date', 'date'])
+
+# callables receiving the list of TreeChange of each committed transaction
+tree_listeners = []
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_tree_changes(session, flush_context):
+    """ Record the changes of the dreams title and date made by a flush """
+    changes = session.info.setdefault('tree_changes', [])
+    for obj in session.new:
+        if isinstance(obj, Dream):
+            changes.append(TreeChange('insert', obj.id, obj.title, None, obj.date))
+    for obj in session.dirty:
+        if isinstance(obj, Dream):
+            attrs = inspect(obj).attrs
+            title, date = attrs.title.history, attrs.date.history
+            if title.has_changes() or date.has_changes():
+                old_date = date.deleted[0] if date.deleted else obj.date
+                changes.append(TreeChange('update', obj.id, obj.title, old_date, obj.date))
+    for obj in session.deleted:
+        if isinstance(obj, Dream):
+            changes.append(TreeChange('delete', obj.id, obj.title, obj.date, None))
+
+
+@event.listens_for(Session, 'after_commit')
+def _dispatch_tree_changes(session):
+    """ Send the changes recorded in the committed transaction to the tree
+    listeners
+    """
+    changes = session.info.pop('tree_changes', None)
+    if changes:
+        for listener in list(tree_listeners):
+            listener(changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_tree_changes(session):
+    session.info.pop('tree_changes', None)
+
+
+class QueryCache:
+    """ Bounded LRU cache of the results of read queries
+
+    Entries are dropped all at once when the database changes: when a
+    connection of the engine commits a transaction that wrote, and when
+    PRAGMA data_version, read on a dedicated connection, tells that another
+    process (or a connection outside of the engine) committed. Reading
+    data_version does not touch the tables, so the check is cheap enough to
+    be done on each lookup.
+
+    The cached values are copied on the way in and out, callers may modify
+    what they get.
+    """
+
+    def __init__(self, size, path):
+        """
+        Arguments:
+            - size (int): maximum number of entries, 0 disables the cache
+            - path (str): path of the sqlite database
+        """
+        self.size = size
+        self.path = path
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # incremented on each invalidation, a value loaded while the
+        # database changed is not stored
+        self.generation = 0
+        self.probe = None
+        self.probe_pid = None
+        self.data_version = None
+
+    def get(self, key, load):
+        """ Return the value cached for key, or load it with load() and cache
+        it. None is not cached.
+        """
+        if not self.size:
+            return load()
+        with self.lock:
+            self._check_data_version()
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(self.entries[key])
+            self.misses += 1
+            generation = self.generation
+
+        value = load()
+        if value is not None:
+            with self.lock:
+                if generation == self.generation:
+                    self.entries[key] = copy.deepcopy(value)
+                    self.entries.move_to_end(key)
+                    while len(self.entries) > self.size:
+                        self.entries.popitem(last=False)
+        return value
+
+    def invalidate(self):
+        """ Drop all the entries """
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1
+
+    def stats(self):
+        """ Return the counters of the cache as a dict """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'size': self.size,
+                    'entries': len(self.entries),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_ratio': self.hits / lookups if lookups else 0}
+
+    def _check_data_version(self):
+        """ Drop the entries if the database was modified by another
+        connection, the lock must be held
+        """
+        if self.probe is None or self.probe_pid != os.getpid():
+            # the connection of a parent process cannot be used after a fork
+            self.probe = sqlite3.connect(self.path, check_same_thread=False)
+            self.probe_pid = os.getpid()
+            self.data_version = None
+        version = self.probe.execute('PRAGMA data_version').fetchone()[0]
+        if version != self.data_version:
+            self.data_version = version
+            self.entries.clear()
+            self.generation += 1
+
+
+cache = QueryCache(config.CACHE_SIZE, Engine.url.database)
+instrument.setup(Engine)
+
+# read-only statements, the others mark the transaction as a write
+_READ_STATEMENTS = ('SELECT', 'PRAGMA', 'EXPLAIN', 'WITH')
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _mark_write(conn, cursor, statement, parameters, context, executemany):
+    if not statement.lstrip()[:7].upper().startswith(_READ_STATEMENTS):
+        conn.info['cache_dirty'] = True
+
+
+@event.listens_for(Engine, 'commit')
+def _invalidate_on_commit(conn):
+    """ Invalidate the query cache once a transaction that wrote is
+    committed
+    """
+    if conn.info.pop('cache_dirty', False):
+        cache.invalidate()
+
+
+@event.listens_for(Engine, 'rollback')
+def _forget_write(conn):
+    conn.info.pop('cache_dirty', None)
+
+
+@instrumented
 class TagDAO:
 
     @classmethod
@@ -143,12 +433,8 @@ class TagDAO:
                 - tag (str)
         """
 
-        record = Tag(label=tag)
-        try:
-            with session_scope() as session:
-                session.add(record)
-        except IntegrityError:
-            logger.info(f'duplicate Tag: {tag}')
+        with session_scope() as session:
+            cls._get_ids(session, [tag])
 
     @classmethod
     def find(cls, labels):
@@ -163,23 +449,33 @@ class TagDAO:
     def get_labels(cls):
         """ Return the list of defined labels
         """
+        return cache.get(('tag labels',), cls._get_labels)
+
+    @classmethod
+    def _get_labels(cls):
         labels = []
         with session_scope() as session:
             for inst in session.query(Tag):
                 labels.append(inst.label)
         return labels
 
+    @classmethod
+    def _get_ids(cls, session, labels):
+        """ Create the missing tags and return their ids as {label: id}
+        Arguments:
+            - session: the session of the current transaction
+            - labels: list(str): a list of strings
+        """
+        return _upsert_labels(session, Tag, labels)
+
 
+@instrumented
 class DreamTypeDAO:
 
     @classmethod
     def create(cls, drtype):
-        record = DreamType(label=drtype)
-        try:
-            with session_scope() as session:
-                session.add(record)
-        except IntegrityError:
-            logger.info(f'duplicate DreamType: {drtype}')
+        with session_scope() as session:
+            cls._get_ids(session, [drtype])
 
     @classmethod
     def find(cls, labels):
@@ -194,15 +490,33 @@ class DreamTypeDAO:
     def get_labels(cls):
         """ Return the list of defined labels
         """
+        return cache.get(('dreamtype labels',), cls._get_labels)
+
+    @classmethod
+    def _get_labels(cls):
         labels = []
         with session_scope() as session:
             for inst in session.query(DreamType):
                 labels.append(inst.label)
         return labels
 
+    @classmethod
+    def _get_ids(cls, session, labels):
+        """ Create the missing dream types and return their ids as
+        {label: id}
+        Arguments:
+            - session: the session of the current transaction
+            - labels: list(str): a list of strings
+        """
+        return _upsert_labels(session, DreamType, labels)
+
 
+@instrumented
 class DreamDAO:
 
+    # number of rows fetched at once when streaming large queries
+    YIELD_PER = 1000
+
     @classmethod
     def create(cls, instance):
         """ Arguments:
@@ -213,52 +527,123 @@ class DreamDAO:
                 - tags (list(str)): a list of tags
                 - drtype (str): a dream type (normal, lucid, ...)
         """
-        record = Dream(title=instance['title'],
-                       recit=instance['recit'],
-                       date=instance['date'])
         idnum = None
         try:
             with session_scope() as session:
-                session.add(record)
-                session.flush()
-                idnum = record.id
+                idnum = cls._create(session, instance)
         except IntegrityError:
             logger.info("duplicate Dream")
 
-        if idnum is not None:
-            cls._add_tags(idnum, instance['tags'])
-            cls._add_drtype(idnum, instance['drtype'])
-
         return idnum
 
     @classmethod
     def update(cls, idnum, instance):
-        # TODO: not sure if check necessary
-        if instance['tags'] is None:
-            instance['tags'] = []
-        if instance['drtype'] is None:
-            instance['drtype'] = ''
-
+        """ Update the record whose id = idnum. Nothing is written when
+        instance does not differ from the record.
+        Arguments:
+            - idnum (int): identity field (primary key) of the table
+            - instance (dict): see create
+        Return:
+            bool: True if the record has been modified
+        """
         try:
             with session_scope() as session:
-                record = session.query(Dream).filter_by(id=idnum).one()
-                old_tags = record.get_tags()
-                old_drtype = record.get_drtype()
-                record.date = instance['date']
-                record.title = instance['title']
-                record.recit = instance['recit']
-                session.add(record)
+                modified = cls._update(session, idnum, instance)
         except IntegrityError:
+            # raised by the commit, once modified is set
             logger.info("error update dream db")
+            return False
+        return modified
+
+    @classmethod
+    def save_batch(cls, instances):
+        """ Create or update several dreams in a single transaction. If the
+        transaction fails, the dreams are saved one at a time so that a single
+        invalid dream does not prevent saving the others.
+        Arguments:
+            - instances list(dict): see create, dreams with an id are updated
+        Return:
+            list(int): the id of each dream, None if it could not be saved
+        """
+        try:
+            with session_scope() as session:
+                return [cls._save(session, instance) for instance in instances]
+        except IntegrityError:
+            logger.info("batch save failed, saving dreams one at a time")
+
+        ids = []
+        for instance in instances:
+            try:
+                with session_scope() as session:
+                    ids.append(cls._save(session, instance))
+            except IntegrityError:
+                logger.info("duplicate Dream")
+                ids.append(None)
+        return ids
 
-        to_add_tags = list(set(instance['tags']).difference(old_tags))
-        to_rm_tags = list(set(old_tags).difference(instance['tags']))
-        cls._add_tags(idnum, to_add_tags)
-        cls._rm_tags(idnum, to_rm_tags)
+    @classmethod
+    def _save(cls, session, instance):
+        """ Create or update a dream in the transaction of session, return
+        its id
+        """
+        if instance.get('id') is None:
+            return cls._create(session, instance)
+        cls._update(session, instance['id'], instance)
+        return instance['id']
+
+    @classmethod
+    def _create(cls, session, instance):
+        """ Insert a dream and link its tags and dream type in the transaction
+        of session. Return the id of the new dream.
+        """
+        record = Dream(title=instance['title'],
+                       recit=instance['recit'],
+                       date=instance['date'])
+        session.add(record)
+        session.flush()
+        cls._set_stats(session, record.id, instance['recit'])
+        cls._add_tags(session, record.id, instance['tags'])
+        cls._add_drtype(session, record.id, instance['drtype'])
+        return record.id
 
-        if instance['drtype'] != old_drtype:
-            cls._add_drtype(idnum, instance['drtype'])
-            cls._rm_drtype(idnum, old_drtype)
+    @classmethod
+    def _update(cls, session, idnum, instance):
+        """ Update a dream and its tags and dream type in the transaction of
+        session. The dream and the labels of its associations are loaded and
+        diffed against instance. Return True if something changed.
+        """
+        record = session.query(Dream).filter(Dream.id == idnum).one()
+
+        new_tags = set(instance['tags'] or [])
+        new_drtype = instance['drtype'] or ''
+        # the labels are looked up through the association primary keys, a
+        # joined eager load of both many-to-many would scan them
+        old_tags = set(cls._get_labels(session, idnum, tags, tags.c.tag_id, Tag))
+        old_drtype = next(iter(cls._get_labels(session, idnum, drtype, drtype.c.type_id,
+                                               DreamType)), '')
+        columns = {key: instance[key] for key in ('title', 'date', 'recit')
+                   if getattr(record, key) != instance[key]}
+
+        if not columns and new_tags == old_tags and new_drtype == old_drtype:
+            logger.info(f'dream {idnum} unchanged')
+            return False
+
+        now = datetime.datetime.utcnow()
+        if 'recit' in columns:
+            cls._set_stats(session, idnum, instance['recit'])
+            RevisionDAO._record(session.connection(), idnum, instance['recit'],
+                                record.recit, record.updated, now)
+        for key, value in columns.items():
+            setattr(record, key, value)
+        # bump the timestamp even if only the tags or the type changed
+        record.updated = now
+
+        cls._add_tags(session, idnum, new_tags - old_tags)
+        cls._rm_tags(session, idnum, old_tags - new_tags)
+        if new_drtype != old_drtype:
+            cls._rm_drtype(session, idnum, old_drtype)
+            cls._add_drtype(session, idnum, new_drtype)
+        return True
 
     @classmethod
     def find_by_id(cls, idnum):
@@ -269,6 +654,11 @@ class DreamDAO:
             obj: a query object
         """
         logger.info(f'find by id: {idnum}')
+        return cache.get(('dream', idnum), lambda: cls._find_by_id(idnum))
+
+    @classmethod
+    def _find_by_id(cls, idnum):
+        record = None
         try:
             with session_scope() as session:
                 obj = session.query(Dream).filter(Dream.id == idnum).one()
@@ -281,107 +671,394 @@ class DreamDAO:
         return record
 
     @classmethod
-    def get_tree(cls):
+    def get_tree(cls, ids=None):
+        """ Return the navigation tree as nested dictionaries
+        {year: {month: {day: [[title, id], ...]}}}
 
+        Only (date, id, title) are selected, streamed in (date, created)
+        order, so the dream bodies are never loaded.
+        Arguments:
+            - ids list(int): only include these dreams, default to all
+        """
         tree = OrderedDict()
+        curdate = None
+        days = None
 
         with session_scope() as session:
-            instances = session.query(Dream).order_by(Dream.date, Dream.created)
-            nbrows = instances.count()
-            dftree = pd.DataFrame(index = np.arange(0, nbrows), columns=['year', 'month', 'day', 'id', 'title'])
-            for i, inst in enumerate(instances):
-                year = inst.date.strftime('%Y')
-                month = inst.date.strftime('%m')
-                day = inst.date.strftime('%d')
-                dftree.loc[i] = [year, month, day, inst.id, inst.title]
+            rows = session.query(Dream.date, Dream.id, Dream.title)
+            if ids is not None:
+                rows = rows.filter(Dream.id.in_(ids))
+            rows = (rows.order_by(Dream.date, Dream.created)
+                    .yield_per(cls.YIELD_PER))
+            for date, idnum, title in rows:
+                if date != curdate:
+                    curdate = date
+                    months = tree.setdefault(f'{date.year:04d}', OrderedDict())
+                    daysdict = months.setdefault(f'{date.month:02d}', OrderedDict())
+                    days = daysdict.setdefault(f'{date.day:02d}', [])
+                days.append([title, idnum])
+
+        return tree
 
-        dftree.apply(cls._poptree, args=(tree,), axis=1)
+    @classmethod
+    def search(cls, query, limit=50, raw=False, start='[', end=']'):
+        """ Full text search of the dreams title and body, best matches first
+        Arguments:
+            - query (str): words to search, or a FTS5 query if raw is True
+            - limit (int): maximum number of results
+            - start, end (str): markers around the matches in the snippet
+        Return:
+            list(dict): id, title, date and snippet of the matching dreams
+        Raise:
+            ValueError: if the raw query is not valid FTS5 syntax
+        """
+        if not raw:
+            query = fts_query(query)
+        if not query:
+            return []
+        # the title weights 10 times more than the body in the ranking
+        statement = text("""
+            SELECT dream.id, dream.title, dream.date,
+                   snippet(dream_fts, -1, :start, :end, '...', 16) AS snippet
+            FROM dream_fts JOIN dream ON dream.id = dream_fts.rowid
+            WHERE dream_fts MATCH :query
+            ORDER BY bm25(dream_fts, 10.0, 1.0)
+            LIMIT :limit""").columns(id=Integer, title=String, date=DATE, snippet=String)
+        try:
+            with session_scope() as session:
+                rows = session.execute(statement, {'query': query, 'limit': limit,
+                                                   'start': start, 'end': end})
+                return [dict(row) for row in rows]
+        except OperationalError as error:
+            if not raw:
+                raise
+            raise ValueError(f'invalid search query {query!r}: {error.orig}') from error
 
-        return(tree)
+    @classmethod
+    def get_years(cls):
+        """ Return the number of dreams per year as {year: count}
 
-    @staticmethod
-    def _poptree(row, tree):
-        """ A helper function to be used with an dataframe.apply function
+        Only ix_dream_date_created is read: each year is found by the first
+        date from the start of the next one, then counted with a date range.
+        The dates are stored as YYYY-MM-DD.
         """
-        if row['year'] not in tree:
-            tree[row['year']] = OrderedDict()
-        if row['month'] not in tree[row['year']]:
-            tree[row['year']][row['month']] = OrderedDict()
+        statement = text("""
+            WITH RECURSIVE year(number) AS (
+                SELECT CAST(substr((SELECT MIN(date) FROM dream), 1, 4) AS INTEGER)
+                UNION ALL
+                SELECT CAST(substr((SELECT MIN(date) FROM dream
+                                    WHERE date >= printf('%04d-01-01', number + 1)),
+                                   1, 4) AS INTEGER)
+                FROM year WHERE number IS NOT NULL)
+            SELECT printf('%04d', number),
+                   (SELECT COUNT(*) FROM dream
+                    WHERE date >= printf('%04d-01-01', number)
+                    AND date < printf('%04d-01-01', number + 1))
+            FROM year WHERE number IS NOT NULL""")
+        with session_scope() as session:
+            rows = session.execute(statement).fetchall()
+        return OrderedDict(rows)
 
-        tree[row['year']][row['month']].setdefault(row['day'], []).append([row['title'], row['id']])
+    @classmethod
+    def get_months(cls, year):
+        """ Return the number of dreams per month of year as {month: count}
+        Arguments:
+            - year (str): four digits year
+        """
+        month = func.strftime('%m', Dream.date)
+        start, end = cls._date_range(year)
+        with session_scope() as session:
+            rows = (session.query(month, func.count(Dream.id))
+                    .filter(Dream.date >= start, Dream.date < end)
+                    .group_by(month)
+                    .order_by(month)
+                    .all())
+        return OrderedDict(rows)
 
     @classmethod
-    def _add_tags(cls, idnum, tags=None):
-        """ append tags to record whose id = idnum
+    def get_days(cls, year, month):
+        """ Return the number of dreams per day of a month as {day: count}
+        Arguments:
+            - year (str): four digits year
+            - month (str): two digits month
         """
+        day = func.strftime('%d', Dream.date)
+        start, end = cls._date_range(year, month)
+        with session_scope() as session:
+            rows = (session.query(day, func.count(Dream.id))
+                    .filter(Dream.date >= start, Dream.date < end)
+                    .group_by(day)
+                    .order_by(day)
+                    .all())
+        return OrderedDict(rows)
 
-        if tags is None:
-            tags = []
+    @classmethod
+    def get_dreams(cls, year, month, day):
+        """ Return the dreams of a day as a list of [title, id]
+        """
+        date = datetime.date(int(year), int(month), int(day))
+        with session_scope() as session:
+            rows = (session.query(Dream.title, Dream.id)
+                    .filter(Dream.date == date)
+                    .order_by(Dream.created)
+                    .all())
+        return [[title, idnum] for title, idnum in rows]
 
-        if tags:
-            for elem in tags:
-                TagDAO.create(elem)
+    @staticmethod
+    def _date_range(year, month=None):
+        """ Return the [start, end) dates of a year or of a month
+        """
+        year = int(year)
+        if month is None:
+            return datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1)
+        month = int(month)
+        start = datetime.date(year, month, 1)
+        end = datetime.date(year + month // 12, month % 12 + 1, 1)
+        return start, end
 
-            try:
-                with session_scope() as session:
-                    instance = session.query(Dream).filter(Dream.id==idnum).one()
-                    tags_rec = session.query(Tag).filter(Tag.label.in_(tags))
-                    for elem in tags_rec:
-                        if elem not in instance.tags:
-                            instance.tags.append(elem)
-            except:
-                logger.error("append tags error")
+    @classmethod
+    def _get_labels(cls, session, idnum, link, link_column, model):
+        """ Return the labels of model (Tag or DreamType) linked to record
+        whose id = idnum through the association table link
+        """
+        rows = session.execute(select([model.label])
+                               .select_from(link.join(model.__table__, link_column == model.id))
+                               .where(link.c.dream_id == idnum))
+        return [label for label, in rows]
 
     @classmethod
-    def _rm_tags(cls, idnum, tags=None):
-        """ remove tags to record whose id = idnum
+    def _set_stats(cls, session, idnum, recit):
+        """ Store the metrics of the body of record whose id = idnum """
+        session.execute(DreamStat.__table__.insert().prefix_with('OR REPLACE'),
+                        {'id': idnum, 'words': word_count(recit)})
+
+    @classmethod
+    def _add_tags(cls, session, idnum, labels=None):
+        """ link tags to record whose id = idnum, creating the missing tags
         """
+        if labels:
+            ids = TagDAO._get_ids(session, labels)
+            session.execute(tags.insert(),
+                            [{'dream_id': idnum, 'tag_id': tag_id}
+                             for tag_id in ids.values()])
 
-        if tags is None:
-            tags = []
+    @classmethod
+    def _rm_tags(cls, session, idnum, labels=None):
+        """ unlink tags from record whose id = idnum
+        """
+        if labels:
+            tag_ids = select([Tag.id]).where(Tag.label.in_(labels))
+            session.execute(tags.delete()
+                            .where(tags.c.dream_id == idnum)
+                            .where(tags.c.tag_id.in_(tag_ids)))
 
-        if tags:
-            try:
-                with session_scope() as session:
-                    instance = session.query(Dream).filter(Dream.id==idnum).one()
-                    tags_rec = session.query(Tag).filter(Tag.label.in_(tags))
-                    for elem in tags_rec:
-                        if elem in instance.tags:
-                            instance.tags.remove(elem)
-            except:
-                logger.error("remove tags error")
+    @classmethod
+    def _add_drtype(cls, session, idnum, label=None):
+        """ link a dream type to record whose id = idnum, creating it if
+        missing
+        """
+        if label:
+            ids = DreamTypeDAO._get_ids(session, [label])
+            session.execute(drtype.insert(),
+                            {'dream_id': idnum, 'type_id': ids[label]})
 
     @classmethod
-    def _add_drtype(cls, idnum, drtype=None):
-        if drtype is None:
-            drtype = ''
+    def _rm_drtype(cls, session, idnum, label=None):
+        """ unlink a dream type from record whose id = idnum
+        """
+        if label:
+            type_ids = select([DreamType.id]).where(DreamType.label == label)
+            session.execute(drtype.delete()
+                            .where(drtype.c.dream_id == idnum)
+                            .where(drtype.c.type_id.in_(type_ids)))
 
-        if drtype:
-            DreamTypeDAO.create(drtype)
 
-            try:
-                with session_scope() as session:
-                    instance = session.query(Dream).filter(Dream.id == idnum).one()
-                    drtype_rec = session.query(DreamType).filter(DreamType.label == drtype).first()
-                    if drtype_rec not in instance.drtype:
-                        instance.drtype.append(drtype_rec)
-            except:
-                logger.error("append drtype error")
+@instrumented
+class RevisionDAO:
+    """ History of the body of the dreams
+
+    A revision is recorded each time the body of a dream is modified. The
+    first modification also records the body it replaces, so a dream never
+    modified has no revision. Every SNAPSHOT_INTERVAL revisions (or when a
+    delta would not be smaller) the whole text is stored, so rebuilding a
+    revision applies at most SNAPSHOT_INTERVAL - 1 deltas.
+    """
+
+    SNAPSHOT_INTERVAL = 16
 
     @classmethod
-    def _rm_drtype(cls, idnum, drtype=None):
-        if drtype is None:
-            drtype = ''
+    def history(cls, idnum):
+        """ Return the revisions of a dream, oldest first, as a list of
+        {'number', 'created', 'snapshot', 'size'}
+        """
+        table = Revision.__table__
+        with session_scope() as session:
+            rows = session.execute(select([table.c.number, table.c.created,
+                                           table.c.snapshot, func.length(table.c.data)])
+                                   .where(table.c.dream_id == idnum)
+                                   .order_by(table.c.number))
+            return [dict(zip(('number', 'created', 'snapshot', 'size'), row)) for row in rows]
 
-        if drtype:
-            try:
-                with session_scope() as session:
-                    instance = session.query(Dream).filter(Dream.id == idnum).one()
-                    drtype_rec = session.query(DreamType).filter(DreamType.label == drtype).first()
-                    if drtype_rec in instance.drtype:
-                        instance.drtype.remove(drtype_rec)
-            except:
-                logger.error("remove drtype error")
+    @classmethod
+    def get(cls, idnum, number):
+        """ Return the body of a dream at revision number, None if there is
+        no such revision
+        """
+        table = Revision.__table__
+        last_snapshot = (select([func.max(table.c.number)])
+                         .where(table.c.dream_id == idnum)
+                         .where(table.c.number <= number)
+                         .where(table.c.snapshot)
+                         .as_scalar())
+        with session_scope() as session:
+            rows = session.execute(select([table.c.number, table.c.snapshot, table.c.data])
+                                   .where(table.c.dream_id == idnum)
+                                   .where(table.c.number.between(last_snapshot, number))
+                                   .order_by(table.c.number)).fetchall()
+        if not rows or rows[-1][0] != number:
+            return None
+        return revisions.rebuild((snapshot, data) for _, snapshot, data in rows)
+
+    @classmethod
+    def restore(cls, idnum, number):
+        """ Set the body of a dream back to revision number, which records a
+        new revision
+        Return:
+            bool: True if the dream has been modified, None if the revision
+            does not exist
+        """
+        recit = cls.get(idnum, number)
+        instance = DreamDAO.find_by_id(idnum)
+        if recit is None or instance is None:
+            return None
+        instance['recit'] = recit
+        return DreamDAO.update(idnum, instance)
+
+    @classmethod
+    def _record(cls, conn, idnum, recit, previous, previous_time, now):
+        """ Record the new body recit of a dream in the transaction of conn
+        Arguments:
+            - conn: sqlalchemy connection
+            - recit (str): the new body
+            - previous (str): the body it replaces
+            - previous_time (datetime): when previous was written
+            - now (datetime): when recit is written
+        """
+        table = Revision.__table__
+        last, last_snapshot = conn.execute(
+            select([func.max(table.c.number),
+                    func.max(case([(table.c.snapshot, table.c.number)]))])
+            .where(table.c.dream_id == idnum)).fetchone()
+        rows = []
+        if last is None:
+            rows.append({'dream_id': idnum, 'number': 1, 'created': previous_time,
+                         'snapshot': True, 'data': revisions.snapshot(previous)})
+            last = last_snapshot = 1
+
+        data = revisions.delta(previous, recit)
+        full = revisions.snapshot(recit)
+        snapshot = last + 1 - last_snapshot >= cls.SNAPSHOT_INTERVAL or len(full) <= len(data)
+        rows.append({'dream_id': idnum, 'number': last + 1, 'created': now,
+                     'snapshot': snapshot, 'data': full if snapshot else data})
+        conn.execute(table.insert(), rows)
+
+
+@instrumented
+class StatDAO:
+
+    # day names indexed by sqlite strftime('%w')
+    WEEKDAYS = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday',
+                'Friday', 'Saturday']
+    LUCID = 'lucid'
+
+    @classmethod
+    def get_stats(cls, today=None):
+        """ Return statistics about the dreams. The counts are read from the
+        dreamcount rows, so the cost does not grow with the number of dreams,
+        except for the streaks which scan the distinct dates.
+        Arguments:
+            - today (datetime.date): reference day of the current streak,
+              default to today
+        Return:
+            dict: dreams, first, last, years, months, weekdays, tags, types,
+            lucid_ratio, words and streaks
+        """
+        today = today or datetime.date.today()
+        with session_scope() as session:
+            counts = {}
+            rows = (session.query(DreamCount.period, DreamCount.value,
+                                  DreamCount.dreams, DreamCount.words)
+                    .order_by(DreamCount.period, DreamCount.value))
+            for period, value, dreams, words in rows:
+                if dreams > 0 or period == 'total':
+                    counts.setdefault(period, OrderedDict())[value] = (dreams, words)
+            count, words = counts.get('total', {}).get('', (0, 0))
+            first, last, longest = session.execute(
+                select([select([func.min(Dream.date)]).as_scalar(),
+                        select([func.max(Dream.date)]).as_scalar(),
+                        select([func.max(DreamStat.words)]).as_scalar()])).first()
+            weekdays = cls._period_count(counts, 'weekday')
+            types = cls._label_count(session, DreamType, cls._period_count(counts, 'type'))
+            stats = {
+                'dreams': count,
+                'first': first.isoformat() if first else None,
+                'last': last.isoformat() if last else None,
+                'years': cls._period_count(counts, 'year'),
+                'months': cls._period_count(counts, 'month'),
+                'weekdays': OrderedDict((cls.WEEKDAYS[int(day)], weekdays.get(str(day), 0))
+                                        for day in [1, 2, 3, 4, 5, 6, 0]),
+                'tags': cls._label_count(session, Tag, cls._period_count(counts, 'tag')),
+                'types': types,
+                'lucid_ratio': types.get(cls.LUCID, 0) / count if count else 0.0,
+                'words': {'total': words,
+                          'mean': round(words / count, 1) if count else 0,
+                          'max': longest or 0},
+                'streaks': cls._streaks(session, today),
+            }
+        return stats
+
+    @staticmethod
+    def _period_count(counts, period):
+        """ Return the number of dreams per value of period, from the
+        dreamcount rows read by get_stats
+        """
+        return OrderedDict((value, dreams) for value, (dreams, _) in counts.get(period, {}).items())
+
+    @staticmethod
+    def _label_count(session, model, counts):
+        """ Return the number of dreams per label of model (Tag or DreamType),
+        most used first
+        Arguments:
+            - counts (dict): {id as str: number of dreams}
+        """
+        labels = dict(session.query(model.id, model.label)
+                      .filter(model.id.in_([int(idnum) for idnum in counts])))
+        rows = sorted(((labels[int(idnum)], dreams) for idnum, dreams in counts.items()),
+                      key=lambda row: (-row[1], row[0]))
+        return OrderedDict(rows)
+
+    @staticmethod
+    def _streaks(session, today):
+        """ Return the longest run of consecutive days with at least one
+        dream, and the current one (ending today or yesterday)
+        """
+        # consecutive days share the same date - row number
+        rows = session.execute(text("""
+            SELECT MIN(day) AS start, MAX(day) AS end, COUNT(*) AS days
+            FROM (SELECT day, julianday(day) - ROW_NUMBER() OVER (ORDER BY day) AS island
+                  FROM (SELECT DISTINCT date AS day FROM dream))
+            GROUP BY island
+            ORDER BY days DESC, start DESC""")).fetchall()
+        longest = {'days': 0, 'start': None, 'end': None}
+        current = dict(longest)
+        if rows:
+            longest = dict(rows[0])
+        yesterday = (today - datetime.timedelta(days=1)).isoformat()
+        for row in rows:
+            if row['end'] in (today.isoformat(), yesterday):
+                current = dict(row)
+                break
+        return {'longest': longest, 'current': current}
 
 
 # initialize database
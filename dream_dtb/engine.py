@@ -0,0 +1,52 @@
+"""
+SQLAlchemy engine, session factory and declarative base of the dream database
+
+Kept out of the package __init__ so that commands which do not touch the
+database do not pay for importing SQLAlchemy.
+"""
+from sqlalchemy import Column
+from sqlalchemy import Integer
+from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.declarative import declared_attr
+from sqlalchemy.ext.declarative import declarative_base
+
+from dream_dtb import compression
+from dream_dtb import config
+
+
+class BaseMixin():
+    """ Mixin that define the table name as the lower case class name and add
+    an index
+    """
+
+    @declared_attr
+    def __tablename__(cls):
+        return cls.__name__.lower()
+
+    id = Column(Integer, primary_key=True)
+
+
+Base = declarative_base(cls=BaseMixin)
+db_uri = 'sqlite:///{}'.format(config.DB_PATH)
+# Engine = create_engine(db_uri, echo=True)  # debug mode
+Engine = create_engine(db_uri)
+# the bodies of the models (CompressedText) are stored in this database
+compression.bind(Engine.url.database)
+Session = sessionmaker(bind=Engine)
+
+
+def set_sqlite_pragmas(dbapi_connection, pragmas):
+    """ Apply pragmas ({name: value}) to a sqlite dbapi connection """
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+    cursor.close()
+
+
+@event.listens_for(Engine, 'connect')
+def on_connect(dbapi_connection, connection_record):
+    """ Tune every new connection from the [sqlite] section of dreamrc """
+    set_sqlite_pragmas(dbapi_connection, config.sqlite_pragmas(config.SETTINGS))
+    compression.register(dbapi_connection, Engine.url.database)
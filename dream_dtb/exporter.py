@@ -0,0 +1,81 @@
+"""
+Streaming export of dreams
+
+Dreams are read from a single cursor in (date, created, id) order and
+fetched by batches. The tags and dream types of a batch are fetched with one
+query each, so memory use does not depend on the size of the journal.
+"""
+import logging
+from collections import defaultdict
+
+from sqlalchemy import and_
+from sqlalchemy import select
+
+from dream_dtb.db import Dream
+from dream_dtb.db import DreamType
+from dream_dtb.db import Tag
+from dream_dtb.db import drtype
+from dream_dtb.db import tags
+from dream_dtb.engine import Engine
+
+logger = logging.getLogger('dream_logger')
+
+BATCH_SIZE = 500
+
+
+def iter_dreams(since=None, until=None, labels=None, batch_size=BATCH_SIZE, engine=Engine):
+    """ Stream the dreams in date order
+    Arguments:
+        - since, until (datetime.date): only dreams within these dates
+          (included)
+        - labels list(str): only dreams having at least one of these tags
+        - batch_size (int): number of dreams fetched at once
+    Return:
+        generator of dict: id, title, date, recit, tags and drtype
+    """
+    table = Dream.__table__
+    query = select([table.c.id, table.c.title, table.c.date, table.c.recit])
+    conditions = []
+    if since is not None:
+        conditions.append(table.c.date >= since)
+    if until is not None:
+        conditions.append(table.c.date <= until)
+    if labels:
+        tagged = (select([tags.c.dream_id])
+                  .select_from(tags.join(Tag.__table__))
+                  .where(Tag.label.in_(labels)))
+        conditions.append(table.c.id.in_(tagged))
+    if conditions:
+        query = query.where(and_(*conditions))
+    query = query.order_by(table.c.date, table.c.created, table.c.id)
+
+    with engine.connect() as conn:
+        result = conn.execute(query)
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            ids = [row.id for row in rows]
+            batch_tags = _labels(conn, tags, tags.c.tag_id, Tag, ids)
+            batch_types = _labels(conn, drtype, drtype.c.type_id, DreamType, ids)
+            for row in rows:
+                yield {'id': row.id,
+                       'title': row.title,
+                       'date': row.date,
+                       'recit': row.recit,
+                       'tags': batch_tags.get(row.id, []),
+                       'drtype': (batch_types.get(row.id) or [''])[0]}
+
+
+def _labels(conn, link, link_column, model, ids):
+    """ Return {dream id: [label, ...]} of the dreams ids through the
+    association table link
+    """
+    labels = defaultdict(list)
+    query = (select([link.c.dream_id, model.label])
+             .select_from(link.join(model.__table__, link_column == model.id))
+             .where(link.c.dream_id.in_(ids))
+             .order_by(link.c.dream_id, model.label))
+    for idnum, label in conn.execute(query):
+        labels[idnum].append(label)
+    return labels
@@ -0,0 +1,263 @@
+"""
+Journal file formats used to import and export dreams
+
+A dream is read as a dictionary with the same keys as the instances given to
+DreamDAO.create: title (str), date (datetime.date), recit (str), tags
+(list(str)) and drtype (str).
+
+- jsonl: one json object per line
+- csv: one row per dream with a header line, tags are comma separated
+- markdown: dreams introduced by a front matter block, several dreams can
+  follow each other in the same file:
+
+    ---
+    title: Flying over the sea
+    date: 2017-03-21
+    type: lucid
+    tags: sea, whales
+    ---
+
+    I was flying above a blue ocean...
+"""
+import csv
+import datetime
+import json
+import os
+import re
+
+FORMATS = ['jsonl', 'csv', 'markdown']
+
+EXTENSIONS = {'.jsonl': 'jsonl',
+              '.json': 'jsonl',
+              '.csv': 'csv',
+              '.md': 'markdown',
+              '.markdown': 'markdown'}
+
+# front matter delimiter of the markdown format
+FRONT_MATTER = '---'
+
+# columns of the csv format
+CSV_FIELDS = ['id', 'title', 'date', 'drtype', 'tags', 'recit']
+
+
+class FormatError(ValueError):
+    """ Raised when a journal file cannot be parsed """
+
+
+def guess_format(path):
+    """ Return the format of path from its extension, directories hold
+    markdown files
+    """
+    if os.path.isdir(path):
+        return 'markdown'
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in EXTENSIONS:
+        raise FormatError(f'{path}: unknown format, use one of {", ".join(FORMATS)}')
+    return EXTENSIONS[ext]
+
+
+def read(path, fmt=None):
+    """ Stream the dreams of a journal file, or of the markdown files of a
+    directory
+    Arguments:
+        - path (str): file or directory
+        - fmt (str): one of FORMATS, guessed from path by default
+    Return:
+        generator of dict
+    """
+    if fmt is None:
+        fmt = guess_format(path)
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            filepath = os.path.join(path, name)
+            if os.path.isfile(filepath) and EXTENSIONS.get(os.path.splitext(name)[1].lower()) == fmt:
+                yield from read(filepath, fmt)
+        return
+
+    reader = {'jsonl': _read_jsonl, 'csv': _read_csv, 'markdown': _read_markdown}[fmt]
+    with open(path, newline='' if fmt == 'csv' else None, encoding='utf-8') as stream:
+        yield from reader(path, stream)
+
+
+def make_instance(fields, where):
+    """ Return a dream instance from raw fields (strings or json values)
+    Arguments:
+        - fields (dict): title, date, recit, tags and drtype. 'body' and
+          'text' are accepted for recit, 'type' for drtype
+        - where (str): location of the fields, used in error messages
+    """
+    title = _string(fields.get('title'), 'title', where).strip()
+    if not title:
+        raise FormatError(f'{where}: missing title')
+    try:
+        year, month, day = str(fields.get('date', '')).strip().split('-')
+        date = datetime.date(int(year), int(month), int(day))
+    except ValueError:
+        raise FormatError(f'{where}: invalid date {fields.get("date")!r}, expected YYYY-MM-DD')
+
+    tags = fields.get('tags')
+    if tags is None:
+        tags = []
+    elif isinstance(tags, str):
+        tags = tags.split(',')
+    elif not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+        raise FormatError(f'{where}: tags must be a string or a list of strings, got {tags!r}')
+    tags = [tag.strip() for tag in tags if tag.strip()]
+
+    recit = _string(fields.get('recit', fields.get('body', fields.get('text'))), 'body', where)
+    drtype = _string(fields.get('drtype', fields.get('type')), 'type', where)
+
+    return {'title': title,
+            'date': date,
+            'recit': recit,
+            'tags': list(dict.fromkeys(tags)),
+            'drtype': drtype.strip()}
+
+
+def _string(value, name, where):
+    """ Return value, '' if it is missing (None)
+    Raise:
+        FormatError: if value is not a string (e.g. a json number or list)
+    """
+    if value is None:
+        return ''
+    if not isinstance(value, str):
+        raise FormatError(f'{where}: {name} must be a string, got {value!r}')
+    return value
+
+
+def _read_jsonl(path, stream):
+    for lineno, line in enumerate(stream, 1):
+        if line.strip():
+            try:
+                fields = json.loads(line)
+            except ValueError as error:
+                raise FormatError(f'{path}:{lineno}: {error}')
+            yield make_instance(fields, f'{path}:{lineno}')
+
+
+def _read_csv(path, stream):
+    reader = csv.DictReader(stream)
+    for row in reader:
+        yield make_instance(row, f'{path}:{reader.line_num}')
+
+
+def _read_markdown(path, stream):
+    fields = None
+    body = []
+    start = 0
+    lines = enumerate(stream, 1)
+    pushed = None
+    while True:
+        if pushed is not None:
+            (lineno, line), pushed = pushed, None
+        else:
+            item = next(lines, None)
+            if item is None:
+                break
+            lineno, line = item
+
+        if line.rstrip('\n') == FRONT_MATTER:
+            # a delimiter followed by a title starts a new dream, otherwise
+            # it is a horizontal rule of the body
+            item = next(lines, None)
+            if item is not None and item[1].lower().startswith('title:'):
+                if fields is not None:
+                    yield _markdown_instance(fields, body, f'{path}:{start}')
+                fields, body, start = _read_front_matter(path, item, lines), [], lineno
+                continue
+            pushed = item
+
+        if fields is not None:
+            body.append(line)
+        elif line.strip():
+            raise FormatError(f'{path}:{lineno}: expected a {FRONT_MATTER} front matter')
+
+    if fields is not None:
+        yield _markdown_instance(fields, body, f'{path}:{start}')
+
+
+def _read_front_matter(path, first, lines):
+    """ Return the 'key: value' lines from first up to the closing delimiter
+    as a dict
+    """
+    fields = {}
+    item = first
+    while item is not None:
+        lineno, line = item
+        line = line.rstrip('\n')
+        if line == FRONT_MATTER:
+            return fields
+        key, sep, value = line.partition(':')
+        if not sep:
+            raise FormatError(f'{path}:{lineno}: expected "key: value"')
+        fields[key.strip().lower()] = value.strip()
+        item = next(lines, None)
+    raise FormatError(f'{path}: unterminated front matter')
+
+
+def _markdown_instance(fields, body, where):
+    # the blank line after the front matter is not part of the body
+    if body and not body[0].strip():
+        body = body[1:]
+    fields['recit'] = ''.join(body).rstrip('\n')
+    return make_instance(fields, where)
+
+
+def write(stream, instances, fmt):
+    """ Write dreams to a text stream
+    Arguments:
+        - stream: text file object
+        - instances: iterable of dict with an additional id key
+        - fmt (str): one of FORMATS
+    """
+    writer = {'jsonl': _write_jsonl, 'csv': _write_csv, 'markdown': _write_markdown}[fmt]
+    writer(stream, instances)
+
+
+def write_markdown_files(directory, instances):
+    """ Write each dream in its own markdown file of directory, named after
+    its date, title and id. Return the number of files written.
+    """
+    os.makedirs(directory, exist_ok=True)
+    count = 0
+    for inst in instances:
+        slug = re.sub(r'[^\w]+', '-', inst['title'].lower()).strip('-')[:60]
+        name = f"{inst['date'].isoformat()}-{slug}-{inst['id']}.md"
+        with open(os.path.join(directory, name), 'w', encoding='utf-8') as stream:
+            stream.write(format_markdown(inst))
+        count += 1
+    return count
+
+
+def format_markdown(inst):
+    """ Return a dream in the markdown format """
+    header = [FRONT_MATTER,
+              f"title: {inst['title']}",
+              f"date: {inst['date'].isoformat()}"]
+    if inst['drtype']:
+        header.append(f"type: {inst['drtype']}")
+    if inst['tags']:
+        header.append(f"tags: {', '.join(inst['tags'])}")
+    header.append(FRONT_MATTER)
+    return '\n'.join(header) + '\n\n' + (inst['recit'] or '') + '\n'
+
+
+def _write_jsonl(stream, instances):
+    for inst in instances:
+        stream.write(json.dumps(dict(inst, date=inst['date'].isoformat()), ensure_ascii=False))
+        stream.write('\n')
+
+
+def _write_csv(stream, instances):
+    writer = csv.DictWriter(stream, CSV_FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    for inst in instances:
+        writer.writerow(dict(inst, date=inst['date'].isoformat(), tags=', '.join(inst['tags'])))
+
+
+def _write_markdown(stream, instances):
+    for index, inst in enumerate(instances):
+        if index:
+            stream.write('\n')
+        stream.write(format_markdown(inst))
@@ -1,15 +1,13 @@
 import gi
 import datetime
 import neovim
-import tempfile
 import logging
+import os
 import threading
+import time
 from functools import partial
 from dream_dtb import config
 
-from dream_dtb.db import DreamDAO
-from dream_dtb.db import TagDAO
-from dream_dtb.db import DreamTypeDAO
 gi.require_version('Gtk', '3.0')
 gi.require_version('Vte', '2.91')
 from gi.repository import Gtk, Gio, Vte, GLib, GObject
@@ -34,150 +32,6 @@ class RpcEventHandler():
         logger.info("nvim loop finished")
 
 
-class Observable:
-    def __init__(self, initialValue=None):
-        self.data = initialValue
-        self.callbacks = {}
-
-    def addCallback(self, func):
-        self.callbacks[func] = 1
-
-    def delCallback(self, func):
-        del self.callbacks[func]
-
-    def _docallbacks(self):
-        for func in self.callbacks:
-            func(self.data)
-
-    def set(self, data):
-        self.data = data
-        self._docallbacks()
-
-    def get(self):
-        return self.data
-
-    def unset(self):
-        self.data = None
-
-
-class Buffer():
-    """ class representing a list of currently edited buffers (id, tags, dream
-    type, title, recit, date) whether one of the field have been modified or
-    not.  If the dream is not already present in the database id is None.
-    """
-
-    def __init__(self):
-        self.bufs = {}
-
-    def add(self, instance):
-        """ add a buffer to the bufs stack """
-        # TODO: check if the (date, title) does already exists in database +
-        # bufs. If it does open the corresponding dream. otherwise create a new
-        # one.
-        tmpfile = tempfile.mkstemp(dir=config.BUF_PATH)[1]
-        with open(tmpfile, "w") as text_file:
-            print(instance.get('recit', ''), file=text_file, end='')
-        self.bufs[tmpfile] = {'modified': False,
-                              'instance': instance}
-        return tmpfile
-
-    def modify(self, bufname, instance):
-        """ modify a buffer
-        Arguments:
-            - bufname (str): name of the buffer
-            - instance (dict): {'title': title,
-                                'date': date,
-                                'recit': recit,
-                                'tags': tags,
-                                'drtype': drtype}
-        """
-        # TODO: Don't set modified to True if field before = field after
-        self.bufs[bufname]['modified'] = True
-        for key in instance:
-            self.bufs[bufname]['instance'][key] = instance[key]
-
-    def save(self, bufname):
-        """ Save a buffer to the database """
-        # TODO: if buf['instance']['recit'] == '', should I discard writing to
-        # database an empty dream ? or maybe remove the dream from the database
-        # if it already exists
-        buf = self.bufs[bufname]
-        if buf['modified']:
-            if buf['instance'].get('id', None) is None:
-                logger.info("create record...")
-                idnum = DreamDAO.create(buf['instance'])
-                logger.info("done creating record")
-                self.bufs[bufname]['id'] = idnum
-            else:
-                logger.info("modify record...")
-                DreamDAO.update(buf['instance']['id'], buf['instance'])
-                logger.info("done modifying record")
-            self.bufs[bufname]['modified'] = False
-
-    def get_ids(self):
-        idnum = []
-        for elem in self.bufs:
-            idnum.append(self.bufs[elem]['instance']['id'])
-        return idnum
-
-    def get_bufname(self, idnum):
-        """ Return buffername which correspond to idnum """
-        dict_tmp = {k: v for k, v in self.bufs.items() if v['instance']['id'] == idnum}
-        for elem in dict_tmp:
-            return elem
-
-    def save_all(self):
-        logger.info("save all buffer!")
-        for elem in list(self.bufs):
-            logger.info(f'save: {elem}')
-            self.save(elem)
-
-    def remove(self, bufname):
-        """ remove a buffer from the buffer stack """
-        print("buffer removed")
-
-
-class Model:
-    def __init__(self):
-        self.myTree = Observable(DreamDAO.get_tree())
-        self.myCurBuff = Observable()
-        self.myBuffList = Buffer()
-
-    def updateTree(self):
-        self.myTree.set(DreamDAO.get_tree())
-
-    def addDreamBuff(self, instance):
-        return self.myBuffList.add(instance)
-
-    def setDreamMeta(self, bufname, instance):
-        self.myBuffList.modify(bufname, instance)
-
-    def setCurBuff(self, bufname):
-        self.myCurBuff.set(bufname)
-
-    def setCurBuffSilent(self, bufname):
-        """ Set current buffer without triggering the callback
-        """
-        # if bufname has been created from vim, ignore it.
-        if bufname in self.myBuffList.bufs:
-            x = bufname
-        else:
-            x = None
-        setattr(self.myCurBuff, 'data', x)
-
-    def getCurBuff(self):
-        return self.myCurBuff.get()
-
-    def get_inst_buf(self, bufname):
-        return self.myBuffList.bufs[bufname]['instance']
-
-    def get_ids(self):
-        return self.myBuffList.get_ids()
-
-    def get_buf_by_id(self, idnum):
-        return self.myBuffList.get_bufname(idnum)
-
-
 class InfoDialog(Gtk.MessageDialog):
     def __init__(self, parent, main, second):
         super().__init__(parent, 0, Gtk.MessageType.INFO,
@@ -213,9 +67,8 @@ class DreamDialog(Gtk.Dialog):
         self.scrolled_window.set_policy(
             Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
 
+        # filled by set_labels
         self.liststore_tags = Gtk.ListStore(str)
-        for label in TagDAO.get_labels():
-                self.liststore_tags.append([label])
 
         self.liststore_tags_entry = Gtk.ListStore(str)
         self.tags_entry = Gtk.TreeView(model=self.liststore_tags_entry)
@@ -247,8 +100,6 @@ class DreamDialog(Gtk.Dialog):
 
         self.drtype_label = Gtk.Label('Dream type:')
         self.drtype_entry = Gtk.ComboBoxText.new_with_entry()
-        for label in DreamTypeDAO.get_labels():
-                self.drtype_entry.insert_text(-1, label)
 
         self.tag_button_grid = Gtk.Grid()
         self.tag_button_grid.props.row_homogeneous = True
@@ -270,6 +121,17 @@ class DreamDialog(Gtk.Dialog):
 
         self.show_all()
 
+    def set_labels(self, labels):
+        """ Set the choices of the tag and dream type entries
+        Arguments:
+            - labels (tuple): list of tag labels, list of dream type labels
+        """
+        tags, drtypes = labels
+        for label in tags:
+            self.liststore_tags.append([label])
+        for label in drtypes:
+            self.drtype_entry.insert_text(-1, label)
+
     def _set_title(self, title):
         self.title_entry.set_text(title)
 
@@ -377,6 +239,14 @@ class DreamDialog(Gtk.Dialog):
 class Editor(Gtk.Frame):
     """ A Frame containing a Vte terminal widget running neovim
     """
+    # milliseconds between two attempts to connect to a socket not yet
+    # listening, and number of attempts
+    ATTACH_INTERVAL = 20
+    ATTACH_RETRIES = 50
+    # milliseconds between two checks of the socket, in case the directory
+    # monitor does not report its creation
+    ATTACH_FALLBACK = 100
+
     def __init__(self):
         """ Create a terminal widget and connect it to the Frame
         """
@@ -389,24 +259,76 @@ class Editor(Gtk.Frame):
                                      rewrap_on_resize=False)
         self.add(self.terminal)
         self.event_callback = {}
+        # nvim buffer number of the dream buffers {bufname: number}
+        self.buffers = {}
 
     def spawn(self, addr, argv=None):
         """
-        Spawn a child process (neovim) into the terminal widget
+        Spawn a child process (neovim) into the terminal widget. nvim is
+        attached once its rpc socket is created, then 'nvim-ready' is
+        emitted. The socket file exists before nvim listens on it, a
+        refused connection is retried every ATTACH_INTERVAL ms. The socket
+        is also looked for every ATTACH_FALLBACK ms, some gio backends do
+        not emit CHANGES_DONE_HINT.
 
         addr: socket address to connect nvim api to
         argv: list(str): arguments passed to the nvim command
-        rtp: (str): path to additional runtime vim file
         """
-        def callback(*args):
-            """ Callback called only once for connecting to the neovim instance
-            and for additional nvim configuration.
+        retries = iter(range(self.ATTACH_RETRIES))
+        attaching = False
+
+        def attach():
+            """ Connect to the neovim instance, return True to be called again
+            while its socket refuses the connection
             """
-            self.terminal.disconnect(once)
-            self.nvim = neovim.attach('socket', path=addr)
+            try:
+                self.nvim = neovim.attach('socket', path=addr)
+            except OSError as error:
+                if next(retries, None) is None:
+                    logger.error(f"cannot attach nvim on {addr}: {error}")
+                    return False
+                return True
             logger.info("nvim attached")
             self.emit('nvim-setup', self.nvim)
-        once = self.terminal.connect('cursor-moved', callback)
+            return False
+
+        def start():
+            """ Attach once the socket exists, from the monitor or the
+            fallback, whichever comes first
+            """
+            nonlocal attaching
+            if attaching:
+                return
+            attaching = True
+            self.monitor.cancel()
+            if attach():
+                GLib.timeout_add(self.ATTACH_INTERVAL, attach)
+
+        def callback(monitor, file, other, event):
+            """ Called on changes of the socket directory. A socket is not
+            written to: gio emits CHANGES_DONE_HINT right after CREATED.
+            """
+            if event != Gio.FileMonitorEvent.CHANGES_DONE_HINT or file.get_path() != addr:
+                return
+            start()
+
+        def fallback():
+            """ Attach if the socket exists, return True to be called again
+            while it does not
+            """
+            if attaching:
+                return False
+            if os.path.exists(addr):
+                start()
+                return False
+            return True
+        # the monitor is set up before nvim is spawned, so the creation of the
+        # socket cannot be missed
+        os.makedirs(os.path.dirname(addr), exist_ok=True)
+        directory = Gio.File.new_for_path(os.path.dirname(addr))
+        self.monitor = directory.monitor_directory(Gio.FileMonitorFlags.NONE, None)
+        self.monitor.connect('changed', callback)
+        GLib.timeout_add(self.ATTACH_FALLBACK, fallback)
         self.terminal.spawn_sync(Vte.PtyFlags.DEFAULT,
                                  None,
                                  ['nvim', *argv],
@@ -423,13 +345,58 @@ class Editor(Gtk.Frame):
         logger.info("init nvim")
         nvim.subscribe('DreamGuiEvent')
         nvim.vars['gui_channel'] = nvim.channel_id
-        nvim.command(f'set rtp^={config.NVIM_RUNTIME}', async=True)
-        nvim.command('runtime! ginit.vim', async=True)
+        nvim.command(f'set rtp^={config.NVIM_RUNTIME}', async_=True)
+        nvim.command('runtime! ginit.vim', async_=True)
         self.nvim_loop = RpcEventHandler(nvim,
                                          partial(self.emit, 'nvim-request', nvim),
                                          partial(self.emit, 'nvim-notify', nvim))
         self.nvim_loop.start()
-        # self.event_callback['startup'](self.event_callback['startup']['data'])
+        self.emit('nvim-ready')
+
+    @GObject.Signal(flags=GObject.SignalFlags.RUN_LAST)
+    def nvim_ready(self):
+        """ Custom signal 'nvim_ready' emitted once the rpc channel is up and
+        nvim is configured, dreams can then be opened
+        """
+        logger.info("nvim ready")
+
+    def show_buffer(self, bufname, text):
+        """ Switch nvim to the dream buffer bufname, creating it with text
+        the first time. The buffer is written through the BufWriteCmd
+        autocommand of ginit.vim. Must run in the nvim event loop, see
+        View.SetCurBuffer.
+        """
+        if bufname in self.buffers:
+            self.nvim.command(f'buffer {self.buffers[bufname]}')
+            return
+        self.nvim.command('enew')
+        buf = self.nvim.current.buffer
+        buf.name = bufname
+        for option, value in (('buftype', 'acwrite'),
+                              ('bufhidden', 'hide'),
+                              ('swapfile', False)):
+            buf.options[option] = value
+        buf[:] = (text or '').split('\n')
+        buf.options['modified'] = False
+        self.buffers[bufname] = buf.number
+
+    def close_buffers(self, bufnames, callback):
+        """ Wipe the dream buffers bufnames out of nvim, except the ones with
+        changes not written yet. Pass the list of the closed buffers to
+        callback, in the gtk main loop. Must run in the nvim event loop.
+        """
+        closed = []
+        for bufname in bufnames:
+            number = self.buffers.get(bufname)
+            if number is not None:
+                if self.nvim.buffers[number].options['modified']:
+                    continue
+                self.nvim.command(f'bwipeout {number}')
+                del self.buffers[bufname]
+            closed.append(bufname)
+        if closed:
+            logger.info(f'buffers closed: {", ".join(closed)}')
+            GLib.idle_add(callback, closed)
 
     @GObject.Signal(flags=GObject.SignalFlags.RUN_LAST)
     def nvim_notify(self, nvim: object, sub: str, args: object):
@@ -437,9 +404,8 @@ class Editor(Gtk.Frame):
         if sub == 'DreamGuiEvent' and args[0] == 'Save':
             logger.info('notify save event')
             instance = {}
-            with open(args[1], 'r') as myfile:
-                data = myfile.read()
-            instance['recit'] = data
+            # the lines of the buffer are sent along with the event
+            instance['recit'] = '\n'.join(args[2])
             self.event_callback['Save'](args[1], instance)
             logger.info(f'{args[1]} saved !')
         if sub == 'DreamGuiEvent' and args[0] == 'Quit':
@@ -456,9 +422,20 @@ class Editor(Gtk.Frame):
 
 
 class NavigationTree(Gtk.Frame):
+    """ Tree of dreams ordered by year, month and day
+
+    Each row holds (label, dream id, date key, number of dreams). Date rows
+    have an id of DATE_NODE. A date row whose children are not loaded yet
+    holds a single PLACEHOLDER child, replaced by the real children when the
+    row is expanded.
+    """
+
+    DATE_NODE = -1
+    PLACEHOLDER = -2
+
     def __init__(self):
         super().__init__()
-        self.store = Gtk.TreeStore(str, int)
+        self.store = Gtk.TreeStore(str, int, str, int)
         self.tree = Gtk.TreeView(self.store)
 
         self.renderer = Gtk.CellRendererText()
@@ -469,6 +446,167 @@ class NavigationTree(Gtk.Frame):
         self.tree.set_activate_on_single_click = False
         self.add(self.tree)
 
+    def set_loading(self, piter):
+        """ Show that the children of piter are being loaded """
+        child = self.store.iter_children(piter)
+        if child is not None and self.store[child][1] == self.PLACEHOLDER:
+            self.store[child][0] = 'Loading...'
+
+    def append_nodes(self, parent, nodes):
+        """ Append date nodes under parent
+        Arguments:
+            - parent (Gtk.TreeIter): parent row, None for the root
+            - nodes (dict): {key: child} where child is either a dict of
+              nodes, a list of [title, id] dreams or the number of dreams of
+              a node whose children are not loaded yet
+        """
+        for key, child in nodes.items():
+            piter = self.store.append(parent, self._date_row(key, self._count(child)))
+            if isinstance(child, int):
+                self.store.append(piter, ['', self.PLACEHOLDER, '', 0])
+            else:
+                self.set_children(piter, child)
+
+    def set_children(self, piter, children):
+        """ Replace the children of the row piter
+        Arguments:
+            - piter (Gtk.TreeIter): parent row
+            - children (dict or list): date nodes (see append_nodes) or a list
+              of [title, id] dreams
+        """
+        old = []
+        child = self.store.iter_children(piter)
+        while child is not None:
+            old.append(self.store.get_path(child))
+            child = self.store.iter_next(child)
+        # the new children are added before the old ones are removed, so that
+        # an expanded row stays expanded
+        if isinstance(children, list):
+            for title, idnum in children:
+                self.store.append(piter, [title, idnum, '', 0])
+        else:
+            self.append_nodes(piter, children)
+        for path in reversed(old):
+            self.store.remove(self.store.get_iter(path))
+
+    def is_loaded(self, piter):
+        """ Return False if the children of piter are not loaded yet """
+        child = self.store.iter_children(piter)
+        return child is None or self.store[child][1] != self.PLACEHOLDER
+
+    def get_keys(self, piter):
+        """ Return the date keys from the root down to piter
+        e.g: ['2017', '03', '21']
+        """
+        keys = []
+        while piter is not None:
+            keys.insert(0, self.store[piter][2])
+            piter = self.store.iter_parent(piter)
+        return keys
+
+    def apply_changes(self, changes):
+        """ Apply changes to the rows already in the store, without
+        rebuilding it, so that the selection and the expanded rows are kept
+        Arguments:
+            - changes list(db.TreeChange)
+        """
+        for change in changes:
+            if change.action == 'update' and change.old_date == change.date:
+                row = self._find_dream(change.id, change.date)
+                if row is not None:
+                    self.store[row][0] = change.title
+                continue
+            if change.old_date is not None:
+                self._remove_dream(change.id, change.old_date)
+            if change.date is not None:
+                self._insert_dream(change.id, change.title, change.date)
+
+    @staticmethod
+    def date_keys(date):
+        """ Return the [year, month, day] keys of a date """
+        return [f'{date.year:04d}', f'{date.month:02d}', f'{date.day:02d}']
+
+    def _date_row(self, key, count):
+        return [f'{key} ({count})', self.DATE_NODE, key, count]
+
+    def _count(self, child):
+        """ Return the number of dreams below a node (see append_nodes) """
+        if isinstance(child, int):
+            return child
+        if isinstance(child, list):
+            return len(child)
+        return sum(self._count(elem) for elem in child.values())
+
+    def _set_count(self, piter, count):
+        self.store[piter] = self._date_row(self.store[piter][2], count)
+
+    def _find_child(self, parent, key):
+        """ Return the child row of parent whose date key is key or None """
+        child = self.store.iter_children(parent)
+        while child is not None and self.store[child][2] != key:
+            child = self.store.iter_next(child)
+        return child
+
+    def _find_dream(self, idnum, date):
+        """ Return the row of a dream or None if it is not loaded """
+        parent = None
+        for key in self.date_keys(date):
+            parent = self._find_child(parent, key)
+            if parent is None or not self.is_loaded(parent):
+                return None
+        child = self.store.iter_children(parent)
+        while child is not None and self.store[child][1] != idnum:
+            child = self.store.iter_next(child)
+        return child
+
+    def _remove_dream(self, idnum, date):
+        """ Remove a dream row, update the count of its date rows and remove
+        the date rows left empty
+        """
+        nodes = []
+        parent = None
+        for key in self.date_keys(date):
+            parent = self._find_child(parent, key)
+            if parent is None:
+                return
+            nodes.append(parent)
+            if not self.is_loaded(parent):
+                break
+        else:
+            row = self._find_dream(idnum, date)
+            if row is None:
+                return
+            self.store.remove(row)
+
+        for node in reversed(nodes):
+            count = self.store[node][3] - 1
+            if count > 0:
+                self._set_count(node, count)
+            else:
+                self.store.remove(node)
+
+    def _insert_dream(self, idnum, title, date):
+        """ Insert a dream row, creating its date rows if needed. Rows that
+        are not loaded only get their count updated.
+        """
+        parent = None
+        for key in self.date_keys(date):
+            node = self._find_child(parent, key)
+            if node is None:
+                node = self._insert_date_node(parent, key)
+            self._set_count(node, self.store[node][3] + 1)
+            if not self.is_loaded(node):
+                return
+            parent = node
+        self.store.append(parent, [title, idnum, '', 0])
+
+    def _insert_date_node(self, parent, key):
+        """ Insert an empty date row under parent, keeping the keys sorted """
+        sibling = self.store.iter_children(parent)
+        while sibling is not None and self.store[sibling][2] < key:
+            sibling = self.store.iter_next(sibling)
+        return self.store.insert_before(parent, sibling, self._date_row(key, 0))
+
 
 class MenuBar(Gtk.HeaderBar):
     def __init__(self):
@@ -486,6 +624,14 @@ class MenuBar(Gtk.HeaderBar):
 
         self.pack_start(box)
 
+        self.search = Gtk.SearchEntry()
+        self.search.set_placeholder_text("Search dreams")
+        self.pack_end(self.search)
+
+        # spinning while database queries are in flight
+        self.spinner = Gtk.Spinner()
+        self.pack_end(self.spinner)
+
 
 class View(Gtk.Window):
     def __init__(self):
@@ -515,35 +661,56 @@ class View(Gtk.Window):
         self.paned.add1(self.navigationbar)
         self.paned.add2(self.edit)
 
+    def SetLoading(self, loading):
+        if loading:
+            self.menubar.spinner.start()
+        else:
+            self.menubar.spinner.stop()
+
     def SetTree(self, tree):
         self.navigationbar.store.clear()
-        for year in tree:
-            piter = self.navigationbar.store.append(None, [year, -1])
-            for month in tree[year]:
-                piter2 = self.navigationbar.store.append(piter, [month, -1])
-                for day in tree[year][month]:
-                    piter3 = self.navigationbar.store.append(piter2, [day, -1])
-                    for dream in tree[year][month][day]:
-                        self.navigationbar.store.append(piter3, dream)
+        self.navigationbar.append_nodes(None, tree)
+
+    def SetSubTree(self, piter, children):
+        self.navigationbar.set_children(piter, children)
 
-    def SetCurBuffer(self, bufname):
-        self.edit.nvim.command(f'edit {bufname}', async=True)
+    def ApplyTreeChanges(self, changes):
+        self.navigationbar.apply_changes(changes)
+
+    def SetSearchTree(self, tree):
+        self.SetTree(tree)
+        self.navigationbar.tree.expand_all()
+
+    def SetCurBuffer(self, bufname, text):
+        # the nvim api is not thread safe, the buffer is set up by the nvim
+        # event loop
+        self.edit.nvim.async_call(self.edit.show_buffer, bufname, text)
+
+    def CloseBuffers(self, bufnames, callback):
+        self.edit.nvim.async_call(self.edit.close_buffers, bufnames, callback)
 
 
 class Controller:
     def __init__(self, instance):
-        # Create view and model
-        self.model = Model()
+        self.started = time.perf_counter()
+        # Create view and model. The view spawns nvim first, it starts while
+        # the database is opened and upgraded (on import of the model) and
+        # while the model loads the tree and the labels.
         self.view = View()
+        from dream_dtb.model import Model
+        self.model = Model()
 
         # Add callback to the model
         self.model.myTree.addCallback(self.TreeChanged)
+        self.model.myTreeDelta.addCallback(self.TreeDeltaChanged)
         self.model.myCurBuff.addCallback(self.CurBuffChanged)
+        self.model.myLoading.addCallback(self.LoadingChanged)
+        # generation of the last search, older results are dropped
+        self.search_id = 0
 
         # Add callback for neovim rpc event
-        # TODO: make model wrapper for myBuffList.modify() and myBuffList.save_all
-        self.view.edit.event_callback['Save'] = self.model.myBuffList.modify
-        self.view.edit.event_callback['Quit'] = self.model.myBuffList.save_all
+        self.view.edit.event_callback['Save'] = self.model.saveDream
+        self.view.edit.event_callback['Quit'] = self.model.flush
         # modify Observable without triggering the Observable callbacks
         self.view.edit.event_callback['Current'] = self.model.setCurBuffSilent
 
@@ -551,41 +718,35 @@ class Controller:
         self.view.connect("delete-event", self.on_close_main)
         self.view.edit.terminal.connect("child-exited", self.on_child_exit)
         self.view.navigationbar.tree.connect("row-activated", self.on_tree_double_click)
+        self.view.navigationbar.tree.connect("test-expand-row", self.on_tree_expand)
         self.view.menubar.newdream.connect("clicked", self.on_newdream_click)
         self.view.menubar.moddream.connect("clicked", self.on_moddream_click)
+        self.view.menubar.search.connect("search-changed", self.on_search_changed)
+        self.view.edit.connect("nvim-ready", self.on_nvim_ready, instance)
 
-        # Init the view
-        self.TreeChanged(self.model.myTree.get())
-        # Allow to run self.on_startup periodically. We are waiting for nvim to
-        # be initialized. self.on_startup must return False for stopping the
-        # GLib to stop.
-        GLib.timeout_add(100, self.on_startup, instance)
+        # Init the view, the tree is shown once loaded
+        self.model.warm_up()
 
         self.view.show_all()
+        self.log_startup('window shown')
 
-    def on_startup(self, instance):
+    def on_nvim_ready(self, editor, instance):
         """ Open an initial dream specified on the command line
         """
         if instance is not None:
-            logger.info("try opening initial instance")
-            try:
-                self.view.edit.nvim
-            except AttributeError:
-                logger.warning("nvim does not exists")
-                var_exists = False
-            else:
-                logger.warning("nvim does exists")
-                var_exists = True
-            if var_exists:
-                self.AddDream(instance)
-            return not var_exists
+            logger.info("opening initial instance")
+            self.AddDream(instance)
         else:
             logger.info("initial instance empty")
-            return False
+        # queued after the buffer set up of AddDream
+        editor.nvim.async_call(self.log_startup, 'first buffer editable')
+
+    def log_startup(self, step):
+        logger.info(f'startup: {step} after {(time.perf_counter() - self.started) * 1000:.0f} ms')
 
     def on_close_main(self, *args):
         logger.info("close event")
-        self.view.edit.nvim.command('xa!', async=True)
+        self.view.edit.nvim.command('xa!', async_=True)
         # The default behavior is to propagate the close signal into the
         # destroy event. To stop the propagation the handler must return True
         return True
@@ -594,6 +755,7 @@ class Controller:
         logger.info("modify dream clicked")
         if self.model.getCurBuff() is not None:
             dialog = DreamDialog(self.view)
+            self.model.get_labels(dialog.set_labels)
             bufname = self.model.getCurBuff()
             dialog.set_dialog(self.model.get_inst_buf(bufname))
 
@@ -609,6 +771,7 @@ class Controller:
     def on_newdream_click(self, *args):
         logger.info("add dream clicked")
         dialog = DreamDialog(self.view)
+        self.model.get_labels(dialog.set_labels)
 
         instance = dialog.spawn()
 
@@ -618,6 +781,9 @@ class Controller:
     def on_child_exit(self, *args):
         logger.info("nvim exited")
         self.view.edit.nvim_loop.stop()
+        # nvim may have exited without sending Quit (crash, kill)
+        self.model.flush()
+        self.model.db.shutdown()
         self.view.destroy()
         Gtk.main_quit()
 
@@ -625,30 +791,98 @@ class Controller:
         """ callback when an item of the treeview has been double-clicked
         """
         if path.get_depth() == 4:
-            logger.info(f'double click on dream id: {self.view.navigationbar.store[path][1]}')
-            instance = DreamDAO.find_by_id(self.view.navigationbar.store[path][1])
-            if instance['id'] not in self.model.get_ids():
-                self.AddDream(instance)
+            idnum = self.view.navigationbar.store[path][1]
+            logger.info(f'double click on dream id: {idnum}')
+            if idnum in self.model.get_ids():
+                logger.info(f"instance: {idnum} already in bufflist")
+                self.model.setCurBuff(self.model.get_buf_by_id(idnum))
             else:
-                logger.info(f"instance: {instance['id']} already in bufflist")
-                tmp_val = self.model.myBuffList.get_bufname(instance['id'])
-                bufname = self.model.get_buf_by_id(instance['id'])
-                self.model.setCurBuff(bufname)
+                self.model.find_dream(idnum, self.DreamLoaded)
         else:
             logger.info("double click on date (year, month, or day)")
 
+    def on_tree_expand(self, tree_view, treeiter, path):
+        """ callback before a row of the treeview is expanded. Load the
+        children of the row if they are not loaded yet.
+        """
+        navigationbar = self.view.navigationbar
+        if not navigationbar.is_loaded(treeiter):
+            keys = navigationbar.get_keys(treeiter)
+            logger.info(f'load tree node: {keys}')
+            navigationbar.set_loading(treeiter)
+            # the row may be moved or removed before its children are loaded
+            row = Gtk.TreeRowReference.new(navigationbar.store, path)
+            self.model.get_subtree(keys, partial(self.SubTreeLoaded, row))
+        # returning False allows the row to expand
+        return False
+
+    def on_search_changed(self, entry):
+        """ callback when the search entry text changed. Filter the navigation
+        tree, or reload it when the entry is emptied: the dreams created,
+        renamed or deleted while searching are not in the tree loaded before.
+        """
+        query = entry.get_text().strip()
+        self.search_id += 1
+        if query:
+            logger.info(f'search: {query}')
+            self.model.search(query, partial(self.SearchDone, self.search_id))
+        else:
+            self.model.updateTree()
+
     def AddDream(self, instance):
         bufname = self.model.addDreamBuff(instance)
         self.model.setCurBuff(bufname)
 
+    def DreamLoaded(self, instance):
+        if instance['id'] in self.model.get_ids():
+            # double clicked again while loading
+            self.model.setCurBuff(self.model.get_buf_by_id(instance['id']))
+        else:
+            self.AddDream(instance)
+
+    def SubTreeLoaded(self, row, children):
+        if row.valid():
+            store = self.view.navigationbar.store
+            piter = store.get_iter(row.get_path())
+            if not self.view.navigationbar.is_loaded(piter):
+                self.view.SetSubTree(piter, children)
+
+    def SearchDone(self, search_id, tree):
+        # results of an outdated query are dropped
+        if search_id == self.search_id:
+            self.view.SetSearchTree(tree)
+
+    def LoadingChanged(self, loading):
+        self.view.SetLoading(loading)
+
     def DreamMetaChanged(self, bufname, instance):
         self.model.setDreamMeta(bufname, instance)
 
     def TreeChanged(self, tree):
-        self.view.SetTree(tree)
+        # the search results stay in place until the search entry is emptied
+        if not self.view.menubar.search.get_text().strip():
+            self.view.SetTree(tree)
+
+    def TreeDeltaChanged(self, changes):
+        # changes may be committed outside of the gtk main loop (e.g: from the
+        # nvim event loop thread)
+        GLib.idle_add(self.ApplyTreeChanges, changes)
+
+    def ApplyTreeChanges(self, changes):
+        # the search results are not updated, the whole tree is reloaded when
+        # the search entry is emptied
+        if not self.view.menubar.search.get_text().strip():
+            self.view.ApplyTreeChanges(changes)
 
     def CurBuffChanged(self, bufname):
-        self.view.SetCurBuffer(bufname)
+        self.view.SetCurBuffer(bufname, self.model.get_inst_buf(bufname).get('recit', ''))
+        bufnames = self.model.get_buffers_to_close()
+        if bufnames:
+            self.view.CloseBuffers(bufnames, self.BuffersClosed)
+
+    def BuffersClosed(self, bufnames):
+        for bufname in bufnames:
+            self.model.close_buffer(bufname)
 
     def RunGui(self):
         Gtk.main()
@@ -665,4 +899,3 @@ class Controller:
 # should not be used in newly-written code.  Use vte_terminal_spawn_async()
 # instead. Not sure what my version is, but vte_terminal_spawn_async is not
 # available.
-# TODO: trigger TreeChanged on db modified
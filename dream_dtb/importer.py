@@ -0,0 +1,248 @@
+"""
+Bulk import of dreams
+
+Dreams are streamed from the journal files (see formats) and written by
+batches: each batch is one transaction using executemany inserts. Tags and
+dream types are resolved through an in-memory label cache, so that a label
+is looked up in the database only once per import.
+
+Statements are plain sql sent as is to the sqlite driver: compiling
+SQLAlchemy constructs for every row dominates the import time otherwise.
+Values are therefore stored in the formats SQLAlchemy uses for the DATE and
+DATETIME columns of the db models, and the bodies encoded as CompressedText
+does.
+"""
+import datetime
+import logging
+from collections import Counter
+from itertools import islice
+
+from sqlalchemy import select
+
+from dream_dtb.compression import encode
+from dream_dtb.db import Dream
+from dream_dtb.db import DreamStat
+from dream_dtb.db import DreamType
+from dream_dtb.db import RevisionDAO
+from dream_dtb.db import Tag
+from dream_dtb.db import drtype
+from dream_dtb.db import tags
+from dream_dtb.db import word_count
+from dream_dtb.engine import Engine
+
+logger = logging.getLogger('dream_logger')
+
+# storage format of SQLAlchemy sqlite DATETIME columns
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+# what to do with a dream whose (title, date) is already in the database
+DUPLICATES = ['skip', 'update', 'fail']
+
+
+class DuplicateError(ValueError):
+    """ Raised when a duplicate dream is imported with on_duplicate='fail' """
+
+
+def chunks(iterable, size):
+    """ Yield lists of at most size elements of iterable """
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+class Importer:
+    """ Import dreams by batches
+    Arguments:
+        - on_duplicate (str): one of DUPLICATES
+        - batch_size (int): number of dreams written per transaction
+    """
+
+    BATCH_SIZE = 5000
+    # maximum number of bound parameters of an IN clause (sqlite limit)
+    IN_SIZE = 500
+
+    def __init__(self, on_duplicate='skip', batch_size=BATCH_SIZE, engine=Engine):
+        if on_duplicate not in DUPLICATES:
+            raise ValueError(f'on_duplicate must be one of {DUPLICATES}')
+        self.on_duplicate = on_duplicate
+        self.batch_size = batch_size
+        self.engine = engine
+        # label caches {label: id}
+        self.tag_ids = {}
+        self.type_ids = {}
+        # number of created, updated, unchanged and skipped dreams
+        self.counts = Counter()
+
+    def run(self, instances):
+        """ Import instances (see DreamDAO.create), one transaction per batch.
+        Batches committed before a DuplicateError are kept.
+        Return:
+            Counter: number of created, updated, unchanged (duplicates
+            identical to the stored dream when updating) and skipped dreams
+        """
+        for batch in chunks(instances, self.batch_size):
+            with self.engine.begin() as conn:
+                self._import_batch(conn, batch)
+            logger.info(f'import: {sum(self.counts.values())} dreams')
+        return self.counts
+
+    def _import_batch(self, conn, batch):
+        # a (title, date) repeated in the batch follows on_duplicate too, as
+        # when the copies end up in different batches
+        instances = {}
+        # first copy of the repeated ones, compared to the stored dream
+        firsts = {}
+        for inst in batch:
+            key = (inst['title'], inst['date'].isoformat())
+            if key not in instances:
+                instances[key] = inst
+            elif self.on_duplicate == 'fail':
+                raise DuplicateError(f'dream imported twice: {key[1]} {key[0]}')
+            elif self.on_duplicate == 'skip':
+                self.counts['skipped'] += 1
+            else:
+                unchanged = self._fields(inst) == self._fields(instances[key])
+                self.counts['unchanged' if unchanged else 'updated'] += 1
+                firsts.setdefault(key, instances[key])
+                instances[key] = inst
+        existing = self._find_ids(conn, instances)
+
+        if existing and self.on_duplicate == 'fail':
+            title, date = next(iter(existing))
+            raise DuplicateError(f'dream already exists: {date} {title}')
+
+        now = datetime.datetime.utcnow().strftime(DATETIME_FORMAT)
+        path = self.engine.url.database
+        new = [(title, date, encode(inst['recit'], path), now, now)
+               for (title, date), inst in instances.items() if (title, date) not in existing]
+        if new:
+            conn.execute(f'INSERT INTO {Dream.__tablename__} (title, date, recit, created, updated) '
+                         'VALUES (?, ?, ?, ?, ?)', new)
+            self.counts['created'] += len(new)
+
+        if self.on_duplicate == 'update' and existing:
+            stored = self._stored(conn, existing.values())
+            for key, idnum in existing.items():
+                unchanged = stored[idnum] == self._fields(firsts.get(key, instances[key]))
+                self.counts['unchanged' if unchanged else 'updated'] += 1
+            changed = {key: idnum for key, idnum in existing.items()
+                       if stored[idnum] != self._fields(instances[key])}
+            if changed:
+                self._update(conn, [(idnum, instances[key]) for key, idnum in changed.items()], now)
+            existing = {key: idnum for key, idnum in existing.items() if key not in changed}
+        else:
+            self.counts['skipped'] += len(existing)
+        # the duplicates left untouched are not linked again
+        instances = {key: inst for key, inst in instances.items() if key not in existing}
+
+        ids = self._find_ids(conn, instances)
+        self._link(conn, ids, instances)
+        if instances:
+            conn.execute(f'INSERT OR REPLACE INTO {DreamStat.__tablename__} (id, words) VALUES (?, ?)',
+                         [(ids[key], word_count(inst['recit'])) for key, inst in instances.items()])
+
+    def _update(self, conn, rows, now):
+        """ Overwrite existing dreams and drop their tags and type, they are
+        linked again afterward. A revision of each modified body is recorded.
+        Arguments:
+            - rows list((id, instance))
+        """
+        bodies = dict(rows)
+        changed = datetime.datetime.strptime(now, DATETIME_FORMAT)
+        for chunk in chunks(list(bodies), self.IN_SIZE):
+            old = conn.execute(select([Dream.id, Dream.recit, Dream.updated])
+                               .where(Dream.id.in_(chunk))).fetchall()
+            for idnum, recit, updated in old:
+                if recit != bodies[idnum]['recit']:
+                    RevisionDAO._record(conn, idnum, bodies[idnum]['recit'], recit, updated, changed)
+        # unchanged bodies are not rewritten, which would also reindex them
+        conn.execute(f'UPDATE {Dream.__tablename__} SET recit = ?, updated = ? '
+                     'WHERE id = ? AND inflate(recit) IS NOT ?',
+                     [(encode(inst['recit'], self.engine.url.database), now, idnum, inst['recit'])
+                      for idnum, inst in rows])
+        for chunk in chunks([idnum for idnum, _ in rows], self.IN_SIZE):
+            marks = ', '.join('?' * len(chunk))
+            conn.execute(f'DELETE FROM {tags.name} WHERE dream_id IN ({marks})', chunk)
+            conn.execute(f'DELETE FROM {drtype.name} WHERE dream_id IN ({marks})', chunk)
+
+    @staticmethod
+    def _fields(instance):
+        """ Return the (recit, tags, drtype) of instance compared to the
+        stored dreams, see _stored
+        """
+        return instance['recit'] or '', frozenset(instance['tags']), instance['drtype'] or ''
+
+    def _stored(self, conn, ids):
+        """ Return {id: (recit, tags, drtype)} of the stored dreams whose id
+        is in ids, tags being a frozenset and drtype '' for no type
+        """
+        fields = {}
+        for chunk in chunks(list(ids), self.IN_SIZE):
+            marks = ', '.join('?' * len(chunk))
+            rows = conn.execute(f'SELECT id, inflate(recit) FROM {Dream.__tablename__} '
+                                f'WHERE id IN ({marks})', chunk)
+            fields.update((idnum, [recit or '', set(), '']) for idnum, recit in rows)
+            rows = conn.execute(f'SELECT {tags.name}.dream_id, {Tag.__tablename__}.label '
+                                f'FROM {tags.name} JOIN {Tag.__tablename__} '
+                                f'ON {Tag.__tablename__}.id = {tags.name}.tag_id '
+                                f'WHERE {tags.name}.dream_id IN ({marks})', chunk)
+            for idnum, label in rows:
+                fields[idnum][1].add(label)
+            rows = conn.execute(f'SELECT {drtype.name}.dream_id, {DreamType.__tablename__}.label '
+                                f'FROM {drtype.name} JOIN {DreamType.__tablename__} '
+                                f'ON {DreamType.__tablename__}.id = {drtype.name}.type_id '
+                                f'WHERE {drtype.name}.dream_id IN ({marks})', chunk)
+            for idnum, label in rows:
+                fields[idnum][2] = label
+        return {idnum: (recit, frozenset(labels), label)
+                for idnum, (recit, labels, label) in fields.items()}
+
+    def _find_ids(self, conn, instances):
+        """ Return {(title, date): id} of the instances keys stored in the
+        database
+        """
+        ids = {}
+        for chunk in chunks({title for title, _ in instances}, self.IN_SIZE):
+            rows = conn.execute(f'SELECT title, date, id FROM {Dream.__tablename__} WHERE title IN ({{}})'
+                                .format(', '.join('?' * len(chunk))), chunk)
+            for title, date, idnum in rows:
+                if (title, date) in instances:
+                    ids[(title, date)] = idnum
+        return ids
+
+    def _link(self, conn, ids, instances):
+        """ Insert the tags and dream type links of the instances
+        Arguments:
+            - ids (dict): {(title, date): id}
+            - instances (dict): {(title, date): instance}
+        """
+        tag_ids = self._label_ids(conn, Tag.__tablename__, self.tag_ids,
+                                  {tag for inst in instances.values() for tag in inst['tags']})
+        type_ids = self._label_ids(conn, DreamType.__tablename__, self.type_ids,
+                                   {inst['drtype'] for inst in instances.values() if inst['drtype']})
+
+        tag_rows = [(ids[key], tag_ids[tag])
+                    for key, inst in instances.items() for tag in inst['tags']]
+        type_rows = [(ids[key], type_ids[inst['drtype']])
+                     for key, inst in instances.items() if inst['drtype']]
+        if tag_rows:
+            conn.execute(f'INSERT OR IGNORE INTO {tags.name} (dream_id, tag_id) VALUES (?, ?)', tag_rows)
+        if type_rows:
+            conn.execute(f'INSERT OR IGNORE INTO {drtype.name} (dream_id, type_id) VALUES (?, ?)', type_rows)
+
+    def _label_ids(self, conn, table, cache, labels):
+        """ Return {label: id} for labels of table (tag or dreamtype),
+        creating the missing ones. Labels already resolved during this import
+        come from cache.
+        """
+        missing = [label for label in labels if label not in cache]
+        if missing:
+            conn.execute(f'INSERT OR IGNORE INTO {table} (label) VALUES (?)',
+                         [(label,) for label in missing])
+            for chunk in chunks(missing, self.IN_SIZE):
+                rows = conn.execute(f'SELECT label, id FROM {table} WHERE label IN ({{}})'
+                                    .format(', '.join('?' * len(chunk))), chunk)
+                cache.update(rows.fetchall())
+        return cache
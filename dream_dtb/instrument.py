@@ -0,0 +1,194 @@
+"""
+Instrumentation of the database calls
+
+With [profile] trace = yes in dreamrc, every public method of the DAO
+classes decorated with instrumented is timed, along with the number and the
+duration of the sql statements it runs. Each call is appended as a json line
+to TRACE_PATH, each process starting with a session line. dreamdtb profile
+summarizes the calls of a session from the trace (see report).
+
+The statements slower than [profile] slow_query milliseconds are logged
+with their query plan, at the debug level. The slow query log is off unless
+slow_query is set or the trace enabled, without either of them the
+statement hooks are not installed.
+
+The statements are counted by SQLAlchemy cursor events, so the statements
+of the connections that do not belong to the engine (the read pool of the
+web server) are not counted.
+"""
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from sqlalchemy import event
+
+from dream_dtb import config
+
+logger = logging.getLogger('dream_logger')
+
+# upper bounds (milliseconds) of the buckets of the latency histograms
+BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, float('inf')]
+
+
+class Trace:
+    """ Append only json lines file, shared by the threads of a process """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.stream = None
+
+    def write(self, record):
+        line = json.dumps(record, default=str) + '\n'
+        with self.lock:
+            if self.stream is None:
+                self.stream = open(self.path, 'a', encoding='utf-8', buffering=1)
+                self.stream.write(json.dumps({'type': 'session', 'pid': os.getpid(),
+                                              'argv': sys.argv[1:], 'time': time.time()}) + '\n')
+            self.stream.write(line)
+
+
+trace = Trace(config.TRACE_PATH)
+# DAO calls in progress in the current thread, innermost last
+_local = threading.local()
+
+
+def _calls():
+    if not hasattr(_local, 'calls'):
+        _local.calls = []
+    return _local.calls
+
+
+def instrumented(cls):
+    """ Class decorator timing the public classmethods of a DAO when the
+    trace is enabled
+    """
+    if not config.PROFILE_TRACE:
+        return cls
+    for name, attr in list(vars(cls).items()):
+        if isinstance(attr, classmethod) and not name.startswith('_'):
+            setattr(cls, name, classmethod(_timed(attr.__func__, f'{cls.__name__}.{name}')))
+    return cls
+
+
+def _timed(func, name):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        calls = _calls()
+        call = {'type': 'call', 'name': name, 'depth': len(calls),
+                'statements': 0, 'sql_ms': 0.0}
+        calls.append(call)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            call['ms'] = (time.perf_counter() - start) * 1000
+            calls.pop()
+            trace.write(call)
+    return wrapper
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_start'] = time.perf_counter()
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = (time.perf_counter() - conn.info.pop('query_start')) * 1000
+    # the statements of nested calls also count for the calls around them
+    for call in _calls():
+        call['statements'] += 1
+        call['sql_ms'] += elapsed
+    if config.SLOW_QUERY and elapsed >= config.SLOW_QUERY:
+        _log_slow_query(cursor, statement, parameters, executemany, elapsed)
+
+
+def _log_slow_query(cursor, statement, parameters, executemany, elapsed):
+    """ Log a slow statement with its query plan, and trace it """
+    plan = []
+    if not executemany and statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE', 'WITH')):
+        try:
+            rows = cursor.connection.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+            plan = [row[-1] for row in rows]
+        except Exception:
+            logger.exception('explain failed')
+    calls = _calls()
+    logger.debug(f"slow query ({elapsed:.1f}ms"
+                 f"{' in ' + calls[-1]['name'] if calls else ''}): {' '.join(statement.split())}"
+                 + ''.join(f'\n    {detail}' for detail in plan))
+    if config.PROFILE_TRACE:
+        trace.write({'type': 'slow', 'name': calls[-1]['name'] if calls else None,
+                     'ms': elapsed, 'sql': statement, 'plan': plan})
+
+
+def setup(engine):
+    """ Listen to the statements of engine if the trace or the slow query
+    log is enabled
+    """
+    if config.PROFILE_TRACE or config.SLOW_QUERY:
+        event.listen(engine, 'before_cursor_execute', _before_execute)
+        event.listen(engine, 'after_cursor_execute', _after_execute)
+
+
+def read_sessions(path=config.TRACE_PATH):
+    """ Return the records of a trace file grouped by session, oldest first
+    """
+    sessions = []
+    with open(path, encoding='utf-8') as stream:
+        for line in stream:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # a line cut by a crash
+                continue
+            if record['type'] == 'session':
+                sessions.append({'session': record, 'records': []})
+            elif sessions:
+                sessions[-1]['records'].append(record)
+    return sessions
+
+
+def percentile(values, ratio):
+    """ Return the ratio (0 to 1) percentile of sorted values """
+    return values[min(int(len(values) * ratio), len(values) - 1)]
+
+
+def report(records, nested=False):
+    """ Summarize the DAO calls of records
+    Arguments:
+        - records: trace records, see read_sessions
+        - nested (bool): also count the calls made by other DAO calls
+    Return:
+        dict: {name: {'calls', 'total', 'p50', 'p95', 'max', 'statements',
+        'sql', 'histogram'}} ordered by total time, times in milliseconds,
+        statements per call and histogram the number of calls per bucket of
+        BUCKETS
+    """
+    durations = {}
+    statements = {}
+    sql = {}
+    for record in records:
+        if record['type'] != 'call' or (record['depth'] and not nested):
+            continue
+        durations.setdefault(record['name'], []).append(record['ms'])
+        statements[record['name']] = statements.get(record['name'], 0) + record['statements']
+        sql[record['name']] = sql.get(record['name'], 0) + record['sql_ms']
+
+    summary = {}
+    for name, values in sorted(durations.items(), key=lambda item: -sum(item[1])):
+        values.sort()
+        histogram = [0] * len(BUCKETS)
+        for value in values:
+            histogram[next(i for i, bound in enumerate(BUCKETS) if value <= bound)] += 1
+        summary[name] = {'calls': len(values),
+                         'total': sum(values),
+                         'p50': percentile(values, 0.5),
+                         'p95': percentile(values, 0.95),
+                         'max': values[-1],
+                         'statements': statements[name] / len(values),
+                         'sql': sql[name],
+                         'histogram': histogram}
+    return summary
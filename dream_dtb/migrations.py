@@ -0,0 +1,361 @@
+"""
+Versioned migrations of the database schema
+
+The schema version is stored in the sqlite header (PRAGMA user_version).
+MIGRATIONS[n] upgrades a database from version n to n + 1, so that a
+database at version 0 (new, or created before migrations existed) is brought
+to SCHEMA_VERSION by running all of them. When the schema is current, startup
+only reads the version.
+
+Each migration runs in its own transaction together with the version bump.
+Migrations are frozen: they must keep producing the schema of their version
+even when the models of db.py evolve, so they only use plain sql (and the
+inflate function that engine connections get from compression) and never
+import db. Migrations copying rows work by batches of rowids and log their
+progress.
+"""
+import logging
+
+logger = logging.getLogger('dream_logger')
+
+# rows copied per statement by the data migrations
+BATCH_SIZE = 20000
+
+
+def _baseline(conn):
+    """ Tables of dream-dtb 0.1 """
+    conn.execute("""CREATE TABLE IF NOT EXISTS dream (
+        id INTEGER NOT NULL,
+        created DATETIME NOT NULL,
+        updated DATETIME NOT NULL,
+        title VARCHAR NOT NULL,
+        recit TEXT,
+        date DATE NOT NULL,
+        PRIMARY KEY (id),
+        CONSTRAINT _title_date_uc UNIQUE (title, date))""")
+    for table in ('tag', 'dreamtype'):
+        conn.execute(f"""CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER NOT NULL,
+            label VARCHAR,
+            PRIMARY KEY (id),
+            UNIQUE (label))""")
+    for table, column, ref in (('tags', 'tag_id', 'tag'), ('drtype', 'type_id', 'dreamtype')):
+        conn.execute(f"""CREATE TABLE IF NOT EXISTS {table} (
+            dream_id INTEGER,
+            {column} INTEGER,
+            FOREIGN KEY(dream_id) REFERENCES dream (id),
+            FOREIGN KEY({column}) REFERENCES {ref} (id))""")
+
+
+def _full_text_index(conn):
+    """ External content FTS5 index of the dreams title and body, kept in
+    sync by triggers
+    """
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'dream_fts'").fetchone()
+    conn.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS dream_fts
+        USING fts5(title, recit, content='dream', content_rowid='id')""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS dream_fts_ai AFTER INSERT ON dream BEGIN
+          INSERT INTO dream_fts(rowid, title, recit)
+          VALUES (new.id, new.title, new.recit);
+        END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS dream_fts_ad AFTER DELETE ON dream BEGIN
+          INSERT INTO dream_fts(dream_fts, rowid, title, recit)
+          VALUES ('delete', old.id, old.title, old.recit);
+        END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS dream_fts_au AFTER UPDATE OF title, recit ON dream BEGIN
+          INSERT INTO dream_fts(dream_fts, rowid, title, recit)
+          VALUES ('delete', old.id, old.title, old.recit);
+          INSERT INTO dream_fts(rowid, title, recit)
+          VALUES (new.id, new.title, new.recit);
+        END""")
+    if not exists:
+        logger.info("migration: build full text index")
+        conn.execute("INSERT INTO dream_fts(dream_fts) VALUES ('rebuild')")
+
+
+def _word_count(recit):
+    """ Number of words of a dream body, as counted by _dream_stats """
+    return len(recit.split()) if recit else 0
+
+
+def _dream_stats(conn):
+    """ Word count of each dream, filled from the existing dreams """
+    conn.execute("""CREATE TABLE IF NOT EXISTS dreamstat (
+        id INTEGER NOT NULL,
+        words INTEGER NOT NULL,
+        PRIMARY KEY (id),
+        FOREIGN KEY(id) REFERENCES dream (id))""")
+    for low, high in _batches(conn, 'dream', 'dream stats'):
+        rows = conn.execute("""SELECT id, recit FROM dream
+                               WHERE id BETWEEN ? AND ?
+                               AND id NOT IN (SELECT id FROM dreamstat)""", (low, high))
+        conn.executemany("INSERT INTO dreamstat (id, words) VALUES (?, ?)",
+                         [(idnum, _word_count(recit)) for idnum, recit in rows])
+
+
+def _association_keys(conn):
+    """ Composite primary keys and reverse indexes of the association tables,
+    duplicate links are dropped. Index of the tree order.
+    """
+    for table, column, ref in (('tags', 'tag_id', 'tag'), ('drtype', 'type_id', 'dreamtype')):
+        conn.execute(f"DROP TABLE IF EXISTS {table}_new")
+        conn.execute(f"""CREATE TABLE {table}_new (
+            dream_id INTEGER NOT NULL,
+            {column} INTEGER NOT NULL,
+            PRIMARY KEY (dream_id, {column}),
+            FOREIGN KEY(dream_id) REFERENCES dream (id),
+            FOREIGN KEY({column}) REFERENCES {ref} (id))""")
+        for low, high in _batches(conn, table, f'{table} keys'):
+            conn.execute(f"""INSERT OR IGNORE INTO {table}_new (dream_id, {column})
+                             SELECT dream_id, {column} FROM {table}
+                             WHERE rowid BETWEEN ? AND ?
+                             AND dream_id IS NOT NULL AND {column} IS NOT NULL""", (low, high))
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+        conn.execute(f"CREATE INDEX ix_{table}_{column} ON {table} ({column}, dream_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_dream_date_created ON dream (date, created)")
+
+
+def _revisions(conn):
+    """ Revisions of the dreams body, see revisions """
+    conn.execute("""CREATE TABLE IF NOT EXISTS revision (
+        id INTEGER NOT NULL,
+        dream_id INTEGER NOT NULL,
+        number INTEGER NOT NULL,
+        created DATETIME NOT NULL,
+        snapshot BOOLEAN NOT NULL,
+        data BLOB NOT NULL,
+        PRIMARY KEY (id),
+        CONSTRAINT _dream_number_uc UNIQUE (dream_id, number),
+        FOREIGN KEY(dream_id) REFERENCES dream (id),
+        CHECK (snapshot IN (0, 1)))""")
+
+
+def _compressed_bodies(conn):
+    """ Storage of compressed dream bodies, see compression
+
+    The full text index reads the bodies through the dream_text view and the
+    triggers through the inflate sql function, so that they index the text
+    of compressed bodies too. The index is rebuilt from the view.
+    """
+    conn.execute("""CREATE TABLE IF NOT EXISTS zdict (
+        id INTEGER NOT NULL,
+        data BLOB NOT NULL,
+        PRIMARY KEY (id))""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS setting (
+        name VARCHAR NOT NULL,
+        value VARCHAR,
+        PRIMARY KEY (name))""")
+    conn.execute("""CREATE VIEW IF NOT EXISTS dream_text AS
+        SELECT id, title, inflate(recit) AS recit FROM dream""")
+    for name in ('dream_fts_ai', 'dream_fts_ad', 'dream_fts_au'):
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    conn.execute("DROP TABLE IF EXISTS dream_fts")
+    conn.execute("""CREATE VIRTUAL TABLE dream_fts
+        USING fts5(title, recit, content='dream_text', content_rowid='id')""")
+    conn.execute("""CREATE TRIGGER dream_fts_ai AFTER INSERT ON dream BEGIN
+          INSERT INTO dream_fts(rowid, title, recit)
+          VALUES (new.id, new.title, inflate(new.recit));
+        END""")
+    conn.execute("""CREATE TRIGGER dream_fts_ad AFTER DELETE ON dream BEGIN
+          INSERT INTO dream_fts(dream_fts, rowid, title, recit)
+          VALUES ('delete', old.id, old.title, inflate(old.recit));
+        END""")
+    # a body only (de)compressed keeps its text, it is not indexed again
+    conn.execute("""CREATE TRIGGER dream_fts_au AFTER UPDATE OF title, recit ON dream
+        WHEN old.title IS NOT new.title OR inflate(old.recit) IS NOT inflate(new.recit) BEGIN
+          INSERT INTO dream_fts(dream_fts, rowid, title, recit)
+          VALUES ('delete', old.id, old.title, inflate(old.recit));
+          INSERT INTO dream_fts(rowid, title, recit)
+          VALUES (new.id, new.title, inflate(new.recit));
+        END""")
+    logger.info("migration: rebuild full text index")
+    conn.execute("INSERT INTO dream_fts(dream_fts) VALUES ('rebuild')")
+
+
+def _plain_index_triggers(conn):
+    """ Full text index triggers without sql function while the bodies are
+    stored as text
+
+    A plain sqlite connection does not have the inflate function, it could
+    not write to the dream table anymore. compression.convert switches the
+    triggers back to inflate when the bodies get compressed.
+    """
+    row = conn.execute("SELECT value FROM setting WHERE name = 'body_storage'").fetchone()
+    if row and row[0] != 'text':
+        return
+    for name in ('dream_fts_ai', 'dream_fts_ad', 'dream_fts_au'):
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    conn.execute("DROP VIEW IF EXISTS dream_text")
+    conn.execute("""CREATE VIEW dream_text AS
+        SELECT id, title, recit FROM dream""")
+    conn.execute("""CREATE TRIGGER dream_fts_ai AFTER INSERT ON dream BEGIN
+          INSERT INTO dream_fts(rowid, title, recit)
+          VALUES (new.id, new.title, new.recit);
+        END""")
+    conn.execute("""CREATE TRIGGER dream_fts_ad AFTER DELETE ON dream BEGIN
+          INSERT INTO dream_fts(dream_fts, rowid, title, recit)
+          VALUES ('delete', old.id, old.title, old.recit);
+        END""")
+    conn.execute("""CREATE TRIGGER dream_fts_au AFTER UPDATE OF title, recit ON dream
+        WHEN old.title IS NOT new.title OR old.recit IS NOT new.recit BEGIN
+          INSERT INTO dream_fts(dream_fts, rowid, title, recit)
+          VALUES ('delete', old.id, old.title, old.recit);
+          INSERT INTO dream_fts(rowid, title, recit)
+          VALUES (new.id, new.title, new.recit);
+        END""")
+
+
+def _dream_counts(conn):
+    """ Number of dreams per year, month, weekday, tag and type, and total
+    number of words, kept up to date by triggers
+
+    dreamcount has one row per (period, value): ('total', ''), ('year',
+    '2017'), ('month', '03'), ('weekday', '0' for sunday), ('tag', tag id),
+    ('type', dream type id). The rows are kept when their count drops to 0.
+    words is only maintained for the total row, from dreamstat: the rows
+    replaced by INSERT OR REPLACE do not fire the delete triggers, the
+    previous count is subtracted before the insert instead. The triggers do
+    not use INSERT OR IGNORE, the conflict clause of the statement firing
+    them (e.g. INSERT OR REPLACE) would override it.
+    """
+    conn.execute("""CREATE TABLE IF NOT EXISTS dreamcount (
+        id INTEGER NOT NULL,
+        period VARCHAR NOT NULL,
+        value VARCHAR NOT NULL,
+        dreams INTEGER NOT NULL,
+        words INTEGER NOT NULL,
+        PRIMARY KEY (id),
+        CONSTRAINT _period_value_uc UNIQUE (period, value))""")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_dreamstat_words ON dreamstat (words)")
+
+    def count(period, value, step):
+        """ Statements adding step to the count of (period, value sql
+        expression), creating the row if needed
+        """
+        where = f"period = '{period}' AND value = {value}"
+        return f"""INSERT INTO dreamcount (period, value, dreams, words)
+              SELECT '{period}', {value}, 0, 0
+              WHERE NOT EXISTS (SELECT 1 FROM dreamcount WHERE {where});
+              UPDATE dreamcount SET dreams = dreams + {step} WHERE {where};"""
+
+    periods = [('total', "''"), ('year', "strftime('%Y', {}.date)"),
+               ('month', "strftime('%m', {}.date)"), ('weekday', "strftime('%w', {}.date)")]
+
+    def count_dates(row, step):
+        """ Statements adding step to the date periods of row (new or old) """
+        return '\n'.join(count(period, value.format(row), step) for period, value in periods)
+
+    conn.execute(f"""CREATE TRIGGER dreamcount_ai AFTER INSERT ON dream BEGIN
+          {count_dates('new', 1)}
+        END""")
+    conn.execute(f"""CREATE TRIGGER dreamcount_ad AFTER DELETE ON dream BEGIN
+          {count_dates('old', -1)}
+          DELETE FROM dreamstat WHERE id = old.id;
+        END""")
+    conn.execute(f"""CREATE TRIGGER dreamcount_au AFTER UPDATE OF date ON dream
+        WHEN old.date IS NOT new.date BEGIN
+          {count_dates('old', -1)}
+          {count_dates('new', 1)}
+        END""")
+    labels = (('tags', 'tag_id', 'tag'), ('drtype', 'type_id', 'type'))
+    for table, column, period in labels:
+        conn.execute(f"""CREATE TRIGGER dreamcount_{table}_ai AFTER INSERT ON {table} BEGIN
+              {count(period, f'CAST(new.{column} AS TEXT)', 1)}
+            END""")
+        conn.execute(f"""CREATE TRIGGER dreamcount_{table}_ad AFTER DELETE ON {table} BEGIN
+              {count(period, f'CAST(old.{column} AS TEXT)', -1)}
+            END""")
+    # the total row is created below and never deleted
+    total = "period = 'total' AND value = ''"
+    conn.execute(f"""CREATE TRIGGER dreamcount_words_bi BEFORE INSERT ON dreamstat BEGIN
+          UPDATE dreamcount
+          SET words = words - coalesce((SELECT words FROM dreamstat WHERE id = new.id), 0)
+          WHERE {total};
+        END""")
+    conn.execute(f"""CREATE TRIGGER dreamcount_words_ai AFTER INSERT ON dreamstat BEGIN
+          UPDATE dreamcount SET words = words + new.words WHERE {total};
+        END""")
+    conn.execute(f"""CREATE TRIGGER dreamcount_words_au AFTER UPDATE OF words ON dreamstat BEGIN
+          UPDATE dreamcount SET words = words + new.words - old.words WHERE {total};
+        END""")
+    conn.execute(f"""CREATE TRIGGER dreamcount_words_ad AFTER DELETE ON dreamstat BEGIN
+          UPDATE dreamcount SET words = words - old.words WHERE {total};
+        END""")
+
+    logger.info("migration: count the dreams")
+    conn.execute("DELETE FROM dreamstat WHERE id NOT IN (SELECT id FROM dream)")
+    conn.execute("DELETE FROM dreamcount")
+    conn.execute("""INSERT INTO dreamcount (period, value, dreams, words)
+        SELECT 'total', '', COUNT(*), (SELECT coalesce(SUM(words), 0) FROM dreamstat)
+        FROM dream""")
+    for period, value in periods[1:]:
+        conn.execute(f"""INSERT INTO dreamcount (period, value, dreams, words)
+            SELECT '{period}', {value.format('dream')}, COUNT(*), 0 FROM dream GROUP BY 2""")
+    for table, column, period in labels:
+        conn.execute(f"""INSERT INTO dreamcount (period, value, dreams, words)
+            SELECT '{period}', CAST({column} AS TEXT), COUNT(*), 0 FROM {table} GROUP BY {column}""")
+
+MIGRATIONS = [
+    _baseline,
+    _full_text_index,
+    _dream_stats,
+    _association_keys,
+    _revisions,
+    _compressed_bodies,
+    _plain_index_triggers,
+    _dream_counts,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def _batches(conn, table, what):
+    """ Yield the (low, high) rowid ranges of table by BATCH_SIZE, logging the
+    progress when there is more than one batch
+    """
+    low, high = conn.execute(f"SELECT MIN(rowid), MAX(rowid) FROM {table}").fetchone()
+    if low is None:
+        return
+    total = high - low + 1
+    for start in range(low, high + 1, BATCH_SIZE):
+        yield start, start + BATCH_SIZE - 1
+        if total > BATCH_SIZE:
+            done = min(start + BATCH_SIZE - low, total)
+            logger.info(f"migration: {what} {done * 100 // total}%")
+
+
+def schema_version(conn):
+    """ Return the schema version of a sqlite connection """
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(engine):
+    """ Bring the database of engine to SCHEMA_VERSION
+    Return:
+        int: number of migrations applied
+    """
+    raw = engine.raw_connection()
+    try:
+        conn = raw.connection
+        version = schema_version(conn)
+        if version == SCHEMA_VERSION:
+            return 0
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(f'database schema version {version} is newer than the '
+                               f'supported version {SCHEMA_VERSION}, upgrade dream-dtb')
+        for number in range(version, SCHEMA_VERSION):
+            migration = MIGRATIONS[number]
+            logger.info(f"migration {number + 1}: {migration.__doc__.strip().splitlines()[0]}")
+            # the explicit transaction also covers the ddl statements
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                migration(conn)
+                conn.execute(f"PRAGMA user_version = {number + 1}")
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+        return SCHEMA_VERSION - version
+    finally:
+        raw.close()
@@ -0,0 +1,248 @@
+"""
+Model of the gui: the open dream buffers and the database queries
+
+The database is opened, and its schema upgraded, when dream_dtb.db is
+imported. The gui imports this module once nvim is spawned, so that nvim
+starts meanwhile.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from dream_dtb import config
+from dream_dtb.buffers import AutoSaver
+from dream_dtb.buffers import Buffer
+from dream_dtb.db import DreamDAO
+from dream_dtb.db import TagDAO
+from dream_dtb.db import DreamTypeDAO
+from dream_dtb.db import tree_listeners
+from dream_dtb.db import cache
+from gi.repository import GLib
+
+
+logger = logging.getLogger('dream_logger')
+
+
+class DbExecutor():
+    """ Run the database queries on a dedicated thread, so that a slow or
+    locked database does not freeze the gui. Every query gets its own session
+    (see session_scope). Results are handed back to the gtk main loop with
+    GLib.idle_add.
+    Arguments:
+        - on_busy (callable): called in the main loop with True when a query
+          is submitted while none is running, False when the last one ends
+    """
+
+    def __init__(self, on_busy=None):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='dreamdtb-db')
+        self.on_busy = on_busy
+        # number of queries in flight, only used from the main loop
+        self.running = 0
+
+    def submit(self, func, *args, callback=None):
+        """ Run func(*args) on the database thread then callback(result) in
+        the gtk main loop. Must be called from the main loop.
+        Return:
+            concurrent.futures.Future
+        """
+        self.running += 1
+        if self.running == 1 and self.on_busy is not None:
+            self.on_busy(True)
+        future = self.executor.submit(func, *args)
+        future.add_done_callback(lambda done: GLib.idle_add(self._complete, done, callback))
+        return future
+
+    def _complete(self, future, callback):
+        self.running -= 1
+        if self.running == 0 and self.on_busy is not None:
+            self.on_busy(False)
+        try:
+            result = future.result()
+        except Exception:
+            logger.exception("database query failed")
+        else:
+            if callback is not None:
+                callback(result)
+        # run once
+        return False
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+
+class Observable:
+    def __init__(self, initialValue=None):
+        self.data = initialValue
+        self.callbacks = {}
+
+    def addCallback(self, func):
+        self.callbacks[func] = 1
+
+    def delCallback(self, func):
+        del self.callbacks[func]
+
+    def _docallbacks(self):
+        for func in self.callbacks:
+            func(self.data)
+
+    def set(self, data):
+        self.data = data
+        self._docallbacks()
+
+    def get(self):
+        return self.data
+
+    def unset(self):
+        self.data = None
+
+
+class Model:
+
+    # maximum number of dreams shown in the tree by a search
+    SEARCH_LIMIT = 500
+
+    def __init__(self):
+        self.myTree = Observable({})
+        self.myTreeDelta = Observable()
+        self.myCurBuff = Observable()
+        # True while database queries are in flight
+        self.myLoading = Observable(False)
+        self.myBuffList = Buffer(config.MAX_BUFFERS)
+        self.db = DbExecutor(self.myLoading.set)
+        # (tag labels, dream type labels), None until loaded or after dreams
+        # are saved, which may create labels
+        self.labels = None
+        self.autosaver = AutoSaver(self._save, config.AUTOSAVE_DELAY)
+        # receive the changes of the navigation tree committed to the db
+        tree_listeners.append(self.myTreeDelta.set)
+
+    def _load_tree(self):
+        """ Return the whole tree, or only the years and their number of
+        dreams in lazy mode
+        """
+        if config.LAZY_TREE:
+            return DreamDAO.get_years()
+        return DreamDAO.get_tree()
+
+    def updateTree(self):
+        """ Load the tree in the background, myTree is set when done """
+        self.db.submit(self._load_tree, callback=self.myTree.set)
+
+    def get_subtree(self, keys, callback):
+        """ Load the children of the tree node identified by its date keys
+        and pass them to callback
+        Arguments:
+            - keys list(str): [year], [year, month] or [year, month, day]
+        """
+        if len(keys) == 1:
+            self.db.submit(DreamDAO.get_months, *keys, callback=callback)
+        elif len(keys) == 2:
+            self.db.submit(DreamDAO.get_days, *keys, callback=callback)
+        else:
+            self.db.submit(DreamDAO.get_dreams, *keys, callback=callback)
+
+    def search(self, query, callback):
+        """ Pass the tree of the dreams matching query to callback
+        """
+        self.db.submit(self._search, query, callback=callback)
+
+    def _search(self, query):
+        ids = [result['id'] for result in DreamDAO.search(query, limit=self.SEARCH_LIMIT)]
+        return DreamDAO.get_tree(ids)
+
+    def find_dream(self, idnum, callback):
+        """ Pass the dream whose id = idnum to callback """
+        self.db.submit(DreamDAO.find_by_id, idnum, callback=callback)
+
+    def get_labels(self, callback):
+        """ Pass the tag labels and the dream type labels to callback """
+        if self.labels is not None:
+            callback(self.labels)
+        else:
+            self.db.submit(self._get_labels, callback=partial(self._labels_loaded, callback))
+
+    def _get_labels(self):
+        return TagDAO.get_labels(), DreamTypeDAO.get_labels()
+
+    def _labels_loaded(self, callback, labels):
+        self.labels = labels
+        callback(labels)
+
+    def warm_up(self):
+        """ Load the tree and the labels of the dialogs in the background """
+        self.updateTree()
+        self.get_labels(lambda labels: None)
+
+    def addDreamBuff(self, instance):
+        return self.myBuffList.add(instance)
+
+    def setDreamMeta(self, bufname, instance):
+        self.myBuffList.modify(bufname, instance)
+        self.autosaver.schedule(bufname)
+
+    def saveDream(self, bufname, instance):
+        """ Record the text of a buffer written in nvim, it is saved to the
+        database by the autosaver
+        """
+        self.myBuffList.modify(bufname, instance)
+        self.autosaver.schedule(bufname)
+
+    def _save(self, bufnames):
+        """ Save buffers, called by the autosaver thread """
+        self.myBuffList.save_all(bufnames)
+        self.labels = None
+
+    def flush(self):
+        """ Save the buffers still modified, before quitting. Called when
+        nvim quits and again when it exits, the second call saves nothing.
+        """
+        self.autosaver.stop()
+        # e.g. buffers whose last save failed
+        try:
+            self.myBuffList.save_all()
+        except Exception:
+            logger.exception("save on exit failed")
+        logger.info(f"unchanged dreams not saved: {self.myBuffList.skipped}")
+        logger.info(f"query cache: {cache.stats()}")
+
+    def setCurBuff(self, bufname):
+        self.myBuffList.touch(bufname)
+        self.myCurBuff.set(bufname)
+
+    def setCurBuffSilent(self, bufname):
+        """ Set current buffer without triggering the callback
+        """
+        # if bufname has been created from vim, ignore it.
+        if bufname in self.myBuffList.bufs:
+            x = bufname
+            self.myBuffList.touch(bufname)
+        else:
+            x = None
+        setattr(self.myCurBuff, 'data', x)
+
+    def get_buffers_to_close(self):
+        """ Return the least recently used buffers over the limit of open
+        buffers, the current buffer is never part of them
+        """
+        return self.myBuffList.lru(keep=self.myCurBuff.get())
+
+    def close_buffer(self, bufname):
+        """ Forget a buffer closed in nvim, saving it in the background if
+        needed
+        """
+        instance = self.myBuffList.remove(bufname)
+        if instance is not None:
+            logger.info(f'save: {bufname}')
+            self.db.submit(DreamDAO.save_batch, [instance])
+
+    def getCurBuff(self):
+        return self.myCurBuff.get()
+
+    def get_inst_buf(self, bufname):
+        return self.myBuffList.bufs[bufname]['instance']
+
+    def get_ids(self):
+        return self.myBuffList.get_ids()
+
+    def get_buf_by_id(self, idnum):
+        return self.myBuffList.get_bufname(idnum)
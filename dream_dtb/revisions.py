@@ -0,0 +1,62 @@
+"""
+Compressed encoding of the revisions of the dreams body
+
+A revision is either a snapshot, the zlib compressed text, or a delta, the
+zlib compressed line diff against the text of the previous revision. A delta
+is a json list of [start, end] ranges of lines copied from the previous text
+and of strings of new lines, concatenated in order.
+
+The text of a revision is rebuilt from the closest snapshot before it by
+applying the deltas that follow, whose number is bounded by the snapshot
+interval of RevisionDAO. The encoding is stored in the database: it must not
+change.
+"""
+import json
+import zlib
+from difflib import SequenceMatcher
+
+
+def snapshot(text):
+    """ Return the snapshot of text as bytes """
+    return zlib.compress((text or '').encode('utf-8'), 9)
+
+
+def delta(old, new):
+    """ Return the delta turning the text old into new as bytes """
+    old_lines = (old or '').splitlines(keepends=True)
+    new_lines = (new or '').splitlines(keepends=True)
+    ops = []
+    matcher = SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif tag in ('replace', 'insert'):
+            ops.append(''.join(new_lines[j1:j2]))
+    return zlib.compress(json.dumps(ops, separators=(',', ':')).encode('utf-8'), 9)
+
+
+def patch(old, data):
+    """ Apply the delta data to the text old and return the new text """
+    old_lines = (old or '').splitlines(keepends=True)
+    parts = []
+    for op in json.loads(zlib.decompress(data).decode('utf-8')):
+        if isinstance(op, str):
+            parts.append(op)
+        else:
+            parts.extend(old_lines[op[0]:op[1]])
+    return ''.join(parts)
+
+
+def rebuild(rows):
+    """ Return the text of the last revision of rows
+    Arguments:
+        - rows: (is_snapshot, data) of consecutive revisions, the first one
+          being a snapshot
+    """
+    text = None
+    for is_snapshot, data in rows:
+        if is_snapshot:
+            text = zlib.decompress(data).decode('utf-8')
+        else:
+            text = patch(text, data)
+    return text
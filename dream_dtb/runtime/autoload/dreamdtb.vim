@@ -1,7 +1,10 @@
 function! dreamdtb#notify_save_buffer()
-  " notify client after buffer has been saved
+  " send the content of a dream buffer to the client instead of writing it
+  " to a file
   let s:bufname=expand('<afile>')
-  call rpcnotify(g:gui_channel, 'DreamGuiEvent', 'Save', s:bufname)
+  let s:bufnr=str2nr(expand('<abuf>'))
+  call rpcnotify(g:gui_channel, 'DreamGuiEvent', 'Save', s:bufname, getbufline(s:bufnr, 1, '$'))
+  call setbufvar(s:bufnr, '&modified', 0)
 endfunction
 
 function! dreamdtb#notify_quit_vim()
@@ -1,5 +1,5 @@
 from contextlib import contextmanager
-from dream_dtb import Session
+from dream_dtb.engine import Session
 
 
 class Singleton(type):
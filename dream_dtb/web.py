@@ -0,0 +1,364 @@
+"""
+Local web server to browse the dreams like a blog
+
+- /                     dreams, most recent first, with a link to older ones
+- /dreams/<id>          a single dream
+- /api/dreams           json list of dreams: ?limit=20&after=<cursor>
+- /api/dreams/<id>      json dream
+
+Lists use keyset pagination over (date, created, id): the cursor is the key of
+the last dream of a page, so every page costs the same whatever its depth.
+Single dreams carry ETag and Last-Modified headers derived from their updated
+timestamp, repeated requests of an unchanged dream get a 304 response.
+
+Queries run in a thread pool on read-only sqlite connections, which never
+take the write lock needed by the gui.
+"""
+import asyncio
+import base64
+import datetime
+import email.utils
+import html
+import json
+import logging
+import queue
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+
+from dream_dtb import compression
+from dream_dtb import config
+from dream_dtb.db import Dream
+from dream_dtb.db import DreamType
+from dream_dtb.db import Tag
+from dream_dtb.db import drtype
+from dream_dtb.db import tags
+from dream_dtb.engine import set_sqlite_pragmas
+from dream_dtb.importer import DATETIME_FORMAT
+
+logger = logging.getLogger('dream_logger')
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 200
+# largest request head accepted
+MAX_HEAD = 16384
+# pragmas that make sense on a read-only connection
+READ_PRAGMAS = ['cache_size', 'mmap_size', 'temp_store', 'busy_timeout']
+
+STATUS = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found',
+          405: 'Method Not Allowed'}
+
+HTML_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ max-width: 42em; margin: auto; font-family: serif; line-height: 1.5; }}
+article {{ border-bottom: 1px solid #ccc; margin-bottom: 2em; }}
+.meta {{ color: #666; font-style: italic; }}
+</style>
+</head>
+<body>
+<h1><a href="/">Dreams</a></h1>
+{body}
+</body>
+</html>
+"""
+
+
+class ReadPool:
+    """ A pool of read-only sqlite connections, shared by the threads of the
+    server
+    Arguments:
+        - path (str): database file
+        - size (int): number of connections
+    """
+
+    def __init__(self, path=config.DB_PATH, size=4):
+        pragmas = {name: value
+                   for name, value in config.sqlite_pragmas(config.SETTINGS).items()
+                   if name in READ_PRAGMAS}
+        self.size = size
+        self.connections = queue.Queue()
+        for _ in range(size):
+            conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            set_sqlite_pragmas(conn, pragmas)
+            compression.register(conn, path)
+            self.connections.put(conn)
+
+    def run(self, func, *args):
+        """ Call func(connection, *args) with a connection of the pool """
+        conn = self.connections.get()
+        try:
+            return func(conn, *args)
+        finally:
+            self.connections.put(conn)
+
+    def close(self):
+        for _ in range(self.size):
+            self.connections.get().close()
+
+
+def encode_cursor(row):
+    """ Return the pagination cursor pointing after row """
+    key = json.dumps([row['date'], row['created'], row['id']])
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """ Return the (date, created, id) key of a cursor, raise ValueError if
+    it is malformed
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        date, created, idnum = key
+        return str(date), str(created), int(idnum)
+    except (TypeError, ValueError) as error:
+        raise ValueError(f'invalid cursor: {error}')
+
+
+def list_dreams(conn, limit, after=None):
+    """ Return a page of dreams, most recent first, and the cursor of the
+    next page (None on the last page)
+    Arguments:
+        - limit (int): number of dreams of the page
+        - after (tuple): (date, created, id) key of the last dream of the
+          previous page
+    """
+    where, params = '', []
+    if after is not None:
+        where = 'WHERE (date, created, id) < (?, ?, ?)'
+        params = list(after)
+    rows = conn.execute(f"""
+        SELECT id, title, date, inflate(recit) AS recit, created, updated FROM {Dream.__tablename__}
+        {where}
+        ORDER BY date DESC, created DESC, id DESC
+        LIMIT ?""", params + [limit + 1]).fetchall()
+    cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return _with_labels(conn, rows[:limit]), cursor
+
+
+def get_dream(conn, idnum):
+    """ Return a dream as a dict, None if it does not exist """
+    rows = conn.execute(f'SELECT id, title, date, inflate(recit) AS recit, created, updated '
+                        f'FROM {Dream.__tablename__} WHERE id = ?', (idnum,)).fetchall()
+    dreams = _with_labels(conn, rows)
+    return dreams[0] if dreams else None
+
+
+def _with_labels(conn, rows):
+    """ Return rows as dicts with their tags and dream type, fetched with one
+    query each
+    """
+    dreams = [dict(row, tags=[], drtype='') for row in rows]
+    if not dreams:
+        return dreams
+    byid = {dream['id']: dream for dream in dreams}
+    marks = ', '.join('?' * len(byid))
+    for link, column, table in ((tags, 'tag_id', Tag.__tablename__),
+                                (drtype, 'type_id', DreamType.__tablename__)):
+        for idnum, label in conn.execute(f"""
+                SELECT {link.name}.dream_id, {table}.label
+                FROM {link.name} JOIN {table} ON {table}.id = {link.name}.{column}
+                WHERE {link.name}.dream_id IN ({marks})
+                ORDER BY {table}.label""", list(byid)):
+            if link is tags:
+                byid[idnum]['tags'].append(label)
+            else:
+                byid[idnum]['drtype'] = label
+    return dreams
+
+
+def last_modified(dream):
+    """ Return the updated timestamp of a dream as an aware datetime,
+    truncated to the second like http dates
+    """
+    updated = datetime.datetime.strptime(dream['updated'], DATETIME_FORMAT)
+    return updated.replace(microsecond=0, tzinfo=datetime.timezone.utc)
+
+
+def etag(dream):
+    return '"{}-{}"'.format(dream['id'], dream['updated'].replace(' ', 'T'))
+
+
+def not_modified(headers, dream):
+    """ Return True if the client copy of dream is still valid """
+    if 'if-none-match' in headers:
+        return etag(dream) in [tag.strip() for tag in headers['if-none-match'].split(',')]
+    if 'if-modified-since' in headers:
+        try:
+            since = email.utils.parsedate_to_datetime(headers['if-modified-since'])
+        except (TypeError, ValueError):
+            return False
+        return since is not None and last_modified(dream) <= since
+    return False
+
+
+class Response:
+
+    def __init__(self, status=200, body=b'', content_type='text/html; charset=utf-8', headers=None):
+        self.status = status
+        self.body = body
+        self.headers = {'Content-Type': content_type}
+        self.headers.update(headers or {})
+
+    def encode(self, keep_alive, head_only=False):
+        headers = dict(self.headers, **{'Content-Length': str(len(self.body)),
+                                        'Connection': 'keep-alive' if keep_alive else 'close'})
+        if self.status == 304:
+            del headers['Content-Length'], headers['Content-Type']
+        lines = [f'HTTP/1.1 {self.status} {STATUS[self.status]}']
+        lines += [f'{name}: {value}' for name, value in headers.items()]
+        head = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+        if head_only or self.status == 304:
+            return head
+        return head + self.body
+
+
+def json_response(data, status=200, headers=None):
+    return Response(status, json.dumps(data, ensure_ascii=False).encode(),
+                    'application/json; charset=utf-8', headers)
+
+
+def error_response(status, message, api):
+    if api:
+        return json_response({'error': message}, status)
+    return Response(status, HTML_PAGE.format(title=STATUS[status],
+                                             body=f'<p>{html.escape(message)}</p>').encode())
+
+
+def render_article(dream, link=True):
+    title = html.escape(dream['title'])
+    if link:
+        title = f'<a href="/dreams/{dream["id"]}">{title}</a>'
+    meta = ' · '.join(filter(None, [dream['date'], dream['drtype'], ', '.join(dream['tags'])]))
+    paragraphs = ''.join(f'<p>{html.escape(par)}</p>\n'
+                         for par in (dream['recit'] or '').split('\n\n') if par.strip())
+    return (f'<article>\n<h2>{title}</h2>\n<p class="meta">{html.escape(meta)}</p>\n'
+            f'{paragraphs}</article>\n')
+
+
+class DreamServer:
+    """ Asyncio http server of the dreams
+    Arguments:
+        - pool (ReadPool): connections used by the queries
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.executor = ThreadPoolExecutor(pool.size, thread_name_prefix='dreamdtb-web')
+
+    async def serve(self, host='127.0.0.1', port=8080):
+        server = await asyncio.start_server(self.handle, host, port)
+        logger.info(f'browse: serving on http://{host}:{port}/')
+        async with server:
+            await server.serve_forever()
+
+    async def query(self, func, *args):
+        """ Run a query of this module in the thread pool """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.pool.run, func, *args)
+
+    async def handle(self, reader, writer):
+        """ Serve the requests of a connection until it is closed """
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                if len(head) > MAX_HEAD:
+                    break
+                lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = lines[0].split(' ')
+                except ValueError:
+                    writer.write(error_response(400, 'bad request', False).encode(False))
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    name, sep, value = line.partition(':')
+                    if sep:
+                        headers[name.strip().lower()] = value.strip()
+
+                if method in ('GET', 'HEAD'):
+                    response = await self.dispatch(target, headers)
+                else:
+                    response = error_response(405, f'method {method} not allowed', False)
+                connection = headers.get('connection', '').lower()
+                keep_alive = (connection != 'close' if version == 'HTTP/1.1'
+                              else connection == 'keep-alive')
+                writer.write(response.encode(keep_alive, method == 'HEAD'))
+                await writer.drain()
+                logger.debug(f'browse: {method} {target} {response.status}')
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    async def dispatch(self, target, headers):
+        url = urlsplit(target)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split('/') if part]
+        api = parts[:1] == ['api']
+        if api:
+            parts = parts[1:]
+        try:
+            if not parts:
+                return await self.dream_list(params, api)
+            if parts[0] == 'dreams' and len(parts) == 1:
+                return await self.dream_list(params, api)
+            if parts[0] == 'dreams' and len(parts) == 2:
+                return await self.dream_page(int(parts[1]), headers, api)
+        except ValueError as error:
+            return error_response(400, str(error), api)
+        return error_response(404, f'{url.path} not found', api)
+
+    async def dream_list(self, params, api):
+        limit = min(int(params.get('limit', PAGE_SIZE)), MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError('limit must be positive')
+        after = decode_cursor(params['after']) if 'after' in params else None
+        dreams, cursor = await self.query(list_dreams, limit, after)
+        if api:
+            for dream in dreams:
+                del dream['created']
+            return json_response({'dreams': dreams, 'next': cursor})
+        body = ''.join(render_article(dream) for dream in dreams)
+        if cursor:
+            body += f'<p><a href="/?after={cursor}&amp;limit={limit}">Older dreams</a></p>\n'
+        return Response(body=HTML_PAGE.format(title='Dreams', body=body).encode())
+
+    async def dream_page(self, idnum, headers, api):
+        dream = await self.query(get_dream, idnum)
+        if dream is None:
+            return error_response(404, f'dream {idnum} not found', api)
+        cache = {'ETag': etag(dream),
+                 'Last-Modified': email.utils.format_datetime(last_modified(dream), usegmt=True),
+                 'Cache-Control': 'no-cache'}
+        if not_modified(headers, dream):
+            return Response(304, headers=cache)
+        if api:
+            del dream['created']
+            return json_response(dream, headers=cache)
+        body = render_article(dream, link=False)
+        return Response(body=HTML_PAGE.format(title=html.escape(dream['title']), body=body).encode(),
+                        headers=cache)
+
+    def close(self):
+        self.executor.shutdown()
+        self.pool.close()
+
+
+def serve(host='127.0.0.1', port=8080, connections=4):
+    """ Run the web server until interrupted """
+    server = DreamServer(ReadPool(size=connections))
+    try:
+        asyncio.run(server.serve(host, port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
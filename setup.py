@@ -4,7 +4,7 @@ Dream note gui
 from setuptools import find_packages, setup
 
 dependencies = ['click', 'click-default-group', 'click-datetime',
-                'neovim', 'SQLAlchemy', 'sqlalchemy-utils', 'pandas']
+                'neovim', 'SQLAlchemy']
 
 setup(
     name='dream-dtb',
@@ -18,7 +18,7 @@ setup(
     long_description=open('README.rst').read(),
     use_scm_version=True,
     packages=find_packages(exclude=['tests']),
-    python_requires='>=3.6',
+    python_requires='>=3.8',
     include_package_data=True,
     zip_safe=False,
     platforms='any',
@@ -0,0 +1,54 @@
+"""
+Fixtures shared by the tests
+
+The XDG directories are pointed to a temporary directory before dream_dtb is
+imported, so the tests never touch the journal of the user. The database is
+created once per test session and emptied by the db fixture.
+"""
+import datetime
+import os
+import tempfile
+
+ROOT = tempfile.mkdtemp(prefix='dreamdtb-tests')
+for var in ('XDG_DATA_HOME', 'XDG_CACHE_HOME', 'XDG_CONFIG_HOME', 'XDG_RUNTIME_DIR'):
+    os.environ[var] = os.path.join(ROOT, var.lower())
+
+import pytest  # noqa: E402
+
+# tables emptied between tests, the associations first
+TABLES = ['revision', 'dreamstat', 'tags', 'drtype', 'dream', 'tag', 'dreamtype']
+
+
+@pytest.fixture
+def db():
+    """ The db module, on an empty journal """
+    from dream_dtb import db
+    with db.Engine.begin() as conn:
+        for table in TABLES:
+            conn.execute(f'DELETE FROM {table}')
+    return db
+
+
+def make_dreams(count, first=datetime.date(2000, 1, 1)):
+    """ Return count dream instances, two per day from first """
+    return [{'title': f'dream {i}',
+             'date': first + datetime.timedelta(days=i // 2),
+             'recit': f'flying over the sea number {i}\n\nthen walking home',
+             'tags': sorted({f'tag{i % 7}', f'tag{i % 11}'}),
+             'drtype': 'lucid' if i % 3 else 'normal'}
+            for i in range(count)]
+
+
+@pytest.fixture
+def journal(db):
+    """ Import dreams in the empty journal, return their instances
+    Arguments:
+        - count (int): number of dreams, see make_dreams
+    """
+    from dream_dtb.importer import Importer
+
+    def populate(count):
+        instances = make_dreams(count)
+        Importer().run(instances)
+        return instances
+    return populate
@@ -0,0 +1,91 @@
+import datetime
+import re
+import zlib
+
+import pytest
+
+from dream_dtb.book import Book
+from dream_dtb.importer import Importer
+
+from conftest import make_dreams
+
+YEARS = ['2000', '2001', '2002', '2003']
+
+
+@pytest.fixture
+def dreams(db):
+    """ Import dreams in four years, return their instances """
+    instances = (make_dreams(5) + make_dreams(3, first=datetime.date(2001, 12, 31))
+                 + make_dreams(1, first=datetime.date(2003, 6, 1)))
+    Importer().run(instances)
+    return instances
+
+
+def pdf_pages(data):
+    """ Return the text of each page of a pdf written by PdfWriter, checking
+    its cross-reference table on the way
+    """
+    assert data.startswith(b'%PDF-1.4\n')
+    assert data.endswith(b'%%EOF\n')
+    xref = int(re.search(rb'startxref\n(\d+)\n', data).group(1))
+    offsets = [int(offset) for offset in re.findall(rb'(\d{10}) 00000 n', data[xref:])]
+    for objid, offset in enumerate(offsets, 1):
+        assert data[offset:].startswith(f'{objid} 0 obj\n'.encode())
+    count = int(re.search(rb'/Type /Pages /Kids \[[^\]]*\] /Count (\d+)', data).group(1))
+    streams = re.findall(rb'/FlateDecode >>\nstream\n(.*?)\nendstream', data, re.S)
+    assert len(re.findall(rb'/Type /Page ', data)) == len(streams) == count
+    return [b'\n'.join(re.findall(rb'\((.*?)\) Tj', zlib.decompress(stream))).decode('cp1252')
+            for stream in streams]
+
+
+def test_html(tmp_path, dreams):
+    path = tmp_path / 'book.html'
+    assert Book('html', workers=1).write(str(path), title='Nights') == len(YEARS)
+    text = path.read_text()
+    assert text.startswith('<!DOCTYPE html>') and text.endswith('</html>\n')
+    assert '<title>Nights</title>' in text
+    assert re.findall(r'<section>\n<h1>(.*)</h1>', text) == YEARS
+    assert text.count('<article>') == len(dreams)
+    assert re.findall(r'<h2>(.*)</h2>', text)[:2] == ['dream 0', 'dream 1']
+
+    by_month = Book('html', by='month', since=datetime.date(2001, 1, 1), workers=1)
+    assert by_month.write(str(path)) == 3
+    assert re.findall(r'<section>\n<h1>(.*)</h1>', path.read_text()) == ['2001-12', '2002-01',
+                                                                          '2003-06']
+
+
+def test_pdf(tmp_path, dreams):
+    path = tmp_path / 'book.pdf'
+    assert Book('pdf', workers=1).write(str(path)) == len(YEARS)
+    pages = pdf_pages(path.read_bytes())
+    # each section starts a page, these ones fit in it
+    assert [page.split('\n')[0] for page in pages] == YEARS
+    assert sum(page.count('flying over the sea') for page in pages) == len(dreams)
+
+
+def test_pdf_long_dream(tmp_path, db):
+    instance = dict(make_dreams(1)[0], recit='\n'.join(f'line {i}' for i in range(200)))
+    Importer().run([instance])
+    path = tmp_path / 'book.pdf'
+    assert Book('pdf', workers=1).write(str(path)) == 1
+    pages = pdf_pages(path.read_bytes())
+    assert len(pages) == 4
+    assert '\n'.join(pages).split('\n')[-1] == 'line 199'
+
+
+def test_empty(tmp_path, db):
+    path = tmp_path / 'book.pdf'
+    assert Book('pdf', workers=1).write(str(path)) == 0
+    assert pdf_pages(path.read_bytes()) == ['']
+
+
+@pytest.mark.parametrize('fmt', ['html', 'pdf'])
+def test_workers(tmp_path, dreams, fmt):
+    # the sections are appended in date order whatever the worker finishing
+    # first
+    outputs = []
+    for workers in (1, 3):
+        path = tmp_path / f'book-{workers}.{fmt}'
+        assert Book(fmt, by='month', workers=workers).write(str(path)) == 4
+        outputs.append(path.read_bytes())
+    assert outputs[0] == outputs[1]
@@ -0,0 +1,90 @@
+import datetime
+
+import pytest
+
+from dream_dtb.buffers import AutoSaver
+from dream_dtb.buffers import Buffer
+
+
+@pytest.fixture
+def saved(db):
+    """ A dream stored in the database, as loaded by the gui """
+    idnum = db.DreamDAO.create({'title': 'dream', 'date': datetime.date(2000, 1, 1),
+                                'recit': 'A', 'tags': ['sea'], 'drtype': 'lucid'})
+    return dict(db.DreamDAO.find_by_id(idnum))
+
+
+def test_modify(saved):
+    buffers = Buffer()
+    name = buffers.add(dict(saved))
+    buffers.modify(name, {'tags': ['sea', 'sea']})
+    assert not buffers.bufs[name]['modified']
+    assert buffers.skipped == 1
+    buffers.modify(name, {'recit': 'B'})
+    assert buffers.bufs[name]['modified']
+    buffers.modify(name, {'recit': 'A'})
+    assert not buffers.bufs[name]['modified']
+
+
+def test_save(db, saved):
+    buffers = Buffer()
+    name = buffers.add(dict(saved))
+    buffers.modify(name, {'recit': 'B'})
+    buffers.save(name)
+    assert db.DreamDAO.find_by_id(saved['id'])['recit'] == 'B'
+    assert not buffers.bufs[name]['modified']
+    # a new dream gets its id
+    new = buffers.add({})
+    buffers.modify(new, dict(saved, id=None, title='new'))
+    buffers.save_all()
+    assert buffers.get_bufname(buffers.bufs[new]['instance']['id']) == new
+
+
+def test_revert_during_save(db, saved, monkeypatch):
+    buffers = Buffer()
+    name = buffers.add(dict(saved))
+    buffers.modify(name, {'recit': 'B'})
+    save_batch = db.DreamDAO.save_batch
+
+    def reverting(instances):
+        # the buffer is reverted to A while B is being saved
+        buffers.modify(name, {'recit': 'A'})
+        assert buffers.bufs[name]['modified']
+        return save_batch(instances)
+
+    monkeypatch.setattr(db.DreamDAO, 'save_batch', reverting)
+    buffers.save(name)
+    assert db.DreamDAO.find_by_id(saved['id'])['recit'] == 'B'
+    assert buffers.bufs[name]['modified']
+
+    monkeypatch.undo()
+    buffers.save(name)
+    assert db.DreamDAO.find_by_id(saved['id'])['recit'] == 'A'
+    assert not buffers.bufs[name]['modified']
+
+
+def test_save_failed(db, saved, monkeypatch):
+    buffers = Buffer()
+    name = buffers.add(dict(saved))
+    buffers.modify(name, {'recit': 'B'})
+
+    def failing(instances):
+        raise RuntimeError('database locked')
+
+    monkeypatch.setattr(db.DreamDAO, 'save_batch', failing)
+    with pytest.raises(RuntimeError):
+        buffers.save(name)
+    assert buffers.bufs[name]['modified']
+    assert buffers.remove(name)['recit'] == 'B'
+
+
+def test_autosaver_stop():
+    saves = []
+    autosaver = AutoSaver(saves.append, delay=60)
+    autosaver.schedule('dreamdtb://1')
+    autosaver.schedule('dreamdtb://2')
+    # the pending buffers are saved at once
+    autosaver.stop()
+    assert saves == [{'dreamdtb://1', 'dreamdtb://2'}]
+    autosaver.stop()
+    assert len(saves) == 1
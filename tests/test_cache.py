@@ -0,0 +1,83 @@
+import datetime
+import sqlite3
+
+import pytest
+
+DREAM = {'title': 'dream', 'date': datetime.date(2000, 1, 1), 'recit': 'flying',
+         'tags': ['sea'], 'drtype': 'lucid'}
+
+
+@pytest.fixture
+def cache(db, monkeypatch):
+    """ The query cache of the db module, enabled and emptied """
+    monkeypatch.setattr(db.cache, 'size', 10)
+    db.cache.invalidate()
+    return db.cache
+
+
+def test_invalidated_by_commit(db, cache):
+    idnum = db.DreamDAO.create(DREAM)
+    assert db.DreamDAO.find_by_id(idnum)['recit'] == 'flying'
+    hits = cache.hits
+    # the cached value is a copy
+    db.DreamDAO.find_by_id(idnum)['recit'] = 'changed'
+    assert db.DreamDAO.find_by_id(idnum)['recit'] == 'flying'
+    assert cache.hits == hits + 2
+
+    generation = cache.generation
+    assert db.DreamDAO.update(idnum, dict(DREAM, recit='walking')) is True
+    assert cache.generation > generation
+    assert db.DreamDAO.find_by_id(idnum)['recit'] == 'walking'
+
+    # reads do not invalidate the cache
+    generation = cache.generation
+    db.DreamDAO.get_tree()
+    assert cache.generation == generation
+
+
+def test_load_during_write(db, cache):
+    # a value loaded while a write is committed may be stale, it is not
+    # stored
+    idnum = db.DreamDAO.create(DREAM)
+
+    def load():
+        value = db.DreamDAO._find_by_id(idnum)
+        db.DreamDAO.update(idnum, dict(DREAM, recit='walking'))
+        return value
+    assert cache.get(('dream', idnum), load)['recit'] == 'flying'
+    assert ('dream', idnum) not in cache.entries
+    assert db.DreamDAO.find_by_id(idnum)['recit'] == 'walking'
+
+
+def test_other_connection(db, cache):
+    # committed outside of the engine, seen through PRAGMA data_version
+    idnum = db.DreamDAO.create(DREAM)
+    assert db.DreamDAO.find_by_id(idnum)['recit'] == 'flying'
+    conn = sqlite3.connect(db.Engine.url.database)
+    with conn:
+        conn.execute("UPDATE dream SET recit = 'walking' WHERE id = ?", (idnum,))
+    conn.close()
+    assert db.DreamDAO.find_by_id(idnum)['recit'] == 'walking'
+
+
+def test_lru(db):
+    cache = db.QueryCache(2, db.Engine.url.database)
+    loads = []
+
+    def load(key):
+        loads.append(key)
+        return key
+    for key in ['a', 'b', 'a', 'c', 'a', 'b']:
+        assert cache.get(key, lambda: load(key)) == key
+    # c evicted b, the least recently used, then b evicted c
+    assert loads == ['a', 'b', 'c', 'b']
+    assert list(cache.entries) == ['a', 'b']
+    assert cache.stats() == {'size': 2, 'entries': 2, 'hits': 2, 'misses': 4, 'hit_ratio': 2 / 6}
+
+    # None is not cached, size 0 disables the cache
+    assert cache.get('none', lambda: load(None)) is None
+    assert 'none' not in cache.entries
+    disabled = db.QueryCache(0, db.Engine.url.database)
+    assert disabled.get('a', lambda: load('a')) == 'a'
+    assert len(loads) == 6
+    assert not disabled.entries
@@ -0,0 +1,52 @@
+"""
+The commands are run in a subprocess, as from the shell, on the journal of
+the tests
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import TABLES
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def dreamdtb(*args):
+    """ Run dreamdtb args, return its stdout """
+    return subprocess.run([sys.executable, '-m', 'dream_dtb.cli', *args], cwd=ROOT, check=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True).stdout
+
+
+@pytest.mark.parametrize('fmt, ext', [('jsonl', '.jsonl'), ('csv', '.csv'), ('markdown', '.md')])
+def test_export_import(db, journal, tmp_path, fmt, ext):
+    journal(20)
+    exported = dreamdtb('export', '--format', fmt)
+    path = tmp_path / f'journal{ext}'
+    path.write_text(exported, encoding='utf-8')
+
+    with db.Engine.begin() as conn:
+        for table in TABLES:
+            conn.execute(f'DELETE FROM {table}')
+    output = dreamdtb('import', str(path))
+    assert output.startswith('20 created, 0 updated, 0 unchanged, 0 skipped')
+    assert dreamdtb('export', '--format', fmt) == exported
+
+
+def test_stat_json(journal):
+    journal(20)
+    stats = json.loads(dreamdtb('stat', '--json'))
+    assert stats['dreams'] == 20
+    assert stats['first'] == '2000-01-01' and stats['last'] == '2000-01-10'
+    assert stats['types'] == {'lucid': 13, 'normal': 7}
+
+
+def test_search_invalid(db):
+    proc = subprocess.run([sys.executable, '-m', 'dream_dtb.cli', 'search', '--raw', 'AND'],
+                          cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+    assert proc.returncode == 1
+    assert proc.stderr.endswith('Error: invalid search query \'AND\': fts5: syntax error near "AND"\n')
@@ -0,0 +1,151 @@
+import datetime
+import os
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy import event
+
+from dream_dtb import compression
+from dream_dtb import config
+from dream_dtb import migrations
+
+BODIES = ['', 'short', 'I was flying over the sea, then I was walking home. ' * 50,
+          'unicode: rêve ☁ \U0001f319\n\nsecond paragraph']
+
+
+@pytest.fixture
+def storage(db, monkeypatch):
+    """ Set [storage] compress, the bodies are converted back to text at
+    the end of the test
+    """
+    with db.Engine.begin() as conn:
+        conn.execute('DELETE FROM setting')
+        conn.execute('DELETE FROM zdict')
+    stamp = f'{db.Engine.url.database}-storage'
+    if os.path.exists(stamp):
+        os.remove(stamp)
+    monkeypatch.setattr(compression, '_dictionaries', {})
+    monkeypatch.setattr(compression, '_current', {})
+
+    def compress(enabled):
+        monkeypatch.setattr(config, 'COMPRESS_BODIES', enabled)
+        return compression.convert(db.Engine)
+    yield compress
+    compress(False)
+
+
+def stored(db, idnum):
+    with db.Engine.connect() as conn:
+        return conn.execute('SELECT recit FROM dream WHERE id = ?', (idnum,)).scalar()
+
+
+def test_deflate_round_trip(monkeypatch):
+    zdict = compression.train(BODIES * 2)
+    monkeypatch.setitem(compression._dictionaries, 'journal.db', {0: b'', 1000: zdict})
+    for body in BODIES:
+        for dict_id, data in ((0, b''), (1000, zdict)):
+            value = compression.deflate(body, dict_id, data)
+            assert compression.HEADER.unpack_from(value) == (dict_id,)
+            assert compression.inflate(value, 'journal.db') == body
+    assert compression.inflate('plain text') == 'plain text'
+    assert compression.inflate(None) is None
+    assert compression.deflate(None, 0, b'') is None
+
+
+def test_train():
+    bodies = ['I was flying over the sea', 'then I was flying home', 'I was flying again', 'sea']
+    zdict = compression.train(bodies, size=20)
+    assert len(zdict) <= 20
+    # the sequence saving the most bytes comes last
+    assert zdict.endswith(b'I was flying ')
+    assert compression.train(['each word once']) == b''
+
+
+def test_compressed_text(db, storage):
+    storage(True)
+    ids = [db.DreamDAO.create({'title': f'dream {i}', 'date': datetime.date(2000, 1, 1),
+                               'recit': body, 'tags': [], 'drtype': ''})
+           for i, body in enumerate(BODIES)]
+    for idnum, body in zip(ids, BODIES):
+        assert isinstance(stored(db, idnum), bytes)
+        assert db.DreamDAO.find_by_id(idnum)['recit'] == body
+    assert [result['id'] for result in db.DreamDAO.search('flying')] == [ids[2]]
+
+    assert storage(False) == len(BODIES)
+    for idnum, body in zip(ids, BODIES):
+        assert stored(db, idnum) == body
+    assert [result['id'] for result in db.DreamDAO.search('flying')] == [ids[2]]
+
+
+def plain_update(db, idnum, recit):
+    """ Update a body through a sqlite connection without the inflate
+    function, as when the database is opened by hand
+    """
+    conn = sqlite3.connect(db.Engine.url.database)
+    try:
+        with conn:
+            conn.execute('UPDATE dream SET recit = ? WHERE id = ?', (recit, idnum))
+    finally:
+        conn.close()
+
+
+def test_plain_connection(db, storage):
+    idnum = db.DreamDAO.create({'title': 'by hand', 'date': datetime.date(2000, 1, 1),
+                                'recit': 'flying', 'tags': [], 'drtype': ''})
+    plain_update(db, idnum, 'walking')
+    assert [result['id'] for result in db.DreamDAO.search('walking')] == [idnum]
+    assert db.DreamDAO.search('flying') == []
+
+    storage(True)
+    with pytest.raises(sqlite3.OperationalError, match='inflate'):
+        plain_update(db, idnum, 'running')
+    storage(False)
+    plain_update(db, idnum, 'running')
+    assert [result['id'] for result in db.DreamDAO.search('running')] == [idnum]
+
+
+def test_convert(db, journal, storage):
+    instances = journal(compression.TRAIN_MIN)
+    assert storage(True) == len(instances)
+    with db.Engine.connect() as conn:
+        assert conn.execute("SELECT value FROM setting WHERE name = 'body_storage'").scalar() == 'zlib:1'
+        assert conn.execute('SELECT COUNT(*) FROM zdict').scalar() == 1
+    assert compression.HEADER.unpack_from(stored(db, 1)) == (1,)
+    assert db.DreamDAO.find_by_id(1)['recit'] == instances[0]['recit']
+    # the storage is up to date, the database is not even queried
+    assert storage(True) == 0
+    with db.Engine.begin() as conn:
+        conn.execute("UPDATE setting SET value = 'text' WHERE name = 'body_storage'")
+    assert storage(True) == 0
+    with db.Engine.begin() as conn:
+        conn.execute("UPDATE setting SET value = 'zlib:1' WHERE name = 'body_storage'")
+    # raises if the full text index does not match the bodies
+    with db.Engine.begin() as conn:
+        conn.execute("INSERT INTO dream_fts(dream_fts, rank) VALUES ('integrity-check', 1)")
+
+
+def test_other_database(tmp_path, db, storage, monkeypatch):
+    # the dictionaries are looked up in the database of the engine, not in
+    # the one of the application
+    path = str(tmp_path / 'other.db')
+    engine = create_engine(f'sqlite:///{path}')
+    event.listen(engine, 'connect',
+                 lambda dbapi_connection, record: compression.register(dbapi_connection, path))
+    migrations.migrate(engine)
+    with engine.begin() as conn:
+        for i in range(compression.TRAIN_MIN):
+            conn.execute("INSERT INTO dream (title, date, recit, created, updated) "
+                         "VALUES (?, '2000-01-01', ?, '2000-01-01 00:00:00', '2000-01-01 00:00:00')",
+                         (f'dream {i}', BODIES[2]))
+    monkeypatch.setattr(config, 'COMPRESS_BODIES', True)
+    assert compression.convert(engine) == compression.TRAIN_MIN
+    with db.Engine.connect() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM zdict').scalar() == 0
+
+    # new connections, the dictionary is read again
+    monkeypatch.setattr(compression, '_dictionaries', {})
+    engine.dispose()
+    with engine.connect() as conn:
+        assert conn.execute('SELECT inflate(recit) FROM dream WHERE id = 1').scalar() == BODIES[2]
+    assert list(compression._dictionaries) == [path]
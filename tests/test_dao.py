@@ -0,0 +1,76 @@
+import datetime
+
+import pytest
+from sqlalchemy import event
+
+DREAM = {'title': 'dream', 'date': datetime.date(2000, 1, 1), 'recit': 'flying',
+         'tags': ['sea'], 'drtype': 'lucid'}
+
+
+@pytest.fixture
+def writes(db):
+    """ Capture the INSERT, UPDATE and DELETE statements run through the
+    engine
+    """
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE')):
+            captured.append(statement)
+
+    event.listen(db.Engine, 'before_cursor_execute', capture)
+    yield captured
+    event.remove(db.Engine, 'before_cursor_execute', capture)
+
+
+def test_update_unchanged(db, writes):
+    idnum = db.DreamDAO.create(DREAM)
+    writes.clear()
+    assert db.DreamDAO.update(idnum, dict(DREAM, tags=['sea', 'sea'])) is False
+    assert writes == []
+
+
+def test_update_duplicate(db):
+    idnum = db.DreamDAO.create(DREAM)
+    other = db.DreamDAO.create(dict(DREAM, title='other'))
+    # renamed onto an existing (title, date), the commit fails
+    assert db.DreamDAO.update(other, dict(DREAM, recit='changed')) is False
+    assert db.DreamDAO.find_by_id(other)['title'] == 'other'
+    assert db.DreamDAO.find_by_id(idnum)['recit'] == 'flying'
+    assert db.DreamDAO.update(other, dict(DREAM, title='renamed')) is True
+
+
+@pytest.fixture
+def commits(db):
+    """ Count the transactions committed through the engine """
+    committed = []
+
+    def count(conn):
+        committed.append(conn)
+
+    event.listen(db.Engine, 'commit', count)
+    yield committed
+    event.remove(db.Engine, 'commit', count)
+
+
+def test_single_commit(db, commits):
+    # the dream, its labels and its links are written in one transaction
+    instance = dict(DREAM, tags=[f'tag{i}' for i in range(10)])
+    idnum = db.DreamDAO.create(instance)
+    assert len(commits) == 1
+    assert sorted(db.DreamDAO.find_by_id(idnum)['tags']) == sorted(instance['tags'])
+
+    del commits[:]
+    assert db.DreamDAO.update(idnum, dict(instance, recit='walking', tags=['land'], drtype='normal'))
+    assert len(commits) == 1
+
+    del commits[:]
+    ids = db.DreamDAO.save_batch([dict(DREAM, title='other', tags=['new']),
+                                  dict(instance, id=idnum, tags=['sea'])])
+    assert None not in ids
+    assert len(commits) == 1
+
+    # rolled back, nothing is committed
+    del commits[:]
+    assert db.DreamDAO.update(idnum, dict(DREAM, title='other')) is False
+    assert commits == []
@@ -0,0 +1,87 @@
+import datetime
+import os
+
+import pytest
+
+from dream_dtb import formats
+
+DREAMS = [
+    {'id': 1, 'title': 'Flying over the sea', 'date': datetime.date(2017, 3, 21),
+     'recit': 'I was flying above a blue ocean.\n\n---\n\nthen "whales", commas, and a\nnew line',
+     'tags': ['sea', 'whales'], 'drtype': 'lucid'},
+    {'id': 2, 'title': 'No tags', 'date': datetime.date(2017, 3, 22),
+     'recit': 'rêve ☁', 'tags': [], 'drtype': 'normal'},
+    {'id': 3, 'title': 'Empty', 'date': datetime.date(2018, 1, 1),
+     'recit': '', 'tags': ['one'], 'drtype': ''},
+]
+
+
+def without_id(instances):
+    return [{key: value for key, value in inst.items() if key != 'id'} for inst in instances]
+
+
+@pytest.mark.parametrize('fmt, ext', [('jsonl', '.jsonl'), ('csv', '.csv'), ('markdown', '.md')])
+def test_round_trip(tmp_path, fmt, ext):
+    path = str(tmp_path / f'journal{ext}')
+    with open(path, 'w', encoding='utf-8', newline='' if fmt == 'csv' else None) as stream:
+        formats.write(stream, DREAMS, fmt)
+    assert list(formats.read(path)) == without_id(DREAMS)
+
+
+def test_markdown_files(tmp_path):
+    directory = str(tmp_path / 'dreams')
+    assert formats.write_markdown_files(directory, DREAMS) == len(DREAMS)
+    assert sorted(os.listdir(directory))[0] == '2017-03-21-flying-over-the-sea-1.md'
+    assert list(formats.read(directory)) == without_id(DREAMS)
+
+
+def test_guess_format(tmp_path):
+    assert formats.guess_format('dreams.JSON') == 'jsonl'
+    assert formats.guess_format(str(tmp_path)) == 'markdown'
+    with pytest.raises(formats.FormatError):
+        formats.guess_format('dreams.txt')
+
+
+def test_make_instance():
+    instance = formats.make_instance({'title': ' title ', 'date': '2017-3-1', 'body': 'text',
+                                      'type': ' lucid ', 'tags': 'a, b,,a'}, 'here')
+    assert instance == {'title': 'title', 'date': datetime.date(2017, 3, 1), 'recit': 'text',
+                        'tags': ['a', 'b'], 'drtype': 'lucid'}
+
+
+@pytest.mark.parametrize('fields', [
+    {'date': '2017-03-21'},
+    {'title': ' ', 'date': '2017-03-21'},
+    {'title': 'title'},
+    {'title': 'title', 'date': '2017-02-30'},
+    {'title': 'title', 'date': '21/03/2017'},
+    {'title': 12, 'date': '2017-03-21'},
+    {'title': ['title'], 'date': '2017-03-21'},
+    {'title': 'title', 'date': '2017-03-21', 'body': {'text': 'body'}},
+    {'title': 'title', 'date': '2017-03-21', 'type': 1},
+    {'title': 'title', 'date': '2017-03-21', 'tags': 3},
+    {'title': 'title', 'date': '2017-03-21', 'tags': ['a', None]},
+])
+def test_make_instance_errors(fields):
+    with pytest.raises(formats.FormatError, match='^here: '):
+        formats.make_instance(fields, 'here')
+
+
+def test_make_instance_missing():
+    instance = formats.make_instance({'title': 'title', 'date': '2017-03-21', 'body': None,
+                                      'type': None, 'tags': None}, 'here')
+    assert (instance['recit'], instance['drtype'], instance['tags']) == ('', '', [])
+
+
+def test_read_errors(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+    path.write_text('{"title": "ok", "date": "2017-03-21"}\n\nnot json\n')
+    with pytest.raises(formats.FormatError, match=':3: '):
+        list(formats.read(str(path)))
+    path.write_text('{"title": ["not", "a string"], "date": "2017-03-21"}\n')
+    with pytest.raises(formats.FormatError, match=':1: title must be a string'):
+        list(formats.read(str(path)))
+    path = tmp_path / 'journal.md'
+    path.write_text('no front matter\n')
+    with pytest.raises(formats.FormatError, match=':1: expected'):
+        list(formats.read(str(path)))
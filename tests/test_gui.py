@@ -0,0 +1,21 @@
+import os
+import py_compile
+
+import pytest
+
+PACKAGE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'dream_dtb')
+
+
+@pytest.mark.parametrize('module', ['gui', 'model'])
+def test_compile(tmp_path, module):
+    py_compile.compile(os.path.join(PACKAGE, f'{module}.py'), cfile=str(tmp_path / f'{module}.pyc'),
+                       doraise=True)
+
+
+def test_import():
+    pytest.importorskip('gi')
+    pytest.importorskip('neovim')
+    from dream_dtb import gui
+    from dream_dtb import model
+    assert gui.Controller
+    assert model.Model
@@ -0,0 +1,90 @@
+from collections import Counter
+
+import pytest
+
+from dream_dtb.importer import DuplicateError
+from dream_dtb.importer import Importer
+
+from conftest import make_dreams
+
+
+def test_create(db):
+    instances = make_dreams(30)
+    counts = Importer(batch_size=7).run(instances)
+    assert counts == Counter({'created': 30})
+    for idnum, instance in enumerate(instances, 1):
+        stored = db.DreamDAO.find_by_id(idnum)
+        assert dict(stored, tags=sorted(stored['tags'])) == dict(stored, **instance)
+    assert db.StatDAO.get_stats()['words']['total'] == sum(len(inst['recit'].split())
+                                                           for inst in instances)
+    assert db.DreamDAO.search('number 12')[0]['title'] == 'dream 12'
+
+
+@pytest.mark.parametrize('batch_size', [10, 3], ids=['same batch', 'next batch'])
+@pytest.mark.parametrize('on_duplicate, counts, recit', [
+    ('skip', {'created': 3, 'skipped': 2}, 'first'),
+    ('update', {'created': 3, 'updated': 1, 'unchanged': 1}, 'last'),
+])
+def test_duplicates_in_file(db, batch_size, on_duplicate, counts, recit):
+    instances = make_dreams(3)
+    instances[2] = dict(instances[2], recit='first')
+    # the copies of the third dream are in the same batch of 10, or in the
+    # next batch of 3
+    instances += [dict(instances[2]), dict(instances[2], recit='last')]
+    assert Importer(on_duplicate, batch_size).run(instances) == Counter(counts)
+    assert db.DreamDAO.find_by_id(3)['recit'] == recit
+    assert db.StatDAO.get_stats()['dreams'] == 3
+
+
+@pytest.mark.parametrize('batch_size', [10, 2], ids=['same batch', 'next batch'])
+def test_duplicates_in_file_fail(db, batch_size):
+    instances = make_dreams(2)
+    importer = Importer('fail', batch_size)
+    with pytest.raises(DuplicateError):
+        importer.run(instances + [dict(instances[1], recit='copy')])
+    # the batches before the duplicate are kept
+    assert db.StatDAO.get_stats()['dreams'] == (0 if batch_size == 10 else 2)
+
+
+def test_skip(db):
+    Importer().run(make_dreams(10))
+    changed = [dict(inst, recit='changed', tags=['other']) for inst in make_dreams(12)]
+    counts = Importer('skip').run(changed)
+    assert counts == Counter({'created': 2, 'skipped': 10})
+    assert db.DreamDAO.find_by_id(1)['recit'] != 'changed'
+    stored = db.DreamDAO.find_by_id(11)
+    assert (stored['title'], stored['recit'], stored['tags']) == ('dream 10', 'changed', ['other'])
+
+
+def test_update(db):
+    Importer().run(make_dreams(10))
+    changed = make_dreams(12)
+    changed[0] = dict(changed[0], recit='changed', tags=['other'], drtype='lucid')
+    changed[7] = dict(changed[7], tags=changed[7]['tags'][::-1])
+    changed[2] = dict(changed[2], drtype='')
+    counts = Importer('update').run(changed)
+    # the tags order does not matter
+    assert counts == Counter({'created': 2, 'updated': 2, 'unchanged': 8})
+    stored = db.DreamDAO.find_by_id(1)
+    assert (stored['recit'], stored['tags'], stored['drtype']) == ('changed', ['other'], 'lucid')
+    assert db.RevisionDAO.get(1, 1) == make_dreams(1)[0]['recit']
+    assert db.RevisionDAO.get(1, 2) == 'changed'
+    assert db.DreamDAO.search('changed')[0]['id'] == 1
+    assert db.RevisionDAO.history(2) == []
+    assert db.DreamDAO.find_by_id(3)['drtype'] == ''
+    assert db.DreamDAO.find_by_id(4)['updated'] == db.DreamDAO.find_by_id(4)['created']
+
+
+def test_fail(db):
+    Importer().run(make_dreams(5))
+    importer = Importer('fail', batch_size=5)
+    with pytest.raises(DuplicateError):
+        importer.run(make_dreams(20, first=make_dreams(6)[5]['date']) + make_dreams(1))
+    # the batches before the duplicate are kept
+    assert importer.counts == Counter({'created': 20})
+    assert db.StatDAO.get_stats()['dreams'] == 25
+
+
+def test_on_duplicate():
+    with pytest.raises(ValueError):
+        Importer('replace')
@@ -0,0 +1,67 @@
+"""
+Import time regression tests of the command line interface
+
+`import dream_dtb.cli` and `dreamdtb help` run in a subprocess: they must not
+import a heavy module (gtk, neovim, sqlalchemy, ...). The import time of the
+dream_dtb modules themselves, measured with -X importtime, must stay small
+next to the one of click: a ratio does not depend on the speed of the machine
+as an absolute budget would.
+"""
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HELP = ['-m', 'dream_dtb.cli', 'help']
+# modules that must not be imported by `dreamdtb help`
+FORBIDDEN = ['gi', 'neovim', 'pandas', 'numpy', 'sqlalchemy', 'sqlalchemy_utils',
+             'configparser', 'logging.config', 'tempfile', 'uuid']
+# allowed self import time of the dream_dtb modules, relative to the
+# cumulative import time of click
+BUDGET = 0.25
+RUNS = 5
+
+
+def python(args, **kwargs):
+    return subprocess.run([sys.executable, *args], cwd=ROOT, check=True,
+                          stdout=subprocess.PIPE, universal_newlines=True, **kwargs)
+
+
+def import_times(args):
+    """ Return {module: (self us, cumulative us)} of the modules imported by
+    python args
+    """
+    proc = python(['-X', 'importtime', *args], stderr=subprocess.PIPE)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if line.startswith('import time:') and not line.endswith('| imported package'):
+            own, cumulative, name = line[len('import time:'):].split('|')
+            times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+
+def test_no_heavy_imports():
+    modules = import_times(HELP)
+    assert {'dream_dtb', 'click'} <= set(modules)
+    heavy = {name for name in modules
+             if name in FORBIDDEN or name.split('.')[0] in FORBIDDEN}
+    assert heavy == set()
+
+
+def test_cli_module():
+    # the modules of the gui and of the database are imported by the
+    # commands using them
+    code = ('import sys, dream_dtb.cli; '
+            'print(" ".join(name for name in ("sqlalchemy", "sqlalchemy.orm", "gi", "neovim", '
+            '"dream_dtb.db", "dream_dtb.gui") if name in sys.modules))')
+    assert python(['-c', code]).stdout.split() == []
+
+
+def test_startup_time():
+    ratios = []
+    for _ in range(RUNS):
+        times = import_times(HELP)
+        own = sum(own for name, (own, _) in times.items()
+                  if name.split('.')[0] == 'dream_dtb')
+        ratios.append(own / times['click'][1])
+    assert min(ratios) < BUDGET
@@ -0,0 +1,26 @@
+from sqlalchemy import event
+
+from dream_dtb import config
+from dream_dtb import instrument
+
+
+def test_off_by_default(db):
+    assert not config.PROFILE_TRACE and not config.SLOW_QUERY
+    assert not event.contains(db.Engine, 'after_cursor_execute', instrument._after_execute)
+    assert not hasattr(db.DreamDAO.find_by_id, '__wrapped__')
+
+
+def test_report():
+    records = [{'type': 'call', 'name': 'DreamDAO.update', 'depth': 0, 'ms': ms,
+                'statements': 4, 'sql_ms': ms / 2} for ms in (1, 2, 3, 40)]
+    records += [{'type': 'call', 'name': 'DreamDAO.find_by_id', 'depth': 1, 'ms': 0.2,
+                 'statements': 1, 'sql_ms': 0.1},
+                {'type': 'slow', 'name': None, 'ms': 150, 'sql': 'SELECT 1', 'plan': []}]
+    summary = instrument.report(records)
+    assert list(summary) == ['DreamDAO.update']
+    update = summary['DreamDAO.update']
+    assert (update['calls'], update['total'], update['max'], update['statements']) == (4, 46, 40, 4)
+    assert update['p50'] == 3 and update['sql'] == 23
+    assert sum(update['histogram']) == 4
+    assert update['histogram'][instrument.BUCKETS.index(50)] == 1
+    assert list(instrument.report(records, nested=True)) == ['DreamDAO.update', 'DreamDAO.find_by_id']
@@ -0,0 +1,66 @@
+import sqlite3
+
+import pytest
+
+from sqlalchemy import create_engine
+from sqlalchemy import event
+
+from dream_dtb import compression
+from dream_dtb import migrations
+
+
+def engine_at(path, version, dreams=()):
+    """ Return an engine on a database at schema version with dreams
+    (title, date, recit) inserted. At version 0 the database has the tables
+    of dream-dtb 0.1, created before the migrations existed.
+    """
+    conn = sqlite3.connect(path)
+    compression.register(conn, path)
+    for migration in migrations.MIGRATIONS[:version or 1]:
+        migration(conn)
+    conn.execute(f'PRAGMA user_version = {version}')
+    conn.executemany("INSERT INTO dream (title, date, recit, created, updated) "
+                     "VALUES (?, ?, ?, '2000-01-01 00:00:00.000000', '2000-01-01 00:00:00.000000')",
+                     dreams)
+    conn.commit()
+    conn.close()
+    engine = create_engine(f'sqlite:///{path}')
+    event.listen(engine, 'connect',
+                 lambda dbapi_connection, record: compression.register(dbapi_connection, path))
+    return engine
+
+
+def test_migrate(tmp_path):
+    dreams = [('first', '2000-01-01', 'one two  three\nfour'), ('empty', '2000-01-02', None)]
+    engine = engine_at(str(tmp_path / 'dream.db'), 0, dreams)
+    assert migrations.migrate(engine) == migrations.SCHEMA_VERSION
+    assert migrations.migrate(engine) == 0
+    with engine.connect() as conn:
+        assert conn.execute('SELECT id, words FROM dreamstat ORDER BY id').fetchall() == [(1, 4), (2, 0)]
+        assert conn.execute("SELECT rowid FROM dream_fts WHERE dream_fts MATCH 'three'").fetchall() == [(1,)]
+        assert conn.execute('PRAGMA user_version').scalar() == migrations.SCHEMA_VERSION
+
+    # the bodies are stored as text: no sql function is needed to write
+    conn = sqlite3.connect(str(tmp_path / 'dream.db'))
+    with conn:
+        conn.execute("UPDATE dream SET title = 'renamed', recit = 'five' WHERE id = 1")
+        conn.execute('DELETE FROM dream WHERE id = 2')
+        assert conn.execute("SELECT rowid FROM dream_fts WHERE dream_fts MATCH 'five'").fetchall() == [(1,)]
+    conn.close()
+
+
+def test_migrate_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(migrations, 'BATCH_SIZE', 3)
+    dreams = [(f'dream {i}', '2000-01-01', 'word ' * i) for i in range(10)]
+    engine = engine_at(str(tmp_path / 'dream.db'), 2, dreams)
+    migrations.migrate(engine)
+    with engine.connect() as conn:
+        assert conn.execute('SELECT words FROM dreamstat ORDER BY id').fetchall() == [(i,) for i in range(10)]
+
+
+def test_newer_schema(tmp_path):
+    engine = engine_at(str(tmp_path / 'dream.db'), migrations.SCHEMA_VERSION)
+    with engine.connect() as conn:
+        conn.execute(f'PRAGMA user_version = {migrations.SCHEMA_VERSION + 1}')
+    with pytest.raises(RuntimeError, match='newer'):
+        migrations.migrate(engine)
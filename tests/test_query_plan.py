@@ -0,0 +1,161 @@
+"""
+Query plan regression tests of the hot DAO queries
+
+The DAO methods used by the gui, the cli and the web server are run against a
+small journal. Every SELECT, UPDATE and DELETE they issue is captured and
+explained with EXPLAIN QUERY PLAN: a table scanned without an index fails the
+test. Scans of a whole index (e.g. the navigation tree walking
+ix_dream_date_created), of the full text index and of common table
+expressions are accepted.
+"""
+import datetime
+import re
+
+import pytest
+from sqlalchemy import event
+
+NBDREAMS = 300
+# a table scanned without index, e.g. "SCAN tags" (sqlite >= 3.36) or
+# "SCAN TABLE tags AS tags_1" (older versions)
+FULL_SCAN = re.compile(r'^SCAN (TABLE )?(\w+)( AS \w+)?$')
+
+
+def find_by_id(db):
+    db.DreamDAO.find_by_id(NBDREAMS // 2)
+
+
+def update(db):
+    instance = db.DreamDAO.find_by_id(NBDREAMS // 2)
+    db.DreamDAO.update(instance['id'], dict(instance, recit='edited', tags=['tag1', 'new'],
+                                            drtype='normal'))
+
+
+def history(db):
+    db.RevisionDAO.history(NBDREAMS // 2)
+    db.RevisionDAO.restore(NBDREAMS // 2, 1)
+
+
+def create(db):
+    db.DreamDAO.create({'title': 'new dream', 'date': datetime.date(2001, 1, 1),
+                        'recit': 'text', 'tags': ['tag2'], 'drtype': 'lucid'})
+
+
+def get_tree_ids(db):
+    db.DreamDAO.get_tree([1, 2, 3])
+
+
+def get_tree(db):
+    db.DreamDAO.get_tree()
+
+
+def get_years(db):
+    db.DreamDAO.get_years()
+
+
+def get_months(db):
+    db.DreamDAO.get_months('2000')
+
+
+def get_days(db):
+    db.DreamDAO.get_days('2000', '02')
+
+
+def get_dreams(db):
+    db.DreamDAO.get_dreams('2000', '02', '03')
+
+
+def search(db):
+    db.DreamDAO.search('sea number')
+
+
+def tag_dreams(db):
+    with db.session_scope() as session:
+        tag = session.query(db.Tag).filter(db.Tag.label == 'tag3').one()
+        tag.dreams.all()
+
+
+def tag_find(db):
+    db.TagDAO.find(['tag1', 'tag2']).all()
+
+
+def export_tags(db):
+    from dream_dtb.exporter import iter_dreams
+    list(iter_dreams(datetime.date(2000, 2, 1), datetime.date(2000, 3, 1), ['tag4']))
+
+
+def browse(db):
+    from dream_dtb import web
+    pool = web.ReadPool(size=1)
+    page, cursor = pool.run(web.list_dreams, 20)
+    pool.run(web.list_dreams, 20, web.decode_cursor(cursor))
+    pool.run(web.get_dream, 10)
+    pool.close()
+
+
+HOT_QUERIES = [find_by_id, update, history, create, get_tree_ids, get_tree, get_years,
+               get_months, get_days, get_dreams, search, tag_dreams, tag_find, export_tags,
+               browse]
+
+
+@pytest.fixture(scope='module')
+def populated():
+    from dream_dtb import db
+    from dream_dtb.importer import Importer
+    from conftest import TABLES, make_dreams
+
+    with db.Engine.begin() as conn:
+        for table in TABLES:
+            conn.execute(f'DELETE FROM {table}')
+    Importer().run(make_dreams(NBDREAMS))
+    return db
+
+
+@pytest.fixture
+def statements(populated, monkeypatch):
+    """ Capture the statements run through the engine and by the read-only
+    connections of the web server, as (sql, parameters)
+    """
+    from dream_dtb import web
+
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(('SELECT', 'WITH', 'UPDATE', 'DELETE')):
+            captured.append((statement, parameters))
+
+    # the read-only pool of the web server does not go through the engine
+    connect = web.sqlite3.connect
+
+    def traced_connect(*args, **kwargs):
+        conn = connect(*args, **kwargs)
+        conn.set_trace_callback(lambda sql: sql.lstrip().upper().startswith('SELECT')
+                                and captured.append((sql, ())))
+        return conn
+
+    monkeypatch.setattr(web.sqlite3, 'connect', traced_connect)
+    event.listen(populated.Engine, 'before_cursor_execute', capture)
+    yield captured
+    event.remove(populated.Engine, 'before_cursor_execute', capture)
+
+
+def full_scans(engine, statements):
+    """ Return the (table, statement) of the tables scanned without index """
+    scans = set()
+    for statement, parameters in statements:
+        with engine.connect() as conn:
+            tables = {name for name, in conn.execute("SELECT name FROM sqlite_master")}
+            plan = conn.execute('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+        for row in plan:
+            match = FULL_SCAN.match(row[-1])
+            # the rows of a common table expression are not in the database
+            if match and match.group(2) in tables:
+                scans.add((match.group(2), ' '.join(statement.split())))
+    return scans
+
+
+@pytest.mark.parametrize('hot_query', HOT_QUERIES, ids=lambda func: func.__name__)
+def test_indexes_used(populated, statements, hot_query):
+    hot_query(populated)
+    captured = list(statements)
+    assert captured
+    assert full_scans(populated.Engine, captured) == set()
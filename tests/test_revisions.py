@@ -0,0 +1,71 @@
+import datetime
+import json
+import zlib
+
+from dream_dtb import revisions
+
+OLD = 'I was flying.\nThe sea was blue.\nI woke up.\n'
+NEW = 'I was flying.\nThe sea was green.\nI woke up.\nThe end.\n'
+# revisions written by dream-dtb, they must stay readable
+STORED_SNAPSHOT = bytes.fromhex('78daf354284f2c5648cba9cccc4bd7e3020023630496')
+STORED_DELTA = bytes.fromhex('78da8b8e36d0318cd5510ac94855284e4d54284f2c56482f4a4dcdd38bc953'
+                             'd28936d231864aa6e6a58084620170940ed1')
+
+
+def test_delta_encoding():
+    ops = json.loads(zlib.decompress(revisions.delta(OLD, NEW)))
+    assert ops == [[0, 1], 'The sea was green.\n', [2, 3], 'The end.\n']
+
+
+def test_stored_revisions_readable():
+    assert revisions.rebuild([(True, STORED_SNAPSHOT)]) == 'I was flying.\n'
+    assert revisions.patch(OLD, STORED_DELTA) == NEW
+
+
+def test_patch_round_trip():
+    texts = ['', 'one line', 'a\nb\nc', 'a\nb\nc\n', 'c\nb\na\n', None, 'no newline\r\nat end']
+    for old in texts:
+        for new in texts:
+            assert revisions.patch(old, revisions.delta(old, new)) == (new or '')
+
+
+def test_rebuild():
+    versions = [f'line {i}\n' * i + 'end\n' for i in range(5)]
+    rows = [(True, revisions.snapshot(versions[0]))]
+    rows += [(False, revisions.delta(old, new)) for old, new in zip(versions, versions[1:])]
+    for number in range(len(versions)):
+        assert revisions.rebuild(rows[:number + 1]) == versions[number]
+
+
+def test_history(db):
+    idnum = db.DreamDAO.create({'title': 'edited', 'date': datetime.date(2000, 1, 1),
+                                'recit': 'version 0', 'tags': [], 'drtype': 'normal'})
+    assert db.RevisionDAO.history(idnum) == []
+    count = db.RevisionDAO.SNAPSHOT_INTERVAL + 4
+    instance = db.DreamDAO.find_by_id(idnum)
+    for version in range(1, count):
+        instance['recit'] = 'a long enough first line to be worth a delta\n' * 20 + f'version {version}'
+        assert db.DreamDAO.update(idnum, instance)
+
+    history = db.RevisionDAO.history(idnum)
+    assert [revision['number'] for revision in history] == list(range(1, count + 1))
+    snapshots = [revision['number'] for revision in history if revision['snapshot']]
+    assert snapshots[0] == 1
+    assert all(later - earlier <= db.RevisionDAO.SNAPSHOT_INTERVAL
+               for earlier, later in zip(snapshots, snapshots[1:]))
+    assert db.RevisionDAO.get(idnum, 1) == 'version 0'
+    assert db.RevisionDAO.get(idnum, count).endswith(f'version {count - 1}')
+    assert db.RevisionDAO.get(idnum, count + 1) is None
+
+
+def test_restore(db):
+    idnum = db.DreamDAO.create({'title': 'restored', 'date': datetime.date(2000, 1, 1),
+                                'recit': 'first', 'tags': ['tag'], 'drtype': 'lucid'})
+    instance = db.DreamDAO.find_by_id(idnum)
+    db.DreamDAO.update(idnum, dict(instance, recit='second'))
+    assert db.RevisionDAO.restore(idnum, 1) is True
+    restored = db.DreamDAO.find_by_id(idnum)
+    assert restored['recit'] == 'first'
+    assert restored['tags'] == ['tag'] and restored['drtype'] == 'lucid'
+    assert db.RevisionDAO.restore(idnum, 1) is False
+    assert db.RevisionDAO.restore(idnum, 10) is None
@@ -0,0 +1,32 @@
+import pytest
+
+
+def test_search(journal, db):
+    journal(20)
+    # the last word is a prefix
+    results = db.DreamDAO.search('number 1', limit=50)
+    assert sorted(result['id'] for result in results) == [2] + list(range(11, 21))
+    assert len(db.DreamDAO.search('sea numb', limit=50)) == 20
+    assert db.DreamDAO.search('numb 1') == []
+    assert db.DreamDAO.search('  ') == []
+    assert db.DreamDAO.search('"AND"') == []
+
+
+def test_search_snippet(journal, db):
+    journal(5)
+    result, = db.DreamDAO.search('number 3', start='<', end='>')
+    assert '<number> <3>' in result['snippet']
+
+
+def test_search_raw(journal, db):
+    journal(20)
+    results = db.DreamDAO.search('sea NOT number', raw=True)
+    assert results == []
+    results = db.DreamDAO.search('recit:(number 1*) NOT title:"dream 1"', raw=True, limit=50)
+    assert sorted(result['id'] for result in results) == list(range(11, 21))
+
+
+@pytest.mark.parametrize('query', ['AND', 'unknown:column', '"unterminated', 'NEAR('])
+def test_search_raw_invalid(db, query):
+    with pytest.raises(ValueError, match='invalid search query'):
+        db.DreamDAO.search(query, raw=True)
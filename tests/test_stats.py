@@ -0,0 +1,95 @@
+import datetime
+import sqlite3
+from collections import OrderedDict
+
+from dream_dtb.importer import Importer
+
+from conftest import make_dreams
+
+
+def aggregates(db):
+    """ Return the statistics of get_stats that are read from the dream
+    counts, recomputed by aggregate queries over the dreams
+    """
+    with db.Engine.connect() as conn:
+        def group(key):
+            rows = conn.execute(f'SELECT {key}, COUNT(*) FROM dream GROUP BY 1 ORDER BY 1')
+            return OrderedDict(rows.fetchall())
+
+        def labels(table, link, column):
+            return OrderedDict(conn.execute(f"""SELECT {table}.label, COUNT(*) FROM {link}
+                JOIN {table} ON {table}.id = {link}.{column}
+                GROUP BY {table}.label ORDER BY COUNT(*) DESC, {table}.label""").fetchall())
+        count = conn.execute('SELECT COUNT(*) FROM dream').scalar()
+        words = conn.execute('SELECT coalesce(SUM(words), 0), MAX(words) FROM dreamstat '
+                             'WHERE id IN (SELECT id FROM dream)').first()
+        weekdays = group("strftime('%w', date)")
+        return {'dreams': count,
+                'years': group("strftime('%Y', date)"),
+                'months': group("strftime('%m', date)"),
+                'weekdays': OrderedDict((db.StatDAO.WEEKDAYS[day], weekdays.get(str(day), 0))
+                                        for day in [1, 2, 3, 4, 5, 6, 0]),
+                'tags': labels('tag', 'tags', 'tag_id'),
+                'types': labels('dreamtype', 'drtype', 'type_id'),
+                'words': {'total': words[0],
+                          'mean': round(words[0] / count, 1) if count else 0,
+                          'max': words[1] or 0}}
+
+
+def check(db):
+    expected = aggregates(db)
+    stats = db.StatDAO.get_stats()
+    assert {key: stats[key] for key in expected} == expected
+    return stats
+
+
+def test_empty(db):
+    stats = check(db)
+    assert stats['dreams'] == 0
+    assert stats['first'] is None
+
+
+def test_writes(db):
+    instances = make_dreams(12)
+    ids = [db.DreamDAO.create(instance) for instance in instances]
+    stats = check(db)
+    assert stats['dreams'] == 12
+    assert stats['types'] == OrderedDict([('lucid', 8), ('normal', 4)])
+
+    # date moved to another year, month and weekday, other tags and type
+    moved = dict(instances[0], date=datetime.date(2003, 7, 9), tags=['new'], drtype='normal',
+                 recit='a much longer body than before ' * 3)
+    assert db.DreamDAO.update(ids[0], moved) is True
+    stats = check(db)
+    assert stats['years'] == OrderedDict([('2000', 11), ('2003', 1)])
+    assert stats['tags']['new'] == 1
+
+    db.DreamDAO.save_batch([dict(instances[1], id=ids[1], tags=[], drtype='')])
+    check(db)
+
+
+def test_plain_connection(db):
+    # the counts are maintained by triggers, for any connection
+    ids = [db.DreamDAO.create(instance) for instance in make_dreams(5)]
+    conn = sqlite3.connect(db.Engine.url.database)
+    with conn:
+        conn.execute("UPDATE dream SET date = '1999-12-31' WHERE id = ?", (ids[0],))
+        conn.execute('DELETE FROM tags WHERE dream_id = ?', (ids[1],))
+        conn.execute('DELETE FROM drtype WHERE dream_id = ?', (ids[1],))
+        conn.execute('DELETE FROM dream WHERE id = ?', (ids[1],))
+    conn.close()
+    stats = check(db)
+    assert stats['dreams'] == 4
+    assert list(stats['years']) == ['1999', '2000']
+
+
+def test_import(db):
+    Importer(batch_size=7).run(make_dreams(30))
+    check(db)
+    # duplicates rewritten with other tags, types and bodies
+    instances = [dict(instance, tags=['other'], drtype='dream', recit='short')
+                 for instance in make_dreams(10)]
+    Importer('update', batch_size=4).run(instances + make_dreams(40)[30:])
+    stats = check(db)
+    assert stats['dreams'] == 40
+    assert stats['types']['dream'] == 10
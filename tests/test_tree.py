@@ -0,0 +1,65 @@
+import datetime
+
+import pytest
+
+from dream_dtb.importer import Importer
+
+from conftest import make_dreams
+
+
+def test_get_years(db):
+    assert db.DreamDAO.get_years() == {}
+    # 1999-12-31 to 2000-01-03, then a gap of two years
+    Importer().run(make_dreams(8, first=datetime.date(1999, 12, 31))
+                   + make_dreams(3, first=datetime.date(2003, 12, 31))
+                   + make_dreams(1, first=datetime.date(987, 6, 1)))
+    years = db.DreamDAO.get_years()
+    assert list(years.items()) == [('0987', 1), ('1999', 2), ('2000', 6), ('2003', 2),
+                                   ('2004', 1)]
+    assert sum(db.DreamDAO.get_months('2000').values()) == 6
+
+
+@pytest.fixture
+def changes(db):
+    """ The TreeChange lists sent to the tree listeners """
+    received = []
+    db.tree_listeners.append(received.append)
+    yield received
+    db.tree_listeners.remove(received.append)
+
+
+def test_tree_changes(db, changes):
+    day = datetime.date(2000, 1, 1)
+    instance = {'title': 'dream', 'date': day, 'recit': 'flying', 'tags': ['sea'], 'drtype': 'lucid'}
+    idnum = db.DreamDAO.create(instance)
+    assert changes == [[db.TreeChange('insert', idnum, 'dream', None, day)]]
+
+    # a body, tags or type change does not move the dream in the tree
+    del changes[:]
+    db.DreamDAO.update(idnum, dict(instance, recit='walking', tags=['land'], drtype='normal'))
+    assert changes == []
+
+    db.DreamDAO.update(idnum, dict(instance, title='renamed'))
+    assert changes == [[db.TreeChange('update', idnum, 'renamed', day, day)]]
+
+    del changes[:]
+    moved = datetime.date(2001, 2, 3)
+    db.DreamDAO.update(idnum, dict(instance, title='renamed', date=moved))
+    assert changes == [[db.TreeChange('update', idnum, 'renamed', day, moved)]]
+
+    # the changes of a rolled back transaction are not sent
+    del changes[:]
+    other = db.DreamDAO.create(dict(instance, title='other', date=moved))
+    del changes[:]
+    assert db.DreamDAO.update(other, dict(instance, title='renamed', date=moved)) is False
+    assert changes == []
+
+    with db.session_scope() as session:
+        session.delete(session.query(db.Dream).get(idnum))
+    assert changes == [[db.TreeChange('delete', idnum, 'renamed', moved, None)]]
+
+    # one list per transaction
+    del changes[:]
+    ids = db.DreamDAO.save_batch([dict(instance, title=f'batch {i}') for i in range(3)])
+    assert changes == [[db.TreeChange('insert', idnum, f'batch {i}', None, day)
+                        for i, idnum in enumerate(ids)]]
@@ -0,0 +1,83 @@
+import asyncio
+import datetime
+import email.utils
+import json
+
+import pytest
+
+from dream_dtb import web
+
+
+@pytest.fixture
+def server(journal):
+    journal(45)
+    server = web.DreamServer(web.ReadPool(size=2))
+    yield server
+    server.close()
+
+
+def get(server, target, headers=None):
+    return asyncio.run(server.dispatch(target, headers or {}))
+
+
+def test_keyset_pagination(db, server):
+    pages = []
+    target = '/api/dreams?limit=10'
+    while target:
+        response = get(server, target)
+        assert response.status == 200
+        page = json.loads(response.body)
+        pages.append([dream['id'] for dream in page['dreams']])
+        target = page['next'] and f"/api/dreams?limit=10&after={page['next']}"
+    assert [len(page) for page in pages] == [10, 10, 10, 10, 5]
+    # most recent first: two dreams a day, the latest created first
+    ids = [idnum for page in pages for idnum in page]
+    assert ids == sorted(range(1, 46), key=lambda idnum: (-((idnum - 1) // 2), -idnum))
+
+
+def test_pagination_stable(db, server):
+    first = json.loads(get(server, '/api/dreams?limit=10').body)
+    # a dream added before the cursor does not shift the next page
+    db.DreamDAO.create({'title': 'newest', 'date': datetime.date(2100, 1, 1),
+                        'recit': '', 'tags': [], 'drtype': ''})
+    second = json.loads(get(server, f"/api/dreams?limit=10&after={first['next']}").body)
+    assert second['dreams'][0]['id'] == first['dreams'][-1]['id'] - 1
+
+
+@pytest.mark.parametrize('target', ['/api/dreams?limit=0', '/api/dreams?after=bogus',
+                                    '/api/dreams?limit=x'])
+def test_bad_request(server, target):
+    assert get(server, target).status == 400
+
+
+def test_etag(db, server):
+    response = get(server, '/api/dreams/3')
+    assert response.status == 200
+    dream = json.loads(response.body)
+    assert (dream['title'], dream['tags'], dream['drtype']) == ('dream 2', ['tag2'], 'lucid')
+    tag = response.headers['ETag']
+    modified = response.headers['Last-Modified']
+    assert get(server, '/api/dreams/3', {'if-none-match': tag}).status == 304
+    assert get(server, '/api/dreams/3', {'if-none-match': f'"other", {tag}'}).status == 304
+    assert get(server, '/dreams/3', {'if-modified-since': modified}).status == 304
+    assert get(server, '/api/dreams/3', {'if-none-match': '"other"'}).status == 200
+
+    instance = db.DreamDAO.find_by_id(3)
+    db.DreamDAO.update(3, dict(instance, recit='changed'))
+    response = get(server, '/api/dreams/3', {'if-none-match': tag})
+    assert response.status == 200
+    assert response.headers['ETag'] != tag
+    assert json.loads(response.body)['recit'] == 'changed'
+
+
+def test_if_modified_since(server):
+    response = get(server, '/dreams/3')
+    modified = email.utils.parsedate_to_datetime(response.headers['Last-Modified'])
+    earlier = email.utils.format_datetime(modified.replace(year=modified.year - 1), usegmt=True)
+    assert get(server, '/dreams/3', {'if-modified-since': earlier}).status == 200
+    assert get(server, '/dreams/3', {'if-modified-since': 'not a date'}).status == 200
+
+
+def test_not_found(server):
+    assert get(server, '/api/dreams/1000').status == 404
+    assert get(server, '/nowhere').status == 404